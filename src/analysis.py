@@ -0,0 +1,229 @@
+"""
+Quick looks at captured frames (histogram, star count and half flux radius, and
+a thumbnail), computed in a pool of low priority worker processes so that they
+can keep up with a stack as it's captured.
+
+Frames are read with astropy (FITS), Pillow (JPEG, PNG, TIFF) or rawpy (camera
+RAW).  Pillow and rawpy are optional (`poetry install --with analysis`):
+without them, those frames can't be analyzed (see missing_reader).
+"""
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+import importlib.util
+import math
+import multiprocessing as mp
+import os
+import struct
+import zlib
+
+import numpy as np
+import trio
+
+HISTOGRAM_BINS = 64
+# Longest side of what's analyzed (frames are binned down to it) and of
+# thumbnails.
+ANALYSIS_SIZE = 1024
+THUMBNAIL_SIZE = 320
+# Stars are local maxima this many noise sigmas above the background.
+STAR_SIGMA = 5.0
+MAX_STARS = 200
+# Half flux radius is measured (at full resolution, within this radius) on the
+# brightest stars.
+HFR_STARS = 50
+HFR_RADIUS = 12
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+RAW_EXTENSIONS = (".cr2", ".cr3", ".nef", ".arw", ".dng")
+# Extensions, and the module (and package) they're read with
+_OPTIONAL_READERS = [
+    (IMAGE_EXTENSIONS, "PIL", "Pillow"),
+    (RAW_EXTENSIONS, "rawpy", "rawpy"),
+]
+
+
+def load_image(path: str) -> np.ndarray:
+    """Reads a frame as a 2D (luminance) float array"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in FITS_EXTENSIONS:
+        from astropy.io import fits
+
+        data = np.asarray(fits.getdata(path), dtype=np.float64)
+        # Colour planes first, in FITS
+        return data.mean(axis=0) if data.ndim == 3 else data
+    if ext in IMAGE_EXTENSIONS:
+        from PIL import Image
+
+        with Image.open(path) as image:
+            return np.asarray(image.convert("L"), dtype=np.float64)
+    if ext in RAW_EXTENSIONS:
+        import rawpy
+
+        with rawpy.imread(path) as raw:
+            bayer = np.asarray(raw.raw_image_visible, dtype=np.float64)
+        # Each 2x2 block of the Bayer pattern, summed, is a (half size)
+        # luminance pixel.
+        return _bin(bayer, 2) * 4
+    if ext == ".npy":
+        return np.asarray(np.load(path), dtype=np.float64)
+    raise ValueError(f"don't know how to read {ext} files")
+
+
+def missing_reader(path: str) -> str | None:
+    """
+    The package needed to read the frame at path, if it isn't installed (None
+    if it is, or none is needed)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    for extensions, module, package in _OPTIONAL_READERS:
+        if ext in extensions and importlib.util.find_spec(module) is None:
+            return package
+    return None
+
+
+def analyze_frame(path: str, thumbnail: str | None = None) -> dict:
+    """
+    Returns the histogram, background, noise and stars of the frame at path,
+    and writes a thumbnail (PNG) of it to `thumbnail`, if given.
+    """
+    full = load_image(path)
+    factor = max(1, math.ceil(max(full.shape) / ANALYSIS_SIZE))
+    image = _bin(full, factor)
+
+    peak = float(image.max()) or 1.0
+    counts, _ = np.histogram(image, bins=HISTOGRAM_BINS, range=(0, peak))
+
+    background = float(np.median(image))
+    noise = 1.4826 * float(np.median(np.abs(image - background)))
+    stars = _find_stars(image, background, noise)
+    hfrs = [_hfr(full, background, y, x, factor) for y, x in stars[:HFR_STARS]]
+    hfrs = [h for h in hfrs if h is not None]
+
+    if thumbnail is not None:
+        _write_png(thumbnail, _stretch(_bin(image, _thumb_factor(image))))
+
+    return {
+        "histogram": counts.tolist(),
+        "histogram_max": peak,
+        "background": background,
+        "noise": noise,
+        "saturated": float(np.mean(image >= 0.98 * peak)),
+        "stars": len(stars),
+        # In pixels
+        "hfr": float(np.median(hfrs)) if hfrs else None,
+        "thumbnail": thumbnail,
+    }
+
+
+class FrameAnalyzer:
+    """
+    Runs analyze_frame in `workers` processes, at low priority so that they
+    don't take time from stepping (or capturing).
+    """
+
+    _pool: ProcessPoolExecutor
+    _limiter: trio.CapacityLimiter
+
+    def __init__(self, workers: int = 1, nice: int = 19):
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            # Not forked: the parent has threads (and a trio loop) running.
+            mp_context=mp.get_context("spawn"),
+            initializer=os.nice,
+            initargs=(nice,),
+        )
+        self._limiter = trio.CapacityLimiter(workers)
+
+    async def analyze(self, path: str, thumbnail: str | None = None) -> dict:
+        future = self._pool.submit(analyze_frame, path, thumbnail)
+        try:
+            return await trio.to_thread.run_sync(future.result, limiter=self._limiter)
+        finally:
+            future.cancel()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def thumbnail_path(path: str):
+    return os.path.splitext(path)[0] + "-thumb.png"
+
+
+def _bin(image: np.ndarray, factor: int):
+    """Averages factor x factor blocks (dropping any partial ones)"""
+    if factor == 1:
+        return image
+    h = image.shape[0] // factor * factor
+    w = image.shape[1] // factor * factor
+    return image[:h, :w].reshape(h // factor, factor, w // factor, factor).mean((1, 3))
+
+
+def _thumb_factor(image: np.ndarray):
+    return max(1, math.ceil(max(image.shape) / THUMBNAIL_SIZE))
+
+
+def _find_stars(image: np.ndarray, background: float, noise: float):
+    """(y, x) of the brightest local maxima well above the background"""
+    threshold = background + STAR_SIGMA * max(noise, 1e-9)
+    r = 1
+    core = image[r:-r, r:-r]
+    # Greater than or equal to all eight neighbours
+    peak = core > threshold
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy or dx:
+                shifted = image[
+                    r + dy : image.shape[0] - r + dy, r + dx : image.shape[1] - r + dx
+                ]
+                peak &= core >= shifted
+
+    ys, xs = np.nonzero(peak)
+    order = np.argsort(core[ys, xs])[::-1][:MAX_STARS]
+    return [(int(ys[i]) + r, int(xs[i]) + r) for i in order]
+
+
+def _hfr(full: np.ndarray, background: float, y: int, x: int, factor: int):
+    """
+    Flux weighted mean distance from the peak of the star at (y, x) (in pixels
+    binned by factor), within HFR_RADIUS
+    """
+    block = full[y * factor : (y + 1) * factor, x * factor : (x + 1) * factor]
+    by, bx = np.unravel_index(np.argmax(block), block.shape)
+    y, x = y * factor + int(by), x * factor + int(bx)
+
+    r = HFR_RADIUS
+    if y < r or x < r or y + r >= full.shape[0] or x + r >= full.shape[1]:
+        return None
+    cutout = np.clip(full[y - r : y + r + 1, x - r : x + r + 1] - background, 0, None)
+    dy, dx = np.mgrid[-r : r + 1, -r : r + 1]
+    distance = np.hypot(dy, dx)
+    cutout[distance > r] = 0
+    flux = cutout.sum()
+    if flux <= 0:
+        return None
+    return float((cutout * distance).sum() / flux)
+
+
+def _stretch(image: np.ndarray) -> np.ndarray:
+    """8-bit, with an asinh stretch between low and high percentiles"""
+    low, high = np.percentile(image, (0.5, 99.8))
+    scaled = np.clip((image - low) / max(high - low, 1e-9), 0, 1)
+    return (np.arcsinh(10 * scaled) / np.arcsinh(10) * 255).astype(np.uint8)
+
+
+def _write_png(path: str, gray: np.ndarray):
+    """Writes an 8-bit grayscale PNG"""
+
+    def chunk(kind: bytes, data: bytes):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    h, w = gray.shape
+    # Each row is preceded by its filter type (0, none).
+    rows = np.hstack([np.zeros((h, 1), np.uint8), gray]).tobytes()
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows, 6)))
+        f.write(chunk(b"IEND", b""))
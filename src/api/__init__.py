@@ -1,5 +1,6 @@
 from . import camera as _
 from . import capture as _
+from . import telemetry as _
 from . import telescope as _
 
 from ._blueprint import api as api
@@ -1,16 +1,26 @@
-from quart import request
+from dataclasses import asdict
+
+from quart import current_app, request
+import trio
 
 from ..gphoto2.gphoto import GPhoto
+from ..lib import threads
 from ._blueprint import api
 from .response import returnResponse
 
-Cam = GPhoto()
+KEY_CAMERA = "camera"
+
+
+def get_camera() -> GPhoto:
+    camera = current_app.config[KEY_CAMERA]
+    assert isinstance(camera, GPhoto)
+    return camera
 
 
 @api.route("/camera/config/<_config>/", methods=["GET"])
 async def camera_config_get(_config):
     try:
-        value = Cam.getSetting(_config)
+        value = await get_camera().getSettingAsync(_config)
         return await returnResponse({
             _config: value
         }, 200)
@@ -23,7 +33,7 @@ async def camera_config_get(_config):
 @api.route("/camera/config/<_config>/<_value>/", methods=["POST"])
 async def camera_config_set(_config, _value):
     try:
-        settings = Cam.setSetting(_config, _value)
+        settings = await get_camera().setSettingAsync(_config, _value)
         return await returnResponse({
             "camera_settings_updated": True,
             _config: settings
@@ -37,7 +47,7 @@ async def camera_config_set(_config, _value):
 @api.route("/camera/config/", methods=["GET"])
 async def camera_config_get_all():
     try:
-        result = Cam.getSettings()
+        result = await get_camera().getSettingsAsync()
         return await returnResponse(result, 200)
     except Exception as e:
         return await returnResponse({
@@ -49,7 +59,7 @@ async def camera_config_get_all():
 async def camera_config_set_all():
     try:
         content = await request.json
-        result = Cam.setSettings(content)
+        result = await get_camera().setSettingsAsync(content)
         return await returnResponse(result, 200)
     except Exception as e:
         return await returnResponse({
@@ -57,10 +67,25 @@ async def camera_config_set_all():
         }, 400)
 
 
+@api.route("/camera/config/refresh/", methods=["POST"])
+async def camera_config_refresh():
+    try:
+        tree = await get_camera().refreshConfigAsync()
+        return await returnResponse({
+            path: dict(asdict(entry), value=entry.value)
+            for path, entry in tree.entries.items()
+        }, 200)
+    except Exception as e:
+        return await returnResponse({
+            "error": e.args[0]
+        }, 400)
+
+
 @api.route("/lens/<_focalLength>/", methods=["POST"])
 async def camera_attach_lens(_focalLength):
     try:
-        result = Cam.initLens(_focalLength)
+        result = await trio.to_thread.run_sync(
+            get_camera().initLens, _focalLength, limiter=threads.CAMERA)
         return await returnResponse(result, 200)
     except Exception as e:
         return await returnResponse({
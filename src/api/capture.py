@@ -1,68 +1,103 @@
-from quart import request
+import logging
+import os
+import random
+
+from quart import current_app, request
 import trio
 
-from ..gphoto2.gphoto import GPhoto
+from ..analysis import FrameAnalyzer
+from ..gphoto2.stack import JOURNAL, CaptureSession, StackCapture, StackSettings
+from .. import telescope_control as tc
 from ._blueprint import api
+from .camera import get_camera
 from .response import returnResponse
+from .telescope import get_telescope
 
-scope: trio.CancelScope | None = None
+_log = logging.getLogger(__name__)
 
+KEY_ANALYZER = "analyzer"
 
-async def capture(scope: trio.CancelScope, settings):
-    print(settings)
-
-    imageformat = "7"
-    if ("jpeg" in settings) and (settings['jpeg'] == True):
-        imageformat = "6"
-    if ("jpegonly" in settings) and (settings['jpegonly'] == True):
-        imageformat = "0"
-
-    filepath = '/home/pi/captures/test-new/'
-
-    with scope:
-        for i in range(settings['frames']):
-            filename = filepath + "frame" + str(i)
-            # TODO: filepath: add iso/exposure/focal_length
-            res = await trio.run_process([
-                'gphoto2',
-                '--set-config', 'imageformat=' + str(imageformat),
-                '--set-config-index', 'picturestyle=1',
-                '--set-config', 'shutterspeed=bulb',
-                '--set-config-value', 'aperture=' + str(settings['aperture']),
-                '--set-config', 'iso=' + str(settings['iso']),
-                '--filename', filename + '-%m-%d_%H:%M:%S.%C',
-                '--set-config', 'eosremoterelease=5',
-                '--wait-event=' + str(settings['exposure']) + 's',
-                '--set-config', 'eosremoterelease=11',
-                '--wait-event-and-download=6s'
-            ], capture_stdout=True, capture_stderr=True)
-
-            lines = res.stdout.splitlines()
-
-            if (res.stderr):
-                # print("ERROR!")
-                for line in res.stderr.splitlines():
-                    print(line.decode())
-                # if ("An error occurred in the io-library" in res.stderr):
-                # if ('Could not claim the USB device' in res.stderr):
-                # reset_usb()
-                # toggle camera relay via gpio
-
-            for line in lines:
-                if "Saving file" in line.decode():
-                    print(line.decode())
-        # TODO: Call a "post stack capture" function here to begin pre-processing
+scope: trio.CancelScope | None = None
+session: CaptureSession | None = None
+
+
+def get_analyzer() -> FrameAnalyzer:
+    analyzer = current_app.config[KEY_ANALYZER]
+    assert isinstance(analyzer, FrameAnalyzer)
+    return analyzer
+
+
+class Dither:
+    """
+    Nudges the mount to a random offset of up to `steps` steps on each axis
+    from where the stack started, then waits to settle.  Offsets don't
+    accumulate: each dither replaces the last, and restore puts the mount's
+    calibration back once the stack is done.
+    """
+
+    def __init__(self, telescope: tc.TelescopeControl, steps: int, settle: float):
+        self._telescope = telescope
+        self._steps = steps
+        self._settle = settle
+        self._offset = (0, 0)
+
+    async def __call__(self, index: int):
+        if self._telescope.target is None:
+            _log.info("not tracking, skipping dither before frame %d", index)
+            return
+        self._move_to(
+            (
+                random.randint(-self._steps, self._steps),
+                random.randint(-self._steps, self._steps),
+            )
+        )
+        await trio.sleep(self._settle)
+
+    def restore(self):
+        if self._offset != (0, 0):
+            self._move_to((0, 0))
+
+    def _move_to(self, offset: tuple[int, int]):
+        self._telescope.calibrate_rel_steps(
+            offset[0] - self._offset[0], offset[1] - self._offset[1]
+        )
+        self._offset = offset
+        target = self._telescope.target
+        if target is not None:
+            self._telescope.track(target)
+
+
+async def capture(scope: trio.CancelScope, stack: StackCapture, dither: Dither):
+    _log.info("capturing stack: %s", stack.settings)
+    try:
+        with scope:
+            try:
+                await stack.run()
+            except Exception:
+                # TODO: toggle camera relay via gpio (the session has already
+                # tried resetting the USB device)
+                _log.exception("stack capture failed")
+            status = stack.session.status()
+            _log.info(
+                "stack %s: %d of %d frames, %d errors",
+                status["state"],
+                status["frames"],
+                status["frames_total"],
+                status["errors"],
+            )
+    finally:
+        dither.restore()
 
 
 @api.route("/camera/capture/stack/start/", methods=["POST"])
 async def capture_stack_start():
     try:
-        global scope
+        global scope, session
         settings = await request.json
 
         # TODO: Add target object (use from telescope goto?)
         if scope:
-            print('scope exists already')
+            _log.info("stopping the stack already in progress")
             scope.cancel()
             scope = None
         scope = trio.CancelScope()
@@ -72,13 +107,55 @@ async def capture_stack_start():
             "iso": "800",
             "aperture": "4",
             "exposure": "1",
+            "dither_every": 0,
+            "dither_steps": 20,
+            "dither_settle": 2,
         }
 
         _default_settings.update(settings)
-        api.nursery.start_soon(capture, scope, _default_settings)
-        return await returnResponse({"capturing_stack": True}, 200)
+
+        imageformat = "7"
+        if ("jpeg" in settings) and (settings['jpeg'] == True):
+            imageformat = "6"
+        if ("jpegonly" in settings) and (settings['jpegonly'] == True):
+            imageformat = "0"
+
+        directory = str(_default_settings.get('directory', StackSettings.directory))
+        journal = os.path.join(directory, JOURNAL)
+        if settings.get('resume'):
+            # Carry on from the next frame, with the settings it started with.
+            session = CaptureSession.resume(journal)
+        else:
+            session = CaptureSession.create(
+                StackSettings(
+                    frames=int(_default_settings['frames']),
+                    exposure=float(_default_settings['exposure']),
+                    iso=str(_default_settings['iso']),
+                    aperture=str(_default_settings['aperture']),
+                    imageformat=imageformat,
+                    directory=directory,
+                    dither_every=int(_default_settings['dither_every']),
+                    dither_steps=int(_default_settings['dither_steps']),
+                    dither_settle=float(_default_settings['dither_settle']),
+                ),
+                journal=journal,
+            )
+
+        dither = Dither(
+            get_telescope(),
+            session.settings.dither_steps,
+            session.settings.dither_settle,
+        )
+        stack = StackCapture(
+            get_camera(), session, dither=dither, analyzer=get_analyzer()
+        )
+        api.nursery.start_soon(capture, scope, stack, dither)
+        return await returnResponse({
+            "capturing_stack": True,
+            "next_index": session.next_index,
+        }, 200)
     except Exception as e:
-        return await returnResponse({"capturing_stack": False, "error": e}, 400)
+        return await returnResponse({"capturing_stack": False, "error": str(e)}, 400)
 
 
 @api.route("/camera/capture/stack/stop/", methods=["POST"])
@@ -87,4 +164,34 @@ async def capture_stack_stop():
     if scope:
         scope.cancel()
         scope = None
-    return await returnResponse({"capturing_stack": False}, 200)
+    return await returnResponse({
+        "capturing_stack": False,
+        "stack": session.status() if session else None,
+    }, 200)
+
+
+@api.route("/camera/capture/stack/status/", methods=["GET"])
+async def capture_stack_status():
+    return await returnResponse({
+        "stack": session.status() if session else None,
+    }, 200)
+
+
+@api.route("/camera/capture/stack/frame/<int:index>/", methods=["GET"])
+async def capture_stack_frame(index):
+    try:
+        assert session is not None
+        return await returnResponse({"frame": session.frame(index)}, 200)
+    except Exception as e:
+        return await returnResponse({"error": str(e)}, 400)
+
+
+@api.route("/camera/capture/stack/frame/<int:index>/reject/", methods=["POST"])
+async def capture_stack_reject(index):
+    try:
+        assert session is not None
+        rejected = request.args.get("undo") is None
+        session.reject(index, rejected)
+        return await returnResponse({"index": index, "rejected": rejected}, 200)
+    except Exception as e:
+        return await returnResponse({"error": str(e)}, 400)
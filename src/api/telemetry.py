@@ -0,0 +1,14 @@
+from dataclasses import asdict
+
+from ._blueprint import api
+from .response import returnResponse
+from .telescope import get_telescope
+
+
+@api.route("/telemetry/", methods=["GET"])
+async def telemetry():
+    telemetry = get_telescope().telemetry
+    if telemetry is None:
+        return await returnResponse({"telemetry": None}, 200)
+
+    return await returnResponse({"telemetry": asdict(telemetry)}, 200)
@@ -1,9 +1,14 @@
+from dataclasses import asdict
+
 from quart import current_app, request
 
 from astropy.coordinates import ICRS, SkyCoord
 from astropy.time import Time
+import trio
 
 from .. import telescope_control as tc
+from ..lib import threads
+from ..names import NameIndex
 from ._blueprint import api
 from .response import returnResponse
 
@@ -11,6 +16,12 @@ from .response import returnResponse
 # config, stop the telescope, restart the telescope as needed).
 
 KEY_TELESCOPE = "telescope"
+KEY_NAMES = "names"
+
+# How long a goto waits for the telescope to plan the slew (which, for a new
+# solar system object, includes fitting its ephemeris) before answering without
+# the plan.
+GOTO_PLAN_TIMEOUT = 10
 
 
 def get_telescope() -> tc.TelescopeControl:
@@ -19,13 +30,21 @@ def get_telescope() -> tc.TelescopeControl:
     return telescope
 
 
+def get_names() -> NameIndex:
+    names = current_app.config[KEY_NAMES]
+    assert isinstance(names, NameIndex)
+    return names
+
+
 @api.route("/calibrate/", methods=["POST"])
 async def calibrate():
     try:
         _ra = request.args.get("ra")
         _dec = request.args.get("dec")
-        get_telescope().calibrate(
-            tc.FixedTarget(SkyCoord(ra=_ra, dec=_dec, frame=ICRS))
+        await trio.to_thread.run_sync(
+            get_telescope().calibrate,
+            tc.FixedTarget(SkyCoord(ra=_ra, dec=_dec, frame=ICRS)),
+            limiter=threads.ASTROPY,
         )
 
         return await returnResponse({"calibrated": True, "ra": _ra, "dec": _dec}, 200)
@@ -38,7 +57,10 @@ async def calibrate():
 async def calibrate_by_name():
     try:
         _name = request.args.get("name")
-        get_telescope().calibrate(tc.FixedTarget(SkyCoord.from_name(_name)))
+        coord = await _resolve(_name)
+        await trio.to_thread.run_sync(
+            get_telescope().calibrate, tc.FixedTarget(coord), limiter=threads.ASTROPY
+        )
 
         return await returnResponse({"calibrated": True, "name": _name}, 200)
     except:
@@ -70,7 +92,12 @@ async def calibrate_solar_system_object():
     try:
         _name = request.args.get("name")
 
-        get_telescope().calibrate(tc.SolarSystemTarget(_name))
+        telescope = get_telescope()
+        await trio.to_thread.run_sync(
+            telescope.calibrate,
+            telescope.fit_ephemeris(tc.SolarSystemTarget(_name)),
+            limiter=threads.ASTROPY,
+        )
 
         return await returnResponse(
             {
@@ -95,9 +122,9 @@ async def goto():
         _ra = request.args.get("ra")
         _dec = request.args.get("dec")
 
-        get_telescope().track(tc.FixedTarget(SkyCoord(ra=_ra, dec=_dec, frame=ICRS)))
-
-        return await returnResponse({"goto": True, "ra": _ra, "dec": _dec}, 200)
+        return await _goto(
+            tc.FixedTarget(SkyCoord(ra=_ra, dec=_dec, frame=ICRS)), ra=_ra, dec=_dec
+        )
 
     except:
         return await returnResponse({"goto": False, "ra": _ra, "dec": _dec}, 400)
@@ -107,9 +134,7 @@ async def goto():
 async def goto_by_name():
     try:
         _name = request.args.get("name")
-        get_telescope().track(tc.FixedTarget(SkyCoord.from_name(_name)))
-
-        return await returnResponse({"goto": True, "name": _name}, 200)
+        return await _goto(tc.FixedTarget(await _resolve(_name)), name=_name)
     except:
         return await returnResponse({"goto": False, "name": _name}, 400)
 
@@ -119,9 +144,8 @@ async def goto_by_mpc_query():
     try:
         name = request.args.get("name")
         assert name is not None
-        get_telescope().track(tc.MPCQueryTarget(name))
-
-        return await returnResponse({"goto": True, "name": name}, 200)
+        telescope = get_telescope()
+        return await _goto(telescope.fit_ephemeris(tc.MPCQueryTarget(name)), name=name)
     except:
         return await returnResponse({"goto": False}, 400)
 
@@ -130,13 +154,9 @@ async def goto_by_mpc_query():
 async def goto_solar_system_object():
     try:
         _name = request.args.get("name")
-        get_telescope().track(tc.SolarSystemTarget(_name))
-        return await returnResponse(
-            {
-                "goto": True,
-                "object": _name,
-            },
-            200,
+        telescope = get_telescope()
+        return await _goto(
+            telescope.fit_ephemeris(tc.SolarSystemTarget(_name)), object=_name
         )
     except:
         return await returnResponse(
@@ -148,6 +168,34 @@ async def goto_solar_system_object():
         )
 
 
+async def _goto(target: tc.Target, **fields):
+    """
+    Sends the telescope to target, and responds with how it plans to get there
+    (or 202, without the plan, if it's slow to say, or 409 if another goto
+    overtook this one)
+    """
+    plan = None
+    with trio.move_on_after(GOTO_PLAN_TIMEOUT):
+        try:
+            plan = await get_telescope().goto(target)
+        except tc.Superseded:
+            return await returnResponse(
+                {"goto": False, "superseded": True, **fields}, 409
+            )
+
+    if plan is None:
+        return await returnResponse({"goto": True, "plan": None, **fields}, 202)
+    return await returnResponse({"goto": True, "plan": asdict(plan), **fields}, 200)
+
+
+async def _resolve(name: str | None) -> SkyCoord:
+    if name is None:
+        raise ValueError("a name is required")
+    return await trio.to_thread.run_sync(
+        get_names().resolve, name, limiter=threads.NAMES
+    )
+
+
 def _bool_type(bare_value: bool):
     def parse(s: str) -> bool:
         match s:
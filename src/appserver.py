@@ -1,11 +1,21 @@
 from quart_trio import QuartTrio
 
 from .api import api
-from .api.telescope import KEY_TELESCOPE
+from .analysis import FrameAnalyzer
+from .api.camera import KEY_CAMERA
+from .api.capture import KEY_ANALYZER
+from .api.telescope import KEY_NAMES, KEY_TELESCOPE
+from .gphoto2.gphoto import GPhoto
+from .names import NameIndex
 from .telescope_control import TelescopeControl
 
 
-def create_app(telescope: TelescopeControl):
+def create_app(
+    telescope: TelescopeControl,
+    names: NameIndex,
+    camera: GPhoto,
+    analyzer: FrameAnalyzer,
+):
     app = QuartTrio(__name__)
     # I tried hard to use the app context to store the telescope object, but
     # according to the documentation, app contexts are created and destroyed on
@@ -13,5 +23,8 @@ def create_app(telescope: TelescopeControl):
     # the app) Python objects.  So, instead I'm sticking it in app.config, which
     # seems wrong, but works.
     app.config[KEY_TELESCOPE] = telescope
+    app.config[KEY_NAMES] = names
+    app.config[KEY_CAMERA] = camera
+    app.config[KEY_ANALYZER] = analyzer
     app.register_blueprint(api, url_prefix="/api")
     return app
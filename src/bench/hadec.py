@@ -0,0 +1,73 @@
+"""
+Compares FixedHADec against astropy's HADec transform, for accuracy and speed,
+over random fixed coordinates at (increasing) times through the next hour.
+
+    python -m src.bench.hadec [--samples 50]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import astropy.units as u
+from astropy.coordinates import EarthLocation, HADec, SkyCoord
+from astropy.time import Time
+import numpy as np
+
+from ..sidereal import FixedHADec
+
+LOCATION = EarthLocation(lat=40 * u.deg, lon=-75 * u.deg, height=100 * u.m)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    fixed = FixedHADec(LOCATION)
+    start_ns = time.time_ns()
+
+    times_ns = np.sort(rng.uniform(0, 3_600_000_000_000, args.samples))
+
+    errors = []
+    fast_ns = []
+    astropy_ns = []
+    for offset_ns in times_ns:
+        coord = SkyCoord(
+            ra=rng.uniform(0, 360) * u.deg,
+            dec=np.degrees(np.arcsin(rng.uniform(-1, 1))) * u.deg,
+        )
+        t_ns = start_ns + int(offset_ns)
+
+        # Tracking predicts the same coordinate over and over, so only time
+        # predictions after the first (which converts it to a vector).
+        fixed.hadec(coord, t_ns)
+        t0 = time.perf_counter_ns()
+        ha, dec = fixed.hadec(coord, t_ns)
+        t1 = time.perf_counter_ns()
+        obstime = Time(t_ns / 1_000_000_000, format="unix")
+        expected = coord.transform_to(HADec(obstime=obstime, location=LOCATION))
+        t2 = time.perf_counter_ns()
+
+        fast_ns.append(t1 - t0)
+        astropy_ns.append(t2 - t1)
+
+        d_ha = (ha - expected.ha.to_value(u.rad) + np.pi) % (2 * np.pi) - np.pi
+        d_dec = dec - expected.dec.to_value(u.rad)
+        errors.append(np.hypot(d_ha * np.cos(dec), d_dec))
+
+    errors_arcsec = (np.array(errors) * u.rad).to_value(u.arcsec)
+    print(
+        f"error: median {np.median(errors_arcsec):.3f} arcsec,"
+        f" max {errors_arcsec.max():.3f} arcsec"
+    )
+    # Medians, since FixedHADec occasionally refreshes its terms.
+    print(
+        f"per call (median): {np.median(fast_ns) / 1_000:,.0f} us fast,"
+        f" {np.median(astropy_ns) / 1_000:,.0f} us astropy"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures how long it takes to plan the pulses of a trapezoidal slew, comparing
+pulse_times_trapz followed by the conversions Stepper used to make against
+pulse_plan_trapz filling a preallocated buffer.
+
+    python -m src.bench.plan_trapz [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from ..motion import plan_buffer, pulse_plan_trapz, pulse_times_trapz
+
+# Roughly the bearing axis: 800 * 256 steps/rev.
+MAX_SPEED = 40_000
+ACCEL = 20_000
+
+SLEWS = [1_000, 100_000, 1_000_000]
+
+
+def _params(steps: int):
+    return (0.0, 0.0, MAX_SPEED, ACCEL, -ACCEL, steps + 0.25, 0.5)
+
+
+def _separate(start_ns: int, steps: int):
+    """Times, then deadlines and velocities as separate arrays"""
+    times = pulse_times_trapz(*_params(steps))
+    deadlines = (start_ns + times * 1_000_000_000).astype(np.int64)
+    velocities = np.empty_like(deadlines, dtype=np.float64)
+    velocities[:1] = 0
+    velocities[1:] = 1_000_000_000 / (deadlines[1:] - deadlines[:-1])
+    return deadlines
+
+
+def _preallocated(buffer: np.ndarray):
+    def plan(start_ns: int, steps: int):
+        return pulse_plan_trapz(buffer, start_ns, *_params(steps))[0]
+
+    return plan
+
+
+def _best_of(plan, steps: int, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        plan(time.monotonic_ns(), steps)
+        best = min(best, time.perf_counter_ns() - start)
+    return best / 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    buffer = plan_buffer(max(SLEWS) + 1)
+
+    for steps in SLEWS:
+        separate = _best_of(_separate, steps, args.repeat)
+        preallocated = _best_of(_preallocated(buffer), steps, args.repeat)
+        print(
+            f"{steps:>9,} steps: {separate:>8.2f} ms separate,"
+            f" {preallocated:>8.2f} ms preallocated"
+            f" ({separate / preallocated:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
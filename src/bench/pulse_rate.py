@@ -0,0 +1,84 @@
+"""
+Measures the maximum aggregate step rate of two axes pulsing through a virtual
+(no-op) GPIO output, comparing the old global pulse lock against PulseGroup.
+
+    python -m src.bench.pulse_rate [--seconds 2]
+"""
+from __future__ import annotations
+
+import argparse
+from threading import Event, Lock, Thread
+import time
+
+from ..lib.nsleep import nsleep
+from ..lib.pulse import PulseGroup
+
+PULSE_NS = 50_000
+
+RA_PINS = dict(dir=13, en=12, pul=19)
+DEC_PINS = dict(dir=24, en=4, pul=18)
+
+
+def _virtual_output(channels: list[int], values: list[int], /):
+    pass
+
+
+class _LockedPulses:
+    """The previous lib.pi.motor.step: one lock held across the whole pulse"""
+
+    def __init__(self):
+        self._lock = Lock()
+
+    def step(self, pins: dict, dir: int):
+        with self._lock:
+            _virtual_output([pins["dir"], pins["en"], pins["pul"]], [dir, 0, 1])
+            nsleep(PULSE_NS)
+            _virtual_output([pins["pul"], pins["en"]], [0, 1])
+
+
+def _run(step, seconds: float):
+    stop = Event()
+    counts = {}
+
+    def axis(name: str, pins: dict):
+        n = 0
+        while not stop.is_set():
+            step(pins, 1)
+            n += 1
+        counts[name] = n
+
+    threads = [
+        Thread(target=axis, args=["bearing", RA_PINS]),
+        Thread(target=axis, args=["dec", DEC_PINS]),
+    ]
+
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    return {name: n / elapsed for name, n in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    for name, pulses in [
+        ("global lock", _LockedPulses()),
+        ("pulse group", PulseGroup(_virtual_output, PULSE_NS)),
+    ]:
+        rates = _run(pulses.step, args.seconds)
+        per_axis = ", ".join(f"{axis} {rate:,.0f}" for axis, rate in rates.items())
+        print(
+            f"{name:>12}: {sum(rates.values()):>9,.0f} steps/s aggregate ({per_axis})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Fuzzes lib.stellarium's MessageReader (random mixes of gotos, unknown and
+malformed messages, split at random over a local socket pair, checking that
+exactly the gotos come out), then measures its throughput and latency against
+reading each message with a receive per header and body, accumulating bytes.
+
+    python -m src.bench.stellarium [--rounds 200] [--messages 100000]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+import struct
+import time
+
+import numpy as np
+import trio
+
+from ..lib import stellarium
+from ..lib.stellarium import GOTO, HEADER, MSG_GOTO, MessageReader, ProtocolError
+
+
+def _goto(rng: random.Random):
+    return GOTO.pack(
+        rng.getrandbits(64), rng.getrandbits(32), rng.randint(-(2**30), 2**30)
+    )
+
+
+def _message(type: int, body: bytes):
+    return HEADER.pack(HEADER.size + len(body), type) + body
+
+
+def _random_stream(rng: random.Random, count: int):
+    """The bytes of count random messages, and the goto bodies among them"""
+    data = bytearray()
+    gotos = []
+    for _ in range(count):
+        match rng.choice(["goto", "goto", "goto", "unknown", "long", "short"]):
+            case "goto":
+                body = _goto(rng)
+                gotos.append(body)
+                data += _message(MSG_GOTO, body)
+            case "unknown":
+                data += _message(rng.randint(1, 100), rng.randbytes(rng.randint(0, 64)))
+            case "long":
+                # Longer than any buffer
+                data += _message(rng.randint(1, 100), rng.randbytes(20_000))
+            case "short":
+                data += _message(MSG_GOTO, rng.randbytes(rng.randint(0, GOTO.size - 1)))
+    return bytes(data), gotos
+
+
+async def _send_chunked(sock, data: bytes, rng: random.Random):
+    view = memoryview(data)
+    while view:
+        size = rng.choice([1, 2, 3, 7, 24, 100, 4096, 65536])
+        sent = await sock.send(view[:size])
+        view = view[sent:]
+        if rng.random() < 0.1:
+            await trio.sleep(0)
+    sock.close()
+
+
+async def _read_all(reader: MessageReader):
+    bodies = []
+    try:
+        while True:
+            bodies += [bytes(body) for _, body in await reader.receive()]
+    except stellarium.EndOfStream:
+        return bodies
+
+
+async def fuzz(rounds: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(rounds):
+        data, expected = _random_stream(rng, rng.randint(1, 200))
+        a, b = trio.socket.socketpair()
+        reader = MessageReader(b, size=rng.choice([24, 64, 1000, 4096]))
+        async with trio.open_nursery() as n:
+            n.start_soon(_send_chunked, a, data, rng)
+            received = await _read_all(reader)
+        b.close()
+        if received != expected:
+            raise AssertionError(
+                f"round {i}: got {len(received)} gotos, not {len(expected)}"
+            )
+
+    # A length that can't be right ends the stream.
+    a, b = trio.socket.socketpair()
+    await a.send(_message(MSG_GOTO, _goto(rng)) + HEADER.pack(2, 0))
+    try:
+        await _read_all(MessageReader(b))
+        raise AssertionError("bad length not rejected")
+    except ProtocolError:
+        pass
+    a.close()
+    b.close()
+    print(f"fuzz: {rounds} rounds ok")
+
+
+async def _naive_read(sock, count: int):
+    """Reads (the old way) count gotos, one receive at a time"""
+
+    async def receive_exactly(n: int):
+        data = b""
+        while len(data) < n:
+            more = await sock.recv(n - len(data))
+            if not more:
+                raise stellarium.EndOfStream
+            data += more
+        return data
+
+    for _ in range(count):
+        length, _ = struct.unpack("<hh", await receive_exactly(4))
+        struct.unpack("<QLl", await receive_exactly(length - 4))
+
+
+async def _buffered_read(sock, count: int):
+    reader = MessageReader(sock)
+    received = 0
+    while received < count:
+        for _, body in await reader.receive():
+            GOTO.unpack_from(body)
+            received += 1
+
+
+async def throughput(messages: int):
+    rng = random.Random(1)
+    data = b"".join(_message(MSG_GOTO, _goto(rng)) for _ in range(messages))
+
+    for name, read in [("naive", _naive_read), ("buffered", _buffered_read)]:
+        a, b = trio.socket.socketpair()
+        start_ns = time.perf_counter_ns()
+        async with trio.open_nursery() as n:
+            n.start_soon(_sendall, a, data)
+            await read(b, messages)
+        elapsed = (time.perf_counter_ns() - start_ns) / 1e9
+        a.close()
+        b.close()
+        print(f"{name:>8}: {messages / elapsed:12,.0f} gotos/s")
+
+
+async def _sendall(sock, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[await sock.send(view) :]
+
+
+async def latency(count: int = 2000, burst: int = 20):
+    """From sending a burst of gotos to having the last of them"""
+    rng = random.Random(2)
+    a, b = trio.socket.socketpair()
+    reader = MessageReader(b)
+    latencies = []
+    for _ in range(count):
+        data = b"".join(_message(MSG_GOTO, _goto(rng)) for _ in range(burst))
+        start_ns = time.perf_counter_ns()
+        await _sendall(a, data)
+        received = 0
+        while received < burst:
+            received += len(await reader.receive())
+        latencies.append(time.perf_counter_ns() - start_ns)
+    a.close()
+    b.close()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) / 1000
+    print(f" latency: {burst}-goto bursts, p50 {p50:.1f} us, p99 {p99:.1f} us")
+
+
+async def _main(args):
+    await fuzz(args.rounds)
+    await throughput(args.messages)
+    await latency()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+
+    # (Unknown messages are logged as they're skipped.)
+    stellarium._log.setLevel(logging.ERROR)
+    trio.run(_main, args)
+
+
+if __name__ == "__main__":
+    main()
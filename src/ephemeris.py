@@ -0,0 +1,215 @@
+"""
+Chebyshev fits of (slow to compute) ephemerides, so that a moving target can be
+sampled once per night and then evaluated cheaply.
+"""
+from __future__ import annotations
+
+import csv
+from dataclasses import dataclass
+import functools
+import logging
+import math
+import os
+import re
+from typing import Callable, TypeAlias
+
+from astropy.coordinates import EarthLocation
+import astropy.units as u
+import numpy as np
+from numpy.polynomial import chebyshev
+
+_log = logging.getLogger(__name__)
+
+DAY_NS = 86_400_000_000_000
+
+# Samples times (time.time_ns() values) to ICRS right ascension and declination
+# (radians).
+SampleFn: TypeAlias = Callable[[np.ndarray], tuple[np.ndarray, np.ndarray]]
+
+
+@dataclass(frozen=True)
+class ChebyshevEphemeris:
+    """
+    Right ascension and declination over consecutive, equal length segments
+    starting at start_ns, each fit with a Chebyshev series over [-1, 1].
+    """
+
+    start_ns: int  # time.time_ns()
+    segment_ns: int
+    # Coefficients, one row per segment.  RA is unwrapped (continuous).
+    ra: np.ndarray
+    dec: np.ndarray
+
+    @property
+    def end_ns(self):
+        return self.start_ns + self.segment_ns * len(self.ra)
+
+    def covers(self, t_ns: int | np.ndarray):
+        return bool(np.all((self.start_ns <= t_ns) & (t_ns <= self.end_ns)))
+
+    @functools.cached_property
+    def _rates(self):
+        """Coefficients of the rates (radians/s)"""
+        # d/dt = d/dx * dx/dt
+        scale = 2 / (self.segment_ns / 1_000_000_000)
+        return (
+            chebyshev.chebder(self.ra, axis=1) * scale,
+            chebyshev.chebder(self.dec, axis=1) * scale,
+        )
+
+    def evaluate(self, t_ns: int | np.ndarray):
+        """
+        Returns RA (wrapped into [0, 2 pi)), Dec (radians) and their rates
+        (radians/s) at t_ns, which must be covered.
+        """
+        ra_rate, dec_rate = self._rates
+        coefs = (self.ra, self.dec, ra_rate, dec_rate)
+
+        t = np.asarray(t_ns)
+        i = np.clip((t - self.start_ns) // self.segment_ns, 0, len(self.ra) - 1)
+        x = 2 * (t - self.start_ns - i * self.segment_ns) / self.segment_ns - 1
+
+        if t.ndim == 0:
+            values = [float(chebyshev.chebval(x, c[i])) for c in coefs]
+        else:
+            values = [np.empty(t.shape) for _ in coefs]
+            for segment in np.unique(i):
+                m = i == segment
+                for value, c in zip(values, coefs):
+                    value[m] = chebyshev.chebval(x[m], c[segment])
+
+        values[0] %= 2 * math.pi
+        return tuple(values)
+
+    @classmethod
+    def fit(
+        cls,
+        sample: SampleFn,
+        start_ns: int,
+        segment_ns: int,
+        segments: int,
+        samples_per_segment: int = 25,
+        degree: int = 10,
+    ):
+        """
+        Fits sample over `segments` segments from start_ns, sampling it just
+        once (for all segments together).
+        """
+        steps = samples_per_segment - 1
+        t_ns = start_ns + np.arange(segments * steps + 1) * (segment_ns // steps)
+        ra, dec = sample(t_ns)
+        ra = np.unwrap(ra)
+
+        x = np.linspace(-1, 1, samples_per_segment)
+        ra_coef = np.empty((segments, degree + 1))
+        dec_coef = np.empty((segments, degree + 1))
+        for k in range(segments):
+            window = slice(k * steps, (k + 1) * steps + 1)
+            ra_coef[k] = chebyshev.chebfit(x, ra[window], degree)
+            dec_coef[k] = chebyshev.chebfit(x, dec[window], degree)
+
+        return cls(start_ns, segment_ns, ra_coef, dec_coef)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            start_ns=self.start_ns,
+            segment_ns=self.segment_ns,
+            ra=self.ra,
+            dec=self.dec,
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as f:
+            return cls(int(f["start_ns"]), int(f["segment_ns"]), f["ra"], f["dec"])
+
+
+def night_start_ns(t_ns: int, location: EarthLocation) -> int:
+    """
+    Returns the start of the night containing t_ns: the (local mean solar) noon
+    before it.
+    """
+    # Offset of local mean solar time from UTC.
+    offset_ns = round(location.lon.to_value(u.deg) / 360 * DAY_NS)
+    noon_ns = DAY_NS // 2
+    return (t_ns + offset_ns - noon_ns) // DAY_NS * DAY_NS + noon_ns - offset_ns
+
+
+def cached_fit(
+    cache_dir: str | None,
+    key: str,
+    sample: SampleFn,
+    start_ns: int,
+    segment_ns: int,
+    segments: int,
+) -> ChebyshevEphemeris:
+    """
+    ChebyshevEphemeris.fit, reusing (and saving) fits in cache_dir under a file
+    named for key and start_ns.
+    """
+    if cache_dir is None:
+        return ChebyshevEphemeris.fit(sample, start_ns, segment_ns, segments)
+
+    name = re.sub(r"[^\w.,-]+", "_", f"{key}-{start_ns}") + ".npz"
+    path = os.path.join(cache_dir, name)
+    try:
+        return ChebyshevEphemeris.load(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        _log.warning(f"ignoring unreadable ephemeris cache {path}: {e}")
+
+    ephemeris = ChebyshevEphemeris.fit(sample, start_ns, segment_ns, segments)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename, so that a partial file is never picked up.
+        tmp = path + ".tmp.npz"
+        ephemeris.save(tmp)
+        os.replace(tmp, path)
+    except OSError as e:
+        _log.warning(f"couldn't save ephemeris cache {path}: {e}")
+
+    return ephemeris
+
+
+class EphemerisFile:
+    """
+    Stand-in ephemerides (e.g. for offline testing), read from a CSV file with
+    a header of name,unix_s,ra_deg,dec_deg.  Positions are interpolated
+    linearly between rows, so they should be closely spaced (say, every few
+    minutes).
+    """
+
+    _rows: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]
+
+    def __init__(self, path: str):
+        by_name: dict[str, list[tuple[float, float, float]]] = {}
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                by_name.setdefault(row["name"].strip().lower(), []).append(
+                    (float(row["unix_s"]), float(row["ra_deg"]), float(row["dec_deg"]))
+                )
+
+        self._rows = {}
+        for name, rows in by_name.items():
+            t, ra, dec = np.array(sorted(rows)).T
+            self._rows[name] = (
+                t * 1_000_000_000,
+                np.unwrap(np.radians(ra)),
+                np.radians(dec),
+            )
+
+    def sampler(self, name: str) -> SampleFn:
+        rows = self._rows.get(name.strip().lower())
+        if rows is None:
+            raise KeyError(f"{name} isn't in the ephemeris file")
+        t, ra, dec = rows
+
+        def sample(t_ns: np.ndarray):
+            if t_ns.min() < t[0] or t_ns.max() > t[-1]:
+                raise ValueError(f"the ephemeris file doesn't cover {name} then")
+            return np.interp(t_ns, t, ra) % (2 * math.pi), np.interp(t_ns, t, dec)
+
+        return sample
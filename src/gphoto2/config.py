@@ -0,0 +1,99 @@
+"""
+The camera's configuration, as parsed from `get-config` output, e.g.
+
+    Label: ISO Speed
+    Readonly: 0
+    Type: RADIO
+    Current: 800
+    Choice: 0 Auto
+    Choice: 1 100
+    END
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class ConfigEntry:
+    path: str  # e.g. /main/imgsettings/iso
+    label: str = ""
+    type: str = ""  # TEXT, RANGE, TOGGLE, RADIO, MENU, DATE or BUTTON
+    readonly: bool = False
+    current: str = ""
+    choices: list[str] = field(default_factory=list)
+    # For RANGE
+    bottom: float | None = None
+    top: float | None = None
+    step: float | None = None
+
+    @property
+    def name(self):
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def value(self):
+        """current, as its type (int, float or str)"""
+        try:
+            match self.type:
+                case "RANGE":
+                    return float(self.current)
+                case "TOGGLE" | "DATE":
+                    return int(self.current)
+        except ValueError:
+            pass
+        return self.current
+
+
+def parseConfigEntry(path, output) -> ConfigEntry:
+    entry = ConfigEntry(path)
+    for line in output.splitlines():
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        value = value.strip()
+
+        match key.strip():
+            case "Label":
+                entry.label = value
+            case "Type":
+                entry.type = value
+            case "Readonly":
+                entry.readonly = value == "1"
+            case "Current":
+                entry.current = value
+            case "Choice":
+                # "<index> <choice>"
+                _, _, choice = value.partition(" ")
+                entry.choices.append(choice)
+            case "Bottom":
+                entry.bottom = float(value)
+            case "Top":
+                entry.top = float(value)
+            case "Step":
+                entry.step = float(value)
+    return entry
+
+
+class ConfigTree:
+    """The entries of a camera's configuration, by path and by name"""
+
+    def __init__(self, entries):
+        self.entries: dict[str, ConfigEntry] = {e.path: e for e in entries}
+        self._by_name = {e.name: e for e in entries}
+
+    def get(self, config) -> ConfigEntry:
+        entry = self.entries.get(config) or self._by_name.get(config)
+        if entry is None:
+            raise Exception([config + " not found in configuration tree."])
+        return entry
+
+    def __contains__(self, config):
+        return config in self.entries or config in self._by_name
+
+    def update(self, entry: ConfigEntry):
+        self.entries[entry.path] = entry
+        self._by_name[entry.name] = entry
+
+    def currentValues(self):
+        return {path: entry.current for path, entry in self.entries.items()}
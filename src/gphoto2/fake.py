@@ -0,0 +1,259 @@
+"""
+A stand-in for `gphoto2 --shell` with a (Canon 550D-like) camera attached, for
+running and testing without one.  It speaks enough of the shell to configure
+the camera and take bulb exposures, which are "saved" as empty files, either
+straight away (capturetarget=Internal RAM) or to the memory card, to be
+downloaded later with `get`.
+
+    python -m src.gphoto2.fake [--exposure-scale 0.01] [--download-seconds 3]
+"""
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass, field
+import os
+import sys
+import time
+
+
+@dataclass
+class _Setting:
+    label: str
+    type: str
+    choices: list[str] = field(default_factory=list)
+    current: str = ""
+    readonly: bool = False
+
+
+def _config() -> dict[str, _Setting]:
+    return {
+        "/main/actions/eosremoterelease": _Setting(
+            "Canon EOS Remote Release",
+            "RADIO",
+            [
+                "None",
+                "Press Half",
+                "Press Full",
+                "Release Half",
+                "Release Full",
+                "Immediate",
+                "Press 1",
+                "Press 2",
+                "Press 3",
+                "Release 1",
+                "Release 2",
+                "Release 3",
+            ],
+            "None",
+        ),
+        "/main/imgsettings/imageformat": _Setting(
+            "Image Format",
+            "RADIO",
+            [
+                "Large Fine JPEG",
+                "Large Normal JPEG",
+                "Medium Fine JPEG",
+                "Medium Normal JPEG",
+                "Small Fine JPEG",
+                "Small Normal JPEG",
+                "RAW + Large Fine JPEG",
+                "RAW",
+            ],
+            "RAW",
+        ),
+        "/main/imgsettings/iso": _Setting(
+            "ISO Speed",
+            "RADIO",
+            ["Auto", "100", "200", "400", "800", "1600", "3200", "6400"],
+            "800",
+        ),
+        "/main/capturesettings/shutterspeed": _Setting(
+            "Shutter Speed",
+            "RADIO",
+            ["bulb", "30", "15", "8", "4", "2", "1", "1/2", "1/4", "1/8", "1/15"],
+            "bulb",
+        ),
+        "/main/capturesettings/aperture": _Setting(
+            "Aperture",
+            "RADIO",
+            ["3.5", "4", "4.5", "5", "5.6", "6.3", "7.1", "8", "11", "16", "22"],
+            "4",
+        ),
+        "/main/capturesettings/picturestyle": _Setting(
+            "Picture Style",
+            "RADIO",
+            ["Standard", "Portrait", "Landscape", "Neutral", "Faithful", "Monochrome"],
+            "Standard",
+        ),
+        "/main/settings/capturetarget": _Setting(
+            "Capture Target",
+            "RADIO",
+            ["Internal RAM", "Memory card"],
+            "Internal RAM",
+        ),
+        "/main/status/lensname": _Setting(
+            "Lens Name", "TEXT", current="EF-S18-55mm f/3.5-5.6 IS II", readonly=True
+        ),
+    }
+
+
+_FOLDER = "/store_00020001/DCIM/100CANON"
+
+
+class _Camera:
+    def __init__(self, exposure_scale: float, download_seconds: float):
+        self.config = _config()
+        self.exposure_scale = exposure_scale
+        self.download_seconds = download_seconds
+        self.pressed_ns: int | None = None
+        # Waiting to be downloaded (from RAM) or announced (on the card)
+        self.pending: list[str] = []
+        self.card: set[str] = set()
+        self.frames = 0
+
+    def lookup(self, name: str) -> tuple[str, _Setting]:
+        for path, setting in self.config.items():
+            if path == name or path.rsplit("/", 1)[-1] == name:
+                return path, setting
+        raise _Error(f"{name} not found in configuration tree.")
+
+    def set(self, name: str, value: str, by: str):
+        _, setting = self.lookup(name)
+        if setting.readonly:
+            raise _Error(f"{name} is read only.")
+        if setting.type != "RADIO":
+            setting.current = value
+            return
+
+        if by != "index" and value in setting.choices:
+            choice = value
+        elif by != "value" and value.isdigit() and int(value) < len(setting.choices):
+            choice = setting.choices[int(value)]
+        else:
+            raise _Error(f"Choice {value} not found within list of choices.")
+        setting.current = choice
+
+        if name.endswith("eosremoterelease"):
+            self.release(choice)
+
+    def release(self, choice: str):
+        if choice in ("Press Full", "Immediate"):
+            self.pressed_ns = time.monotonic_ns()
+        elif choice.startswith("Release") and self.pressed_ns is not None:
+            self.pressed_ns = None
+            extensions = {
+                "RAW": [".cr2"],
+                "RAW + Large Fine JPEG": [".cr2", ".jpg"],
+            }.get(self.config["/main/imgsettings/imageformat"].current, [".jpg"])
+            # Like a real camera's numbering, carry on from earlier sessions.
+            while any(os.path.exists(f"capt{self.frames:04d}{e}") for e in extensions):
+                self.frames += 1
+            for extension in extensions:
+                self.pending.append(f"capt{self.frames:04d}{extension}")
+            self.frames += 1
+
+    def wait(self, arg: str, download: bool):
+        to_card = self.config["/main/settings/capturetarget"].current != "Internal RAM"
+
+        if arg == "FILEADDED":
+            # Until the next file is written
+            time.sleep(0.2 * self.exposure_scale)
+            names = self.pending[:1]
+        else:
+            seconds = float(arg.rstrip("s")) if arg.endswith("s") else 0.1
+            time.sleep(seconds * self.exposure_scale)
+            names = list(self.pending)
+        del self.pending[: len(names)]
+
+        for name in names:
+            if to_card:
+                self.card.add(name)
+                print(f"FILEADDED {name} {_FOLDER}")
+            elif download:
+                open(name, "wb").close()
+                print(f"Saving file as {name}")
+
+    def get(self, path: str):
+        folder, _, name = path.rpartition("/")
+        if folder != _FOLDER or name not in self.card:
+            raise _Error(f"{path} not found.")
+        time.sleep(self.download_seconds * self.exposure_scale)
+        open(name, "wb").close()
+        print(f"Saving file as {name}")
+
+
+class _Error(Exception):
+    pass
+
+
+def _run(camera: _Camera, line: str):
+    command, _, arg = line.strip().partition(" ")
+    arg = arg.strip()
+    name, _, value = arg.partition("=")
+
+    match command:
+        case "":
+            pass
+        case "list-config":
+            for path in camera.config:
+                print(path)
+        case "get-config":
+            _, setting = camera.lookup(arg)
+            print(f"Label: {setting.label}")
+            print(f"Readonly: {int(setting.readonly)}")
+            print(f"Type: {setting.type}")
+            print(f"Current: {setting.current}")
+            for i, choice in enumerate(setting.choices):
+                print(f"Choice: {i} {choice}")
+            print("END")
+        case "set-config":
+            camera.set(name, value, "any")
+        case "set-config-index":
+            camera.set(name, value, "index")
+        case "set-config-value":
+            camera.set(name, value, "value")
+        case "lcd":
+            os.chdir(os.path.expanduser(arg))
+            print(f"Local directory now '{os.getcwd()}'.")
+        case "wait-event":
+            camera.wait(arg, download=False)
+        case "wait-event-and-download":
+            camera.wait(arg, download=True)
+        case "get":
+            camera.get(arg)
+        case _:
+            raise _Error(f"Unknown command '{command}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--exposure-scale",
+        type=float,
+        default=1.0,
+        help="Factor by which to shorten (or lengthen) waits",
+    )
+    parser.add_argument(
+        "--download-seconds",
+        type=float,
+        default=3.0,
+        help="Time taken to download a frame from the card",
+    )
+    args = parser.parse_args()
+
+    camera = _Camera(args.exposure_scale, args.download_seconds)
+    while True:
+        print(f"gphoto2: {{{os.getcwd()}}} /> ", end="", flush=True)
+        line = sys.stdin.readline()
+        if not line or line.strip() in ("exit", "quit", "q"):
+            break
+        try:
+            _run(camera, line)
+        except (_Error, OSError) as e:
+            print("*** Error ***")
+            print(e)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,34 @@
+import functools
 import requests
+import sys
 from datetime import date
 
 from exiftool import ExifToolHelper
-from .util import (
-    getCurrentConfigValueFromCamera,
-    setConfigValueOnCamera,
-    getAllConfigFromCamera,
-    setMultipleValuesOnCamera,
-)
+import trio
+
+from ..lib import threads, usbreset
+from .config import ConfigTree, parseConfigEntry
+from .session import CameraError, ShellSession
 from .canon550d import FocalLengths
 
 WEATHER_API_URL = 'http://wttr.in?format="%t+%w+%m+%M+%P+%z+%h+%C"'
 
+# Runs the fake camera (see fake.py) in place of gphoto2.
+FAKE_CAMERA_COMMAND = [sys.executable, "-m", __package__ + ".fake"]
+
 
 class GPhoto:
 
-    def __init__(self):
+    def __init__(self, session=None):
         print("todo init")
+        # All commands go through the one shell, which keeps the camera open.
+        if session is None:
+            session = ShellSession(reset=usbreset.reset)
+        self.session = session
+        # The camera's configuration (and the session generation it's from),
+        # loaded on first use.
+        self._config = None
+        self._configGeneration = None
         # self.getWeather()
         # self.initLens()
         weather = {}
@@ -54,29 +66,112 @@ class GPhoto:
             self.meta['focalLength'] = "Not Set"
         return self.meta
 
+    def config(self):
+        """
+        The camera's configuration, loaded if it hasn't been already (or the
+        camera has reconnected since)
+        """
+        tree = self._cachedConfig()
+        if tree is None:
+            output, = self.session.run("list-config")
+            paths = [line.strip() for line in output.splitlines()
+                     if line.startswith("/")]
+            outputs = self.session.run(
+                *["get-config " + path for path in paths])
+            tree = ConfigTree([parseConfigEntry(path, output)
+                               for path, output in zip(paths, outputs)])
+            self._config = tree
+            self._configGeneration = self.session.generation
+        return tree
+
+    def refreshConfig(self):
+        self._config = None
+        return self.config()
+
+    def _cachedConfig(self):
+        if self._configGeneration != self.session.generation:
+            return None
+        return self._config
+
     def getSetting(self, config):
-        try:
-            return getCurrentConfigValueFromCamera(config)
-        except Exception as e:
-            raise e
+        return self.config().get(config).current
 
     def setSetting(self, config, value):
-        try:
-            return setConfigValueOnCamera(config, value)
-        except Exception as e:
-            raise e
+        return self.setSettings({config: value})[config]
 
     def getSettings(self):
-        try:
-            return getAllConfigFromCamera()
-        except Exception as e:
-            raise e
+        return self.config().currentValues()
 
     def setSettings(self, data):
+        tree = self.config()
+        paths = [tree.get(key).path for key in data]
+        self.run(*["set-config-value " + path + "=" + data[key]
+                   for key, path in zip(data, paths)])
+        # What the camera made of them
+        return {key: tree.get(path).current for key, path in zip(data, paths)}
+
+    def run(self, *commands, timeout=10.0, readback=True):
+        """
+        Runs gphoto2 shell commands, returning their outputs.  Unless readback
+        is False (e.g. for actions like eosremoterelease, which should take no
+        longer than they must), what set-config commands set is read back in
+        the same round trip, to keep the configuration up to date.
+        """
+        tree = self._cachedConfig()
+        changed = [command.split(" ", 1)[1].split("=", 1)[0].strip()
+                   for command in commands if command.startswith("set-config")]
+        # (Only what the configuration has, and only if it's loaded.)
+        readbacks = []
+        if readback and tree is not None:
+            readbacks = [name for name in changed if name in tree]
         try:
-            return setMultipleValuesOnCamera(data)
-        except Exception as e:
-            raise e
+            outputs = self.session.run(
+                *commands, *["get-config " + name for name in readbacks],
+                timeout=timeout)
+        except CameraError:
+            if changed:
+                self._config = None
+            raise
+
+        for name, output in zip(readbacks, outputs[len(commands):]):
+            tree.update(parseConfigEntry(tree.get(name).path, output))
+        return outputs[:len(commands)]
+
+    # Async counterparts of the above, which run (one at a time) in a worker
+    # thread.
+
+    async def getSettingAsync(self, config):
+        # Served from memory, without waiting for the camera, if possible.
+        tree = self._cachedConfig()
+        if tree is not None:
+            return tree.get(config).current
+        return await trio.to_thread.run_sync(
+            self.getSetting, config, limiter=threads.CAMERA)
+
+    async def setSettingAsync(self, config, value):
+        return await trio.to_thread.run_sync(
+            self.setSetting, config, value, limiter=threads.CAMERA)
+
+    async def getSettingsAsync(self):
+        tree = self._cachedConfig()
+        if tree is not None:
+            return tree.currentValues()
+        return await trio.to_thread.run_sync(
+            self.getSettings, limiter=threads.CAMERA)
+
+    async def setSettingsAsync(self, data):
+        return await trio.to_thread.run_sync(
+            self.setSettings, data, limiter=threads.CAMERA)
+
+    async def refreshConfigAsync(self):
+        return await trio.to_thread.run_sync(
+            self.refreshConfig, limiter=threads.CAMERA)
+
+    async def runAsync(self, *commands, timeout=10.0, readback=True):
+        return await trio.to_thread.run_sync(
+            functools.partial(
+                self.run, *commands, timeout=timeout, readback=readback),
+            limiter=threads.CAMERA)
 
     def capture(self):
         print("TODO CAPTURE")
@@ -0,0 +1,219 @@
+"""
+A long-lived `gphoto2 --shell`, so that the camera is only detected (and the
+USB device claimed) once rather than by every command.
+"""
+from __future__ import annotations
+
+import codecs
+import logging
+import os
+import pty
+import re
+import select
+import subprocess
+import termios
+import time
+from threading import Lock
+from typing import Callable, Sequence
+
+_log = logging.getLogger(__name__)
+
+# e.g. "gphoto2: {/home/pi} /store_00020001/DCIM> "
+_PROMPT = re.compile(r"gphoto2: \{[^}\n]*\} [^\n]*?> ")
+# Terminal control sequences (readline's, mostly), which aren't output.
+_CONTROL = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x1b[=>]|\r")
+
+# Errors meaning the camera (or our connection to it) is gone, rather than that
+# a command was bad.
+_CONNECTION_ERRORS = (
+    "io-library",
+    "Could not claim",
+    "No camera found",
+    "Could not detect",
+)
+
+
+class CameraError(Exception):
+    pass
+
+
+class _Disconnected(Exception):
+    pass
+
+
+class ShellSession:
+    """
+    Runs gphoto2 shell commands, one caller at a time, over a shell that's
+    started on first use.  If the camera stops responding (or reports a USB
+    error), the shell is restarted, after calling `reset` (e.g.
+    lib.usbreset.reset), and the commands retried once.
+    """
+
+    _command: list[str]
+    _reset: Callable[[], None] | None
+    _start_timeout: float
+    _lock: Lock
+    _proc: subprocess.Popen | None
+    _fd: int | None
+    _buffer: str
+    _decoder: codecs.IncrementalDecoder
+    # Incremented each time the shell is (re)started, after which anything
+    # known about the camera may be out of date.
+    generation: int
+
+    def __init__(
+        self,
+        command: Sequence[str] = ("gphoto2", "--shell"),
+        reset: Callable[[], None] | None = None,
+        start_timeout: float = 10.0,
+    ):
+        self._command = list(command)
+        self._reset = reset
+        self._start_timeout = start_timeout
+        self._lock = Lock()
+        self.generation = 0
+        self._proc = None
+        self._fd = None
+        self._buffer = ""
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def run(self, *commands: str, timeout: float = 10.0) -> list[str]:
+        """
+        Runs commands (all sent at once, so in one round trip) and returns
+        their outputs.  Raises CameraError if any of them fails.
+        """
+        for command in commands:
+            if "\n" in command or "\r" in command:
+                raise ValueError(f"{command!r} isn't a single command")
+
+        with self._lock:
+            try:
+                outputs = self._run(commands, timeout)
+            except _Disconnected as e:
+                _log.warning(f"camera disconnected ({e}), reconnecting")
+                self._reconnect()
+                outputs = self._run(commands, timeout)
+
+        errors = [line for output in outputs for line in _errors(output)]
+        if errors:
+            raise CameraError(errors)
+        return outputs
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _run(self, commands: tuple[str, ...], timeout: float):
+        if self._proc is None:
+            self._start()
+
+        assert self._fd is not None
+        try:
+            os.write(self._fd, "".join(f"{c}\n" for c in commands).encode())
+        except OSError as e:
+            raise _Disconnected(str(e))
+
+        deadline = time.monotonic() + timeout
+        outputs = []
+        for command in commands:
+            output = self._read_until_prompt(deadline)
+            # Drop the command, if the shell (readline) echoed it.
+            first, _, rest = output.partition("\n")
+            if first.strip() == command:
+                output = rest
+            outputs.append(output)
+
+        for output in outputs:
+            if any(e in output for e in _CONNECTION_ERRORS):
+                raise _Disconnected(output.strip())
+        return outputs
+
+    def _start(self):
+        controller, terminal = pty.openpty()
+        # Through a terminal, the shell prompts (and flushes) as it would
+        # interactively; without echo, our commands don't come back.
+        attrs = termios.tcgetattr(terminal)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(terminal, termios.TCSANOW, attrs)
+
+        try:
+            self._proc = subprocess.Popen(
+                self._command,
+                stdin=terminal,
+                stdout=terminal,
+                stderr=terminal,
+                env={**os.environ, "TERM": "dumb"},
+                start_new_session=True,
+            )
+        except OSError as e:
+            os.close(controller)
+            raise CameraError([f"couldn't start {self._command[0]}: {e}"])
+        finally:
+            os.close(terminal)
+
+        self._fd = controller
+        self.generation += 1
+        self._buffer = ""
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            self._read_until_prompt(time.monotonic() + self._start_timeout)
+        except _Disconnected:
+            self._close()
+            raise
+
+    def _reconnect(self):
+        self._close()
+        if self._reset is not None:
+            try:
+                self._reset()
+            except Exception as e:
+                _log.warning("couldn't reset the camera", exc_info=e)
+        try:
+            self._start()
+        except _Disconnected as e:
+            raise CameraError([f"couldn't reconnect to the camera: {e}"])
+
+    def _close(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_until_prompt(self, deadline: float) -> str:
+        assert self._fd is not None
+        while True:
+            m = _PROMPT.search(self._buffer)
+            if m is not None:
+                output = self._buffer[: m.start()]
+                self._buffer = self._buffer[m.end() :]
+                return output
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise _Disconnected("timed out")
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError:  # EIO, once the shell has exited
+                data = b""
+            if not data:
+                raise _Disconnected("the shell exited")
+            # (Over the whole buffer, in case a sequence was split between
+            # reads.)
+            self._buffer = _CONTROL.sub("", self._buffer + self._decoder.decode(data))
+
+
+def _errors(output: str):
+    """The messages of an output with errors in it (all but its "*** Error" lines)"""
+    if "*** Error" not in output:
+        return []
+    return [
+        line.strip()
+        for line in output.splitlines()
+        if line.strip() and "*** Error" not in line
+    ]
@@ -0,0 +1,525 @@
+"""
+Captures a stack of bulb exposures back to back: frames are saved to the
+camera's card and downloaded while the next one is exposing, rather than in
+between.  Progress is kept in a CaptureSession, which is journaled so that an
+interrupted stack can be resumed.
+"""
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+import math
+import os
+import time
+from typing import Awaitable, Callable
+
+import numpy as np
+import trio
+
+from ..analysis import FrameAnalyzer, missing_reader, thumbnail_path
+from .gphoto import GPhoto
+
+_log = logging.getLogger(__name__)
+
+# Called (with the index of the next frame) between exposures, e.g. to nudge
+# the mount.
+DitherFn = Callable[[int], Awaitable[None]]
+
+# eosremoterelease choices
+_PRESS = "5"  # Immediate
+_RELEASE = "11"
+
+
+@dataclass(frozen=True)
+class StackSettings:
+    frames: int = 1
+    exposure: float = 1.0  # seconds
+    iso: str = "800"
+    aperture: str = "4"
+    # imageformat choice: RAW, RAW + JPEG or JPEG
+    imageformat: str = "7"
+    directory: str = "/home/pi/captures/test-new/"
+    # Dither before every `dither_every`th frame (never, if 0).
+    dither_every: int = 0
+    # Offset from the starting position (at most, per axis), and time allowed
+    # for the mount to settle after dithering.
+    dither_steps: int = 20
+    dither_settle: float = 2.0  # seconds
+
+
+@dataclass
+class Frame:
+    index: int
+    # time.time_ns() at which the shutter opened and closed.
+    start_ns: int
+    end_ns: int
+    # Time since the previous frame's shutter closed: sky time lost.
+    dead_ns: int | None
+    # Where the frame's files are on the camera, and where they were saved.
+    camera_paths: list[str]
+    paths: list[str] = field(default_factory=list)
+    download_ns: int | None = None
+    # See analysis.analyze_frame
+    analysis: dict | None = None
+    rejected: bool = False
+
+
+JOURNAL = "stack.journal"
+
+
+@dataclass
+class CaptureSession:
+    """
+    The progress of a stack capture, appended (as JSON lines) to a journal
+    file as it's made.
+    """
+
+    settings: StackSettings
+    started_ns: int  # time.time_ns()
+    frames: list[Frame] = field(default_factory=list)
+    errors: int = 0
+    # running, stopped, finished or failed
+    state: str = "running"
+    journal: str | None = None
+    # Why frames aren't being analyzed (a reader isn't installed), if they
+    # aren't
+    analysis_skipped: str | None = None
+
+    @classmethod
+    def create(cls, settings: StackSettings, journal: str | None = None):
+        session = cls(settings, time.time_ns(), journal=journal)
+        if journal is not None:
+            # Starting over
+            with open(journal, "w"):
+                pass
+        session._record(
+            {"settings": asdict(settings), "started_ns": session.started_ns}
+        )
+        return session
+
+    @classmethod
+    def resume(cls, journal: str):
+        """Picks up the session recorded in journal where it left off"""
+        session = None
+        with open(journal) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Cut short (by a crash, say)
+                    break
+
+                if "settings" in record:
+                    session = cls(
+                        StackSettings(**record["settings"]),
+                        record["started_ns"],
+                        journal=journal,
+                    )
+                    continue
+                if session is None:
+                    raise ValueError(f"{journal} doesn't start with settings")
+
+                if "frame" in record:
+                    session.frames.append(Frame(**record["frame"]))
+                elif "saved" in record:
+                    index, path, download_ns = record["saved"]
+                    frame = session._frame(index)
+                    frame.paths.append(path)
+                    frame.download_ns = (frame.download_ns or 0) + download_ns
+                elif "analysis" in record:
+                    index, analysis = record["analysis"]
+                    session._frame(index).analysis = analysis
+                elif "rejected" in record:
+                    index, rejected = record["rejected"]
+                    session._frame(index).rejected = rejected
+                elif "error" in record:
+                    session.errors += 1
+
+        if session is None:
+            raise ValueError(f"{journal} is empty")
+        session.state = "running"
+        return session
+
+    @property
+    def next_index(self):
+        return self.frames[-1].index + 1 if self.frames else 0
+
+    @property
+    def complete(self):
+        return self.next_index >= self.settings.frames
+
+    def pending(self):
+        """Frames not yet (fully) downloaded"""
+        return [f for f in self.frames if len(f.paths) < len(f.camera_paths)]
+
+    def add_frame(self, frame: Frame):
+        self.frames.append(frame)
+        self._record({"frame": asdict(frame)})
+
+    def saved(self, frame: Frame, path: str, download_ns: int):
+        frame.paths.append(path)
+        frame.download_ns = (frame.download_ns or 0) + download_ns
+        self._record({"saved": [frame.index, path, download_ns]})
+
+    def analyzed(self, frame: Frame, analysis: dict):
+        frame.analysis = analysis
+        self._record({"analysis": [frame.index, analysis]})
+
+    def reject(self, index: int, rejected: bool = True):
+        frame = self._frame(index)
+        frame.rejected = rejected
+        self._record({"rejected": [index, rejected]})
+        return frame
+
+    def suspects(self):
+        """
+        Indices of frames that look bad next to the rest: with far fewer stars,
+        or much bigger ones (by half flux radius), than is typical
+        """
+        analyses = [
+            (f.index, f.analysis)
+            for f in self.frames
+            if f.analysis is not None and "error" not in f.analysis
+        ]
+        if not analyses:
+            return set()
+        stars = np.median([a["stars"] for _, a in analyses])
+        hfrs = [a["hfr"] for _, a in analyses if a["hfr"] is not None]
+        hfr = np.median(hfrs) if hfrs else None
+
+        return {
+            index
+            for index, a in analyses
+            if a["stars"] < 0.5 * stars
+            or (hfr is not None and a["hfr"] is not None and a["hfr"] > 1.5 * hfr)
+        }
+
+    def error(self, message: str):
+        self.errors += 1
+        self._record({"error": message})
+
+    def set_state(self, state: str):
+        self.state = state
+        self._record({"state": state})
+
+    def status(self):
+        now_ns = time.time_ns()
+        elapsed_s = (now_ns - self.started_ns) / 1e9
+        dead = [f.dead_ns for f in self.frames if f.dead_ns is not None]
+        exposed_s = sum(f.end_ns - f.start_ns for f in self.frames) / 1e9
+        suspects = self.suspects()
+        return {
+            "state": self.state,
+            "frames": len(self.frames),
+            "frames_total": self.settings.frames,
+            "next_index": self.next_index,
+            "errors": self.errors,
+            "started_ns": self.started_ns,
+            "elapsed_s": round(elapsed_s, 1),
+            "exposed_s": round(exposed_s, 1),
+            "frames_per_hour": (
+                round(len(self.frames) / elapsed_s * 3600, 1) if elapsed_s else None
+            ),
+            "mean_dead_ms": _ms(sum(dead) // len(dead)) if dead else None,
+            "pending_downloads": len(self.pending()),
+            "rejected": [f.index for f in self.frames if f.rejected],
+            "suspect": sorted(suspects),
+            "analysis_skipped": self.analysis_skipped,
+            "frame_list": [
+                {
+                    "index": f.index,
+                    "start_ns": f.start_ns,
+                    "exposure_ms": _ms(f.end_ns - f.start_ns),
+                    "dead_ms": _ms(f.dead_ns),
+                    "download_ms": _ms(f.download_ns),
+                    "paths": f.paths,
+                    # Without the histogram (see frame())
+                    "analysis": (
+                        None
+                        if f.analysis is None
+                        else {k: v for k, v in f.analysis.items() if k != "histogram"}
+                    ),
+                    "suspect": f.index in suspects,
+                    "rejected": f.rejected,
+                }
+                for f in self.frames
+            ],
+        }
+
+    def frame(self, index: int):
+        frame = self._frame(index)
+        return dict(asdict(frame), suspect=index in self.suspects())
+
+    def _frame(self, index: int):
+        for frame in reversed(self.frames):
+            if frame.index == index:
+                return frame
+        raise KeyError(index)
+
+    def _record(self, record: dict):
+        if self.journal is None:
+            return
+        try:
+            with open(self.journal, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            _log.warning(f"couldn't write to {self.journal}: {e}")
+
+
+class StackCapture:
+    """
+    Runs a stack capture.  While a frame exposes, the camera is free, so the
+    frames before it are downloaded, as long as (by how long downloads have
+    been taking) that won't hold up the end of the exposure.  Otherwise they
+    wait for the shutter to close.
+    """
+
+    session: CaptureSession
+
+    _camera: GPhoto
+    _dither: DitherFn | None
+    _analyzer: FrameAnalyzer | None
+    # trio.current_time() at which the current exposure ends (None if not
+    # exposing), and an event set (and replaced) when an exposure starts.
+    _window_end: float | None
+    _window_started: trio.Event
+    # Held by _expose from PRESS to RELEASE, and by downloads that don't fit
+    # in an exposure's window, so that they never hold the camera when it's
+    # time to close the shutter.
+    _shutter: trio.Lock
+    _done: bool
+    # How long a download takes (s), as a moving average.
+    _download_s: float
+
+    def __init__(
+        self,
+        camera: GPhoto,
+        session: CaptureSession,
+        dither: DitherFn | None = None,
+        analyzer: FrameAnalyzer | None = None,
+    ):
+        self.session = session
+        self._camera = camera
+        self._dither = dither
+        self._analyzer = analyzer
+        self._window_end = None
+        self._window_started = trio.Event()
+        self._shutter = trio.Lock()
+        self._done = False
+        # About what a RAW frame takes over USB 2, until we know better.
+        self._download_s = 3.0
+
+    @property
+    def settings(self):
+        return self.session.settings
+
+    @property
+    def files_per_frame(self):
+        return 2 if self.settings.imageformat == "6" else 1
+
+    async def run(self):
+        state = "failed"
+        try:
+            await self._run()
+            state = "finished"
+        except trio.Cancelled:
+            state = "stopped"
+            raise
+        except Exception as e:
+            self.session.error(str(e))
+            raise
+        finally:
+            self.session.set_state(state)
+
+    async def _run(self):
+        s = self.settings
+        # Configure once, for the whole stack.
+        await self._camera.runAsync(
+            "lcd " + s.directory,
+            "set-config capturetarget=1",
+            "set-config imageformat=" + s.imageformat,
+            "set-config-index picturestyle=1",
+            "set-config shutterspeed=bulb",
+            "set-config-value aperture=" + s.aperture,
+            "set-config iso=" + s.iso,
+        )
+
+        send, receive = trio.open_memory_channel[Frame](math.inf)
+        # Bounded: if analysis falls behind, frames go unanalyzed rather than
+        # piling up.
+        analyze_send, analyze_receive = trio.open_memory_channel[Frame](8)
+        async with trio.open_nursery() as n:
+            n.start_soon(self._download_loop, receive, analyze_send)
+            n.start_soon(self._analysis_loop, analyze_receive)
+            async with send:
+                # Anything left on the card (or unanalyzed) from before a
+                # resume
+                for frame in self.session.frames:
+                    if frame in self.session.pending() or frame.analysis is None:
+                        await send.send(frame)
+                try:
+                    await self._expose_loop(send)
+                finally:
+                    self._done = True
+                    self._window_started.set()
+
+    async def _expose_loop(self, send: trio.MemorySendChannel[Frame]):
+        s = self.settings
+        end_ns = None
+        for i in range(self.session.next_index, s.frames):
+            if self._dither is not None and s.dither_every and i:
+                if i % s.dither_every == 0:
+                    await self._dither(i)
+
+            try:
+                frame = await self._expose(i, end_ns)
+            except Exception as e:
+                self.session.error(f"frame {i}: {e}")
+                _log.warning(f"frame {i} failed", exc_info=e)
+                continue
+
+            end_ns = frame.end_ns
+            self.session.add_frame(frame)
+            _log.info(f"frame {i}: dead time {_ms(frame.dead_ns)}")
+            await send.send(frame)
+
+    async def _expose(self, index: int, previous_end_ns: int | None):
+        async with self._shutter:
+            start_ns = await self._release(_PRESS)
+
+            # Leave the camera to the downloader while the shutter's open.
+            self._window_end = trio.current_time() + self.settings.exposure
+            self._window_started.set()
+            self._window_started = trio.Event()
+            try:
+                await trio.sleep(self.settings.exposure)
+            finally:
+                self._window_end = None
+
+            end_ns = await self._release(_RELEASE)
+
+        # Until the frame's on the card
+        outputs = await self._camera.runAsync(
+            *["wait-event FILEADDED"] * self.files_per_frame, timeout=30.0
+        )
+
+        camera_paths = []
+        for output in outputs:
+            for line in output.splitlines():
+                # "FILEADDED <name> <folder>"
+                fields = line.split()
+                if len(fields) == 3 and fields[0] == "FILEADDED":
+                    camera_paths.append(fields[2].rstrip("/") + "/" + fields[1])
+
+        return Frame(
+            index,
+            start_ns,
+            end_ns,
+            None if previous_end_ns is None else start_ns - previous_end_ns,
+            camera_paths,
+        )
+
+    async def _release(self, choice: str):
+        """
+        Sets eosremoterelease, returning time.time_ns() half way through the
+        command: when the shutter's most likely to have moved
+        """
+        before_ns = time.time_ns()
+        await self._camera.runAsync(
+            "set-config eosremoterelease=" + choice, readback=False
+        )
+        return (before_ns + time.time_ns()) // 2
+
+    async def _download_loop(
+        self,
+        receive: trio.MemoryReceiveChannel[Frame],
+        analyze: trio.MemorySendChannel[Frame],
+    ):
+        async with receive, analyze:
+            async for frame in receive:
+                for camera_path in frame.camera_paths[len(frame.paths) :]:
+                    try:
+                        elapsed = await self._download(camera_path)
+                    except Exception as e:
+                        self.session.error(f"frame {frame.index}: {e}")
+                        _log.warning(f"couldn't download {camera_path}", exc_info=e)
+                        continue
+
+                    self._download_s = 0.7 * self._download_s + 0.3 * elapsed / 1e9
+                    path = os.path.join(
+                        self.settings.directory, camera_path.rsplit("/", 1)[-1]
+                    )
+                    self.session.saved(frame, path, elapsed)
+                    _log.info(f"frame {frame.index}: saved {path}")
+
+                if frame.paths and len(frame.paths) == len(frame.camera_paths):
+                    try:
+                        analyze.send_nowait(frame)
+                    except trio.WouldBlock:
+                        _log.warning(f"frame {frame.index}: not analyzed (behind)")
+
+    async def _analysis_loop(self, receive: trio.MemoryReceiveChannel[Frame]):
+        async with receive:
+            async for frame in receive:
+                if self._analyzer is None:
+                    continue
+                # JPEGs (when there are both) are quicker to read.
+                paths = sorted(
+                    frame.paths, key=lambda p: not p.lower().endswith(".jpg")
+                )
+                path = next((p for p in paths if missing_reader(p) is None), None)
+                if path is None:
+                    self._skip_analysis(missing_reader(paths[0]))
+                    continue
+                try:
+                    analysis = await self._analyzer.analyze(path, thumbnail_path(path))
+                except Exception as e:
+                    analysis = {"error": str(e)}
+                self.session.analyzed(frame, analysis)
+
+    def _skip_analysis(self, package: str | None):
+        if self.session.analysis_skipped is None:
+            self.session.analysis_skipped = (
+                f"{package} isn't installed (poetry install --with analysis)"
+            )
+            _log.warning(f"not analyzing frames: {self.session.analysis_skipped}")
+
+    async def _download(self, camera_path: str):
+        """Downloads a file from the card, returning how long it took (ns)"""
+
+        async def get():
+            start = time.perf_counter_ns()
+            await self._camera.runAsync("get " + camera_path, timeout=60.0)
+            return time.perf_counter_ns() - start
+
+        if await self._wait_for_window():
+            return await get()
+        # Between exposures (holding up the next one, rather than this one's
+        # end)
+        async with self._shutter:
+            return await get()
+
+    async def _wait_for_window(self):
+        """
+        Waits until a download would fit in what's left of an exposure (and
+        returns True), or returns False if it must go between exposures: when
+        they're too short (or the camera too slow) for it ever to fit, so as
+        not to leave the backlog to grow, or when there are none left.
+        """
+        while not self._done:
+            started = self._window_started
+            end = self._window_end
+            margin = 1.25 * self._download_s
+            if end is not None and trio.current_time() + margin < end:
+                return True
+            if self.settings.exposure < margin:
+                return False
+            await started.wait()
+        return False
+
+
+def _ms(ns: int | None):
+    return None if ns is None else round(ns / 1_000_000, 1)
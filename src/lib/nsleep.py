@@ -1,7 +1,11 @@
 import ctypes
+import errno
+import os
 import time
 
-_libc = ctypes.CDLL("libc.so.6")
+_libc = ctypes.CDLL("libc.so.6", use_errno=True)
+
+_TIMER_ABSTIME = 1
 
 
 class _Timespec(ctypes.Structure):
@@ -16,6 +20,13 @@ _libc.nanosleep.argtypes = [
     ctypes.POINTER(_Timespec),
 ]
 
+_libc.clock_nanosleep.argtypes = [
+    ctypes.c_int,
+    ctypes.c_int,
+    ctypes.POINTER(_Timespec),
+    ctypes.POINTER(_Timespec),
+]
+
 
 def nsleep(ns: int):
     req = _Timespec()
@@ -26,3 +37,34 @@ def nsleep(ns: int):
 
     while _libc.nanosleep(req, rem) == -1:
         req, rem = rem, req
+
+
+def sleep_until(deadline_ns: int, spin_ns: int = 0):
+    """
+    Sleep until time.monotonic_ns() reaches deadline_ns.
+
+    Unlike nsleep, the deadline is absolute, so time spent between reading the
+    clock and going to sleep doesn't accumulate as error.  When spin_ns is
+    non-zero, wake up that long before the deadline and busy-wait the rest of
+    the way, trading CPU for less wakeup jitter.
+    """
+    wake_ns = deadline_ns - spin_ns
+
+    req = _Timespec()
+    req.tv_sec = wake_ns // 1_000_000_000
+    req.tv_nsec = wake_ns % 1_000_000_000
+
+    # clock_nanosleep returns the error number directly, rather than setting
+    # errno.  With TIMER_ABSTIME, an interrupted sleep can just be restarted
+    # with the same request.
+    while (
+        err := _libc.clock_nanosleep(time.CLOCK_MONOTONIC, _TIMER_ABSTIME, req, None)
+    ) == errno.EINTR:
+        pass
+
+    if err != 0:
+        raise OSError(err, os.strerror(err))
+
+    if spin_ns > 0:
+        while time.monotonic_ns() < deadline_ns:
+            pass
@@ -1,9 +1,7 @@
-from threading import Lock
-
 import RPi.GPIO as GPIO
 
 from . import gpio
-from ..nsleep import nsleep
+from ..pulse import PulseGroup
 
 RA_PINS = dict(
     dir=gpio.RA_DIRECTION_PIN,
@@ -19,32 +17,13 @@ DEC_PINS = dict(
 
 PULSE_NS = 50_000
 
-# TODO: Figure out a nicer way to avoid simultaneous pulses clashing.
-_PULSE_LOCK = Lock()
+# Both axes pulse through the same group, so that pulses that coincide share
+# their edges, while the others go out concurrently.
+_PULSES = PulseGroup(GPIO.output, PULSE_NS)
 
 
 def step(pins, dir):
-    with _PULSE_LOCK:
-        _leading(pins, dir)
-        # Propagation
-        nsleep(PULSE_NS)
-        _trailing(pins)
-
-
-def _leading(pins: dict, dir):
-    # Set direction; forward=0 backward=1
-    GPIO.output(pins["dir"], dir)
-    # Enable Motor
-    GPIO.output(pins["en"], 0)
-    # Rising Edge
-    GPIO.output(pins["pul"], 1)
-
-
-def _trailing(pins: dict):
-    # Falling Edge
-    GPIO.output(pins["pul"], 0)
-    # Disable Motor
-    GPIO.output(pins["en"], 1)
+    _PULSES.step(pins, dir)
 
 
 def ra_step(dir):
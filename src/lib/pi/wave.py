@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from collections import deque
+import os
+from threading import Condition, Thread
+import time
+
+import numpy as np
+import pigpio
+
+# Keep these in sync with lib.pi.motor.
+PULSE_US = 50
+DIR_SETUP_US = 5
+
+# Each wave covers this much time, for every axis.
+WAVE_NS = 10_000_000
+# A wave is built this long before the one ahead of it finishes, leaving time to
+# create and queue it (and for the axes to have submitted their steps).
+LEAD_NS = 5_000_000
+# Time allowed for building and queueing a wave, when nothing is transmitting.
+_START_MARGIN_NS = 2_000_000
+
+
+class PigpioWaveDriver:
+    """
+    Drives the step pulses of every axis with pigpiod's waveforms, through one
+    connection.  pigpiod has a single wave buffer and transmitter, so rather
+    than each axis sending its own waves, the steps each axis submits (see
+    axis) are merged, in time order, into one wave per WAVE_NS window, which a
+    sender thread chains after the previous one with WAVE_MODE_ONE_SHOT_SYNC.
+    Pulse timing doesn't depend on Python (or the GIL) at all.
+
+    It connects (and starts its thread) on the first submit, so that it can be
+    created before the control process is forked.
+    """
+
+    _pi: pigpio.pi | None
+    # The process that connected
+    _pid: int | None
+    # Guards everything, including making and sending waves.
+    _cond: Condition
+    _axes: list[PigpioWaveBackend]
+    # Wave ids that have been sent, oldest first.
+    _waves: deque[int]
+    # time.monotonic_ns() at which the most recently sent wave will finish.
+    _end_ns: int
+    _closed: bool
+    _thread: Thread | None
+
+    def __init__(self):
+        self._pi = None
+        self._pid = None
+        self._cond = Condition()
+        self._axes = []
+        self._waves = deque()
+        self._end_ns = 0
+        self._closed = False
+        self._thread = None
+
+    def axis(self, pins: dict, fwd: int = 1, rev: int = 0) -> PigpioWaveBackend:
+        """A PulseBackend for the axis on pins (as in lib.pi.motor)"""
+        with self._cond:
+            if self._pi is not None:
+                raise RuntimeError("axes must be added before stepping starts")
+            axis = PigpioWaveBackend(self, pins, fwd, rev)
+            self._axes.append(axis)
+            return axis
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        thread.join()
+
+        assert self._pi is not None
+        self._pi.wave_tx_stop()
+        while self._waves:
+            self._pi.wave_delete(self._waves.popleft())
+        self._pi.stop()
+
+    def _submitted(self):
+        """Called (holding _cond) when an axis has submitted steps"""
+        if self._pi is None:
+            self._connect()
+        self._cond.notify_all()
+
+    def _connect(self):
+        pi = pigpio.pi()
+        if not pi.connected:
+            raise RuntimeError("unable to connect to pigpiod")
+        for axis in self._axes:
+            for pin in axis.pins.values():
+                pi.set_mode(pin, pigpio.OUTPUT)
+
+        self._pi = pi
+        self._pid = os.getpid()
+        self._thread = Thread(target=self._send_loop, name="pigpio waves", daemon=True)
+        self._thread.start()
+
+    def _send_loop(self):
+        with self._cond:
+            while not self._closed:
+                self._reap()
+
+                first_ns = min(
+                    (a.first_ns for a in self._axes if a.first_ns is not None),
+                    default=None,
+                )
+                if first_ns is None:
+                    self._cond.wait()
+                    continue
+
+                now = time.monotonic_ns()
+                if self._end_ns > now:
+                    # Follow on from the wave that's queued, once it's nearly
+                    # done.
+                    start_ns = self._end_ns
+                    if now < start_ns - LEAD_NS:
+                        self._cond.wait((start_ns - LEAD_NS - now) / 1e9)
+                        continue
+                else:
+                    start_ns = now + _START_MARGIN_NS
+                    if first_ns > start_ns + WAVE_NS:
+                        self._cond.wait((first_ns - start_ns - WAVE_NS) / 1e9)
+                        continue
+
+                if not self._send(start_ns, start_ns + WAVE_NS):
+                    # Nothing due in this window: wait for the first step's
+                    # (or for more steps).
+                    self._cond.wait(max(first_ns - WAVE_NS - now, 1_000_000) / 1e9)
+
+    def _send(self, start_ns: int, end_ns: int):
+        """
+        Sends the steps (of every axis) due before end_ns as one wave starting
+        at start_ns.  Returns False if there were none.
+        """
+        assert self._pi is not None
+
+        # (t_us, phase, on, off) of every edge.  Edges at the same time are
+        # merged, with falling edges and direction changes (phase 0) before
+        # rising edges (phase 1).
+        edges: dict[tuple[int, int], list[int]] = {}
+        t_end_us = 0
+        for axis in self._axes:
+            for t_us, phase, on, off in axis.take(start_ns, end_ns):
+                masks = edges.setdefault((t_us, phase), [0, 0])
+                masks[0] |= on
+                masks[1] |= off
+                t_end_us = max(t_end_us, t_us)
+        if not edges:
+            return False
+
+        # Padded to the whole window, so that the next wave starts on time.
+        t_end_us = max(t_end_us, (end_ns - start_ns) // 1_000)
+        times = sorted(edges)
+        pulses = []
+        if times[0][0] > 0:
+            pulses.append(pigpio.pulse(0, 0, times[0][0]))
+        for (t_us, phase), next in zip(times, times[1:] + [(t_end_us, 0)]):
+            on, off = edges[(t_us, phase)]
+            pulses.append(pigpio.pulse(on, off, next[0] - t_us))
+
+        self._pi.wave_add_new()
+        self._pi.wave_add_generic(pulses)
+        wid = self._pi.wave_create()
+        self._pi.wave_send_using_mode(wid, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+
+        self._waves.append(wid)
+        self._end_ns = start_ns + t_end_us * 1_000
+        return True
+
+    def _reap(self):
+        """Deletes (our) waves that have finished transmitting"""
+        assert self._pi is not None
+        current = None
+        if self._pi.wave_tx_busy():
+            current = self._pi.wave_tx_at()
+            if current not in self._waves:
+                # (Not ours, or not started yet: leave them all be.)
+                return
+
+        while self._waves and self._waves[0] != current:
+            self._pi.wave_delete(self._waves.popleft())
+
+
+class PigpioWaveBackend:
+    """
+    PulseBackend for one axis of a PigpioWaveDriver.  Submitted steps wait
+    (in the driver) for the wave covering their deadlines.
+    """
+
+    pins: dict
+
+    _driver: PigpioWaveDriver
+    _fwd: int
+    _rev: int
+    # Steps not yet put in a wave, guarded by the driver's lock
+    _deadlines: np.ndarray
+    _dirs: np.ndarray
+    # The level the DIR pin was last set to, and time.monotonic_ns() at which
+    # the last step's pulse ends.
+    _dir: int | None
+    _free_ns: int
+
+    def __init__(self, driver: PigpioWaveDriver, pins: dict, fwd: int, rev: int):
+        self.pins = pins
+        self._driver = driver
+        self._fwd = fwd
+        self._rev = rev
+        self._deadlines = np.empty(0, dtype=np.int64)
+        self._dirs = np.empty(0, dtype=np.int8)
+        self._dir = None
+        self._free_ns = 0
+
+    def submit(self, deadlines: np.ndarray, dirs: np.ndarray, /) -> None:
+        with self._driver._cond:
+            self._deadlines = np.concatenate([self._deadlines, deadlines])
+            self._dirs = np.concatenate([self._dirs, dirs])
+            self._driver._submitted()
+
+    @property
+    def first_ns(self) -> int | None:
+        return int(self._deadlines[0]) if len(self._deadlines) else None
+
+    def take(self, start_ns: int, end_ns: int):
+        """
+        Removes the steps due before end_ns, and returns their edges as
+        (t_us, phase, on, off) tuples, in microseconds from start_ns
+        """
+        n = int(np.searchsorted(self._deadlines, end_ns))
+        deadlines = self._deadlines[:n].tolist()
+        dirs = self._dirs[:n].tolist()
+        self._deadlines = self._deadlines[n:]
+        self._dirs = self._dirs[n:]
+
+        pul = 1 << self.pins["pul"]
+        en = 1 << self.pins["en"]
+        dir_bit = 1 << self.pins["dir"]
+
+        edges = []
+        # Not before this axis' previous pulse has ended
+        free_us = max((self._free_ns - start_ns) // 1_000, 0)
+        for deadline, d in zip(deadlines, dirs):
+            # Steps that are already late go out as soon as possible.
+            at_us = max((deadline - start_ns) // 1_000, free_us)
+
+            level = self._fwd if d > 0 else self._rev
+            if level != self._dir:
+                # Leave at least the setup time before the rising edge.
+                dir_us = max(at_us - DIR_SETUP_US, free_us)
+                at_us = dir_us + DIR_SETUP_US
+                edges.append(
+                    (dir_us, 0, dir_bit if level else 0, 0 if level else dir_bit)
+                )
+                self._dir = level
+
+            # Mirror lib.pi.motor.step: enable and raise PUL, then lower PUL
+            # and disable.
+            edges.append((at_us, 1, pul, en))
+            edges.append((at_us + PULSE_US, 0, en, pul))
+            free_us = at_us + PULSE_US
+
+        self._free_ns = start_ns + free_us * 1_000
+        return edges
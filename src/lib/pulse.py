@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+from threading import Event, Lock
+import time
+from typing import Protocol
+
+import numpy as np
+
+from .nsleep import nsleep
+
+EDGE_DTYPE = np.dtype(
+    [
+        ("t_ns", np.int64),  # time.monotonic_ns() of the edge
+        ("level", np.int8),  # 1 for rising, 0 for falling
+        ("dir", np.int8),  # StepDir of the step
+    ]
+)
+
+
+class SimulatedPulseBackend:
+    """
+    Stand-in for a hardware-timed pulse backend (see lib.pi.wave), for running
+    without a Pi.  Rather than driving pins, it records the edges the hardware
+    would produce into a fixed-size ring buffer.
+    """
+
+    _pulse_ns: int
+    _lock: Lock
+    _edges: np.ndarray
+    _count: int
+
+    def __init__(self, pulse_ns: int = 50_000, capacity: int = 1 << 16):
+        self._pulse_ns = pulse_ns
+        self._lock = Lock()
+        self._edges = np.zeros(capacity, dtype=EDGE_DTYPE)
+        self._count = 0
+
+    def submit(self, deadlines: np.ndarray, dirs: np.ndarray, /) -> None:
+        edges = np.empty(2 * len(deadlines), dtype=EDGE_DTYPE)
+        edges["t_ns"][0::2] = deadlines
+        edges["t_ns"][1::2] = deadlines + self._pulse_ns
+        edges["level"][0::2] = 1
+        edges["level"][1::2] = 0
+        edges["dir"][0::2] = dirs
+        edges["dir"][1::2] = dirs
+
+        capacity = len(self._edges)
+        with self._lock:
+            # Only the newest `capacity` edges can survive anyway.
+            edges = edges[-capacity:]
+            idx = (self._count + np.arange(len(edges))) % capacity
+            self._edges[idx] = edges
+            self._count += len(edges)
+
+    @property
+    def count(self):
+        """Total number of edges recorded, including any that were overwritten"""
+        with self._lock:
+            return self._count
+
+    def edges(self) -> np.ndarray:
+        """Returns the recorded edges still in the buffer, oldest first"""
+        capacity = len(self._edges)
+        with self._lock:
+            if self._count <= capacity:
+                return self._edges[: self._count].copy()
+            start = self._count % capacity
+            return np.concatenate([self._edges[start:], self._edges[:start]])
+
+
+class _Batch:
+    start_ns: int
+    pins: list[dict]
+    done: Event
+
+    def __init__(self, start_ns: int, pins: dict):
+        self.start_ns = start_ns
+        self.pins = [pins]
+        self.done = Event()
+
+
+class PulseGroup:
+    """
+    Generates step pulses for several axes that share an output function,
+    without serializing them.
+
+    An axis that starts a pulse holds its rising edge for coincide_ns, the
+    gather window.  Any other axis that steps within the window joins its
+    batch: every PUL pin in the batch goes up in one output call, and comes
+    down pulse_ns later in another, so each gets its full pulse.  Otherwise,
+    axes pulse independently.  The lock only covers bookkeeping and pin
+    writes, never the sleeps.
+
+    Pins are dicts with "dir", "en" and "pul" keys, as in lib.pi.motor.
+    """
+
+    _output: _OutputFn
+    _pulse_ns: int
+    _coincide_ns: int
+    _lock: Lock
+    _open: _Batch | None
+
+    def __init__(
+        self,
+        output: _OutputFn,
+        pulse_ns: int = 50_000,
+        coincide_ns: int = 20_000,
+    ):
+        self._output = output
+        self._pulse_ns = pulse_ns
+        self._coincide_ns = coincide_ns
+        self._lock = Lock()
+        self._open = None
+
+    def step(self, pins: dict, dir: int):
+        with self._lock:
+            batch = self._open
+            if batch is not None:
+                # Joins a batch that's still gathering.  Whoever started it
+                # will raise and lower this one's pulse too.
+                batch.pins.append(pins)
+                leader = False
+            else:
+                batch = _Batch(time.monotonic_ns(), pins)
+                self._open = batch
+                leader = True
+            self._setup(pins, dir)
+
+        if not leader:
+            batch.done.wait()
+            return
+
+        nsleep(self._coincide_ns)
+        with self._lock:
+            self._open = None
+            self._rising(batch.pins)
+
+        # Propagation
+        nsleep(self._pulse_ns)
+
+        with self._lock:
+            self._trailing(batch.pins)
+        batch.done.set()
+
+    def _setup(self, pins: dict, dir: int):
+        # Set direction, enable motor
+        self._output([pins["dir"], pins["en"]], [dir, 0])
+
+    def _rising(self, pins: list[dict]):
+        self._output([p["pul"] for p in pins], [1] * len(pins))
+
+    def _trailing(self, pins: list[dict]):
+        # Falling edges, disable motors
+        channels = []
+        for p in pins:
+            channels += [p["pul"], p["en"]]
+        self._output(channels, [0, 1] * len(pins))
+
+
+class _OutputFn(Protocol):
+    def __call__(self, channels: list[int], values: list[int], /) -> None:
+        ...
@@ -0,0 +1,85 @@
+"""
+A fixed layout struct in shared memory, written by one process and read by
+others without locks or IPC: the writer bumps a sequence number to odd before
+writing and back to even after, and readers retry until they see the same even
+number on both sides of their read.
+
+    state = SharedStruct("<qqd")  # in the parent, before starting the child
+    state.write(1, 2, 3.0)        # in the child
+    state.read()                  # in the parent: (1, 2, 3.0)
+"""
+from __future__ import annotations
+
+from multiprocessing import shared_memory
+import struct
+import time
+
+_SEQ = struct.Struct("<Q")
+
+
+class SharedStruct:
+    """
+    Values of a struct format, in a shared memory block.  Pickles (e.g. to
+    a spawned process) as a reference to the same block.
+
+    CPython has no memory barriers to offer, so on a weakly ordered CPU a
+    read could (very rarely) mix fields of two writes.  That's fine for state
+    that's reported, but don't make decisions on it.
+    """
+
+    _format: struct.Struct
+    _shm: shared_memory.SharedMemory
+    _owner: bool
+    # The values of the last consistent read, to fall back on
+    _last: tuple
+
+    def __init__(self, format: str, name: str | None = None):
+        self._format = struct.Struct(format)
+        self._owner = name is None
+        self._last = tuple(self._format.unpack(bytes(self._format.size)))
+        if name is None:
+            # (Zeroed, as new shared memory is.)
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=_SEQ.size + self._format.size
+            )
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+
+    def __reduce__(self):
+        return SharedStruct, (self._format.format, self._shm.name)
+
+    def write(self, *values):
+        """Only ever from one process (and thread)"""
+        buf = self._shm.buf
+        (seq,) = _SEQ.unpack_from(buf, 0)
+        _SEQ.pack_into(buf, 0, seq + 1)
+        self._format.pack_into(buf, _SEQ.size, *values)
+        _SEQ.pack_into(buf, 0, seq + 2)
+
+    def read(self, timeout: float = 1.0) -> tuple:
+        """
+        The values last written (all zero before the first write).  If a
+        consistent read can't be had within timeout (the writer died
+        mid-write?), the values of the last one that could be.
+        """
+        buf = self._shm.buf
+        deadline = None
+        while True:
+            (before,) = _SEQ.unpack_from(buf, 0)
+            values = self._format.unpack_from(buf, _SEQ.size)
+            (after,) = _SEQ.unpack_from(buf, 0)
+            if before == after and not before & 1:
+                self._last = values
+                return values
+
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                return self._last
+            # Let the writer finish.
+            time.sleep(0)
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
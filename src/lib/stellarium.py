@@ -2,12 +2,14 @@ from __future__ import annotations
 import logging
 import math
 import struct
+import time
 
 from astropy.coordinates import ICRS, SkyCoord
 import astropy.units as u
 import trio
 
 from .. import telescope_control as tc
+from . import threads
 
 _log = logging.getLogger(__name__)
 
@@ -32,97 +34,246 @@ def encode_dec(x: float):
     return int(x * 2 / math.pi * 0x40000000)
 
 
+# Positions are reported every FAST_INTERVAL while the reported position is
+# moving faster than SLEW_SPEED (much faster than the sky turns), and every
+# SLOW_INTERVAL otherwise.
+FAST_INTERVAL = 0.1
+SLOW_INTERVAL = 1.0
+SLEW_SPEED = 60 * u.arcsec / u.s  # pyright: ignore
+# An unchanged position (while tracking) is only re-sent this often.
+KEEPALIVE_INTERVAL = 3.0
+
+
+def encode_position(pos: SkyCoord, t_us: int = 0) -> bytes:
+    """A position message (MessageCurrentPosition), as sent to Stellarium"""
+    ra: float = pos.ra.to(u.hourangle) / (24 * u.hourangle) * 86_400  # pyright: ignore
+    dec: float = pos.dec.to(u.rad).value  # pyright: ignore
+
+    return struct.pack("<hhQLll", 24, 0, t_us, encode_ra(ra), encode_dec(dec), 0)
+
+
+class PositionBroadcaster:
+    """
+    Works out the telescope's position (and encodes it) once per tick, however
+    many clients it's reported to, and only while there are any.  The tick
+    speeds up while slewing and slows down when not.
+    """
+
+    _telescope: tc.TelescopeControl
+    _packet: bytes | None
+    # Incremented with each new packet
+    _version: int
+    _updated: trio.Event
+    _clients: int
+    _connected: trio.Event
+
+    def __init__(self, telescope: tc.TelescopeControl):
+        self._telescope = telescope
+        self._packet = None
+        self._version = 0
+        self._updated = trio.Event()
+        self._clients = 0
+        self._connected = trio.Event()
+
+    async def run(self):
+        prev: tuple[SkyCoord, int] | None = None
+        sent_ns = 0
+
+        while True:
+            if not self._clients:
+                prev = None
+                self._connected = trio.Event()
+                await self._connected.wait()
+
+            pos, now_ns, slewing = await trio.to_thread.run_sync(
+                self._sample, prev, limiter=threads.POSITIONS
+            )
+            interval = FAST_INTERVAL if slewing else SLOW_INTERVAL
+            prev = pos, now_ns
+
+            packet = encode_position(pos, now_ns // 1000)
+            # (Apart from the time, which always changes)
+            moved = self._packet is None or packet[12:] != self._packet[12:]
+            if moved or now_ns - sent_ns >= KEEPALIVE_INTERVAL * 1e9:
+                sent_ns = now_ns
+                self._publish(packet)
+
+            await trio.sleep(interval)
+
+    async def report_to(self, stream: trio.SocketStream):
+        """Sends each new position to stream, skipping any it's too slow for"""
+        self._clients += 1
+        self._connected.set()
+        try:
+            version = 0
+            while True:
+                while self._version == version:
+                    await self._updated.wait()
+                version = self._version
+                assert self._packet is not None
+                await stream.send_all(self._packet)
+        finally:
+            self._clients -= 1
+
+    def _sample(self, prev: tuple[SkyCoord, int] | None):
+        """The current position, its time, and whether it's moving quickly"""
+        pos = self._telescope.current_skycoord()
+        now_ns = time.time_ns()
+        if prev is None:
+            return pos, now_ns, False
+        prev_pos, prev_ns = prev
+        speed = prev_pos.separation(pos) / ((now_ns - prev_ns) * u.ns)
+        return pos, now_ns, bool(speed > SLEW_SPEED)
+
+    def _publish(self, packet: bytes):
+        self._packet = packet
+        self._version += 1
+        self._updated.set()
+        self._updated = trio.Event()
+
+
 async def serve(host: str, port: int, telescope: tc.TelescopeControl):
+    positions = PositionBroadcaster(telescope)
+
     async def handler(stream: trio.SocketStream):
         _log.info("connected")
         try:
             async with trio.open_nursery() as n:
-                n.start_soon(_report_position_loop, stream, telescope)
+                n.start_soon(positions.report_to, stream)
                 n.start_soon(_receive_target_loop, stream, telescope)
         except (trio.BrokenResourceError, EndOfStream):
             _log.info("disconnected")
+        except ProtocolError as e:
+            _log.warning(f"disconnecting: {e}")
         except Exception as e:
             _log.error("disconnecting", exc_info=e)
 
-    await trio.serve_tcp(handler, port=port, host=host)
-
-
-async def _report_position_loop(
-    stream: trio.SocketStream, telescope: tc.TelescopeControl
-):
-    while True:
-        pos = telescope.current_skycoord()
-        await _report_position(stream, pos)
-        await trio.sleep(0.5)
-
-
-async def _report_position(stream: trio.SocketStream, pos: SkyCoord):
-    # FIXME: Send a real time value
-    t_raw = 0
-
-    ra: float = pos.ra.to(u.hourangle) / (24 * u.hourangle) * 86_400  # pyright: ignore
-    dec: float = pos.dec.to(u.rad).value  # pyright: ignore
-
-    await stream.send_all(
-        struct.pack(
-            "<hhQLll",
-            24,
-            0,
-            t_raw,
-            encode_ra(ra),
-            encode_dec(dec),
-            0,
-        )
-    )
+    async with trio.open_nursery() as n:
+        n.start_soon(positions.run)
+        await trio.serve_tcp(handler, port=port, host=host)
 
 
 class EndOfStream(Exception):
     pass
 
 
-async def receive_exactly(stream: trio.SocketStream, count: int):
-    data = b""
-    while len(data) < count:
-        with trio.move_on_after(1):
-            more = await stream.receive_some(count - len(data))
-            if not more:
-                raise EndOfStream
-            data += more
-    return data
-
-
-async def _receive_target_loop(
-    stream: trio.SocketStream, telescope: tc.TelescopeControl
-):
-    while True:
-        if not await _read_target(stream, telescope):
-            await trio.sleep(0.1)
-
-
-async def _read_target(stream: trio.SocketStream, telescope: tc.TelescopeControl):
-    # Read msg length and type
-    header = await receive_exactly(stream, 4)
-    if not header:
-        return False
-
-    msglen, msgtype = struct.unpack("<hh", header)
+class ProtocolError(Exception):
+    pass
 
-    # The protocol only defines one message type: 0
-    assert msgtype == 0
-    # Read the rest of the message (don't include the header count)
-    body = await receive_exactly(stream, msglen - 4)
 
-    # Unpack raw data
-    _, ra_raw, dec_raw = struct.unpack("<QLl", body)
+# Message length (including the header) and type
+HEADER = struct.Struct("<hh")
+# Goto (MessageGoto): time, RA and DEC
+GOTO = struct.Struct("<QLl")
+MSG_GOTO = 0
+
+
+class MessageReader:
+    """
+    Splits what's received on a socket into messages, reading into (and
+    parsing out of) one buffer.  Messages of unknown types are skipped, however
+    long.
+    """
+
+    _socket: trio.socket.SocketType
+    _buffer: bytearray
+    _view: memoryview
+    # The unparsed bytes are _buffer[_start:_end].
+    _start: int
+    _end: int
+    # Bytes still to be dropped, of an unknown message longer than the buffer
+    _skip: int
+
+    def __init__(self, socket: trio.socket.SocketType, size: int = 4096):
+        self._socket = socket
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._skip = 0
+
+    async def receive(self) -> list[tuple[int, memoryview]]:
+        """
+        Waits for at least one message and returns all of those received so
+        far, as (type, body).  The bodies are views into the buffer, only good
+        until the next call.
+        """
+        while True:
+            messages = self._parse()
+            if messages:
+                return messages
+
+            if self._end == len(self._buffer):
+                # Move the partial message at the end to the start.
+                pending = self._end - self._start
+                self._buffer[:pending] = self._buffer[self._start : self._end]
+                self._start, self._end = 0, pending
+
+            count = await self._socket.recv_into(self._view[self._end :])
+            if not count:
+                raise EndOfStream
+            self._end += count
+
+    def _parse(self):
+        messages = []
+        while True:
+            if self._skip:
+                dropped = min(self._skip, self._end - self._start)
+                self._skip -= dropped
+                self._start += dropped
+                if self._skip:
+                    break
+
+            if self._end - self._start < HEADER.size:
+                break
+            length, type = HEADER.unpack_from(self._buffer, self._start)
+            if length < HEADER.size:
+                raise ProtocolError(f"message length {length}")
+
+            if type != MSG_GOTO and length > len(self._buffer):
+                _log.warning(f"skipping message of unknown type {type}")
+                self._start += HEADER.size
+                self._skip = length - HEADER.size
+                continue
+            if length > len(self._buffer):
+                raise ProtocolError(f"message length {length}")
+            if self._end - self._start < length:
+                break
+
+            body = self._view[self._start + HEADER.size : self._start + length]
+            self._start += length
+            if type != MSG_GOTO:
+                _log.warning(f"skipping message of unknown type {type}")
+            elif len(body) < GOTO.size:
+                _log.warning(f"skipping goto message of {len(body)} bytes")
+            else:
+                messages.append((type, body))
+
+        if self._start == self._end:
+            self._start = self._end = 0
+        return messages
+
+
+def decode_goto(body: memoryview | bytes) -> SkyCoord:
     # TODO: Use the time given by Stellarium for something?
+    _, ra_raw, dec_raw = GOTO.unpack_from(body)
 
-    coord = SkyCoord(
+    return SkyCoord(
         (decode_ra(ra_raw) / 3600) * u.hourangle,  # pyright: ignore
         decode_dec(dec_raw) * u.rad,
         frame=ICRS,
     )
 
-    _log.info(f"target: {coord}")
-    telescope.track(tc.FixedTarget(coord))
 
-    return True
+async def _receive_target_loop(
+    stream: trio.SocketStream, telescope: tc.TelescopeControl
+):
+    reader = MessageReader(stream.socket)
+    while True:
+        messages = await reader.receive()
+        # Of a burst of gotos, only the last one matters.
+        _, body = messages[-1]
+        coord = decode_goto(body)
+
+        _log.info(f"target: {coord}")
+        telescope.track(tc.FixedTarget(coord))
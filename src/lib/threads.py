@@ -0,0 +1,19 @@
+"""
+Limits on worker threads for blocking work, one per kind of work, so that e.g.
+a slow camera can't hold up coordinate transforms (or vice versa), and none of
+it holds up the event loop.
+
+    await trio.to_thread.run_sync(fn, *args, limiter=threads.ASTROPY)
+"""
+import trio
+
+# Coordinate transforms and ephemeris fits (which may query JPL or the MPC).
+ASTROPY = trio.CapacityLimiter(2)
+# Name resolution, which may go to Sesame.
+NAMES = trio.CapacityLimiter(2)
+# Positions reported to Stellarium.  Kept apart from ASTROPY so that they keep
+# flowing while a slow fit is in progress.
+POSITIONS = trio.CapacityLimiter(1)
+# Anything that talks to the camera (through the gphoto2 shell session): it
+# only takes one client at a time.
+CAMERA = trio.CapacityLimiter(1)
@@ -14,6 +14,10 @@ from .lib import stellarium
 from .lib.nsleep import nsleep
 from .stepper import StepDir, Stepper, StepperConfig
 from . import appserver
+from .analysis import FrameAnalyzer
+from .gphoto2.gphoto import FAKE_CAMERA_COMMAND, GPhoto
+from .gphoto2.session import ShellSession
+from .names import NameIndex
 from . import telescope_control as tc
 
 _log = logging.getLogger(__name__)
@@ -49,11 +53,70 @@ async def main():
         help="When set, run in virtual mode (only serving to Stellarium, no motor control)",
     )
 
+    parser.add_argument(
+        "--waveform",
+        action="store_true",
+        default=False,
+        help="When set, generate hardware-timed pulse trains with pigpio (simulated in virtual mode)",
+    )
+
+    parser.add_argument(
+        "--ephemeris-cache",
+        default=os.path.expanduser("~/.cache/star-tracker/ephemeris"),
+        help="Directory in which to keep fitted ephemerides of moving targets",
+    )
+
+    parser.add_argument(
+        "--ephemeris-file",
+        default=None,
+        help="CSV file (name,unix_s,ra_deg,dec_deg) to use in place of live ephemerides, e.g. when offline",
+    )
+
+    parser.add_argument(
+        "--names-db",
+        default=os.path.expanduser("~/.cache/star-tracker/names.sqlite"),
+        help="SQLite database in which to keep resolved object names",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=False,
+        help="When set, only resolve names already in the names database (no online lookups)",
+    )
+
+    parser.add_argument(
+        "--fake-camera",
+        action="store_true",
+        default=False,
+        help="When set, use a simulated camera in place of gphoto2",
+    )
+
+    parser.add_argument(
+        "--analysis-workers",
+        type=int,
+        default=1,
+        help="Number of (low priority) processes in which to analyze captured frames",
+    )
+
     args = parser.parse_args()
 
-    if args.virtual:
+    if args.virtual and args.waveform:
+        from .lib.pulse import SimulatedPulseBackend
+
+        bearing_pulse = SimulatedPulseBackend()
+        dec_pulse = SimulatedPulseBackend()
+    elif args.virtual:
         bearing_pulse = virtual_pulse("bearing")
         dec_pulse = virtual_pulse("dec")
+    elif args.waveform:
+        from .lib.pi import motor
+        from .lib.pi.wave import PigpioWaveDriver
+
+        # pigpiod has one wave transmitter, so both axes go through one driver.
+        waves = PigpioWaveDriver()
+        bearing_pulse = waves.axis(motor.RA_PINS)
+        dec_pulse = waves.axis(motor.DEC_PINS)
     else:
         from .lib.pi import gpio, motor
 
@@ -87,10 +150,19 @@ async def main():
                 ),
             ),
             location=STEPHEN_HOUSE,
+            ephemeris_cache_dir=args.ephemeris_cache,
+            ephemeris_stand_in=args.ephemeris_file,
         ),
     )
 
-    app = appserver.create_app(telescope)
+    names = NameIndex(args.names_db, offline=args.offline)
+    if args.fake_camera:
+        camera = GPhoto(ShellSession(FAKE_CAMERA_COMMAND))
+    else:
+        camera = GPhoto()
+
+    analyzer = FrameAnalyzer(workers=args.analysis_workers)
+    app = appserver.create_app(telescope, names, camera, analyzer)
 
     try:
         with trio.open_signal_receiver(signal.SIGTERM) as sigs:
@@ -105,6 +177,8 @@ async def main():
 
     except KeyboardInterrupt:
         pass
+    finally:
+        analyzer.close()
 
 
 def virtual_pulse(name: str):
@@ -130,42 +130,181 @@ def trapz_opt_v_c_and_t_to_intercept(
     return v_c, t
 
 
-def pulse_times_linaccel(
-    steps: int,  # signed step count
+def _linaccel_times(
+    s: np.ndarray,  # signed travel at each pulse
     u: float,  # initial velocity
-    a: float,  # accelration
+    a: float,  # acceleration
+    forward: bool,
 ):
-    if steps == 0:
-        return np.array([])
-
-    s = np.linspace(math.copysign(1, steps), steps, abs(steps))
     # TODO: I'm not wild about this np.clip, but I'm getting nan for the final
     # value (but only sometimes, especially in Stepper _plan_abort).
     common = np.sqrt(np.clip(2 * a * s + u**2, 0, None))
 
-    # print(f"{num:10}{round(u, 2):10}{a:10}{round(common[0], 2):10}")
     # TODO: Prove that this is the right way to choose which root is correct.
-    if math.copysign(steps, common[0]) == steps:
+    if forward:
         return -(u - common) / a
     else:
         return -(u + common) / a
 
 
+def _pulse_travel(steps: int, offset: float):
+    """
+    Signed travel at which each of `steps` pulses occurs.  Pulse k (counting
+    from 1) happens after travelling k - offset steps, so offset is how far
+    toward the first pulse we've already come.
+    """
+    return np.linspace(math.copysign(1, steps), steps, abs(steps)) - math.copysign(
+        offset, steps
+    )
+
+
+def pulse_times_linaccel(
+    steps: int,  # signed step count
+    u: float,  # initial velocity
+    a: float,  # accelration
+    offset: float = 0,  # travel already made toward the first step
+):
+    if steps == 0:
+        return np.array([])
+
+    return _linaccel_times(_pulse_travel(steps, offset), u, a, steps > 0)
+
+
 def pulse_times_constant(
     steps: int,  # signed step count
     v: float,  # velocity
+    offset: float = 0,  # travel already made toward the first step
 ):
-    s = np.linspace(math.copysign(1, steps), steps, abs(steps))
-    return s / v
+    return _pulse_travel(steps, offset) / v
 
 
-def _discretize_trapz_accel(s_in: float, s_out: float, steps: int):
-    steps_in = int(np.trunc(s_in))
-    steps_out = int(np.trunc(s_out))
+def trapz_pulse_count(delta: float, offset: float = 0):
+    """Number of whole steps made over a (signed) travel of delta"""
+    # Allow for a little floating point error, so that moving exactly onto a
+    # step boundary counts the step.
+    return int(np.floor(abs(delta) + offset + 1e-9))
 
-    assert abs(steps_in + steps_out) <= abs(steps)
-    steps_cruise = steps - (steps_in + steps_out)
-    return steps_in, steps_cruise, steps_out
+
+def _trapz_phases(
+    v_i: float,  # initial velocity
+    v_f: float,  # final velocity
+    v_c: float,  # cruise velocity
+    a_in: float,  # in acceleration
+    a_out: float,  # out acceleration
+    delta: float,  # signed travel
+):
+    """
+    Returns the travel (in the direction of motion) through the in and cruise
+    phases, along with their durations.
+    """
+    dir = 1 if delta > 0 else -1
+
+    s_in = dir * travel_linaccel(v_i, v_c, a_in)
+    s_out = dir * travel_linaccel(v_c, v_f, a_out)
+    s_c = max(abs(delta) - s_in - s_out, 0)
+
+    t_in = (v_c - v_i) / a_in
+    t_c = s_c / abs(v_c) if v_c != 0 else 0
+
+    return s_in, s_c, t_in, t_c
+
+
+def velocity_trapz(
+    t: np.ndarray,  # time since the start of the profile
+    v_i: float,  # initial velocity
+    v_f: float,  # final velocity
+    v_c: float,  # cruise velocity
+    a_in: float,  # in acceleration
+    a_out: float,  # out acceleration
+    delta: float,  # signed travel
+):
+    """Velocity at times t along the profile that pulse_times_trapz follows"""
+    _, _, t_in, t_c = _trapz_phases(v_i, v_f, v_c, a_in, a_out, delta)
+    t_out = (v_f - v_c) / a_out
+
+    return np.where(
+        t < t_in,
+        v_i + a_in * np.clip(t, 0, None),
+        np.where(
+            t < t_in + t_c,
+            v_c,
+            v_c + a_out * np.clip(t - t_in - t_c, None, t_out),
+        ),
+    )
+
+
+def _linaccel_times_into(
+    t: np.ndarray,  # signed travel at each pulse, replaced by times
+    u: float,  # initial velocity
+    a: float,  # acceleration
+    forward: bool,
+):
+    """In-place equivalent of _linaccel_times"""
+    np.multiply(t, 2 * a, out=t)
+    np.add(t, u**2, out=t)
+    np.clip(t, 0, None, out=t)
+    np.sqrt(t, out=t)
+    if forward:
+        np.subtract(t, u, out=t)
+    else:
+        np.add(t, u, out=t)
+        np.negative(t, out=t)
+    np.divide(t, a, out=t)
+
+
+def _trapz_times_into(
+    t: np.ndarray,  # one slot per pulse
+    v_i: float,
+    v_f: float,
+    v_c: float,
+    a_in: float,
+    a_out: float,
+    delta: float,
+    offset: float,
+    first: int = 0,
+):
+    """
+    Fills t with the time of each pulse (starting after the first `first`),
+    without allocating any temporaries.  Returns the indices at which the
+    cruise and out phases begin.
+    """
+    forward = delta > 0
+    dir = 1 if forward else -1
+    s_in, s_c, t_in, t_c = _trapz_phases(v_i, v_f, v_c, a_in, a_out, delta)
+
+    # Travel (in the direction of motion) at each pulse.
+    t.fill(1)
+    np.cumsum(t, out=t)
+    np.add(t, first - offset, out=t)
+    np.clip(t, 0, None, out=t)
+
+    # Travel is sorted, so each phase is a contiguous run of pulses.
+    i_c = int(np.searchsorted(t, s_in, side="right"))
+    i_out = int(np.searchsorted(t, s_in + s_c, side="right"))
+
+    accel = t[:i_c]
+    np.multiply(accel, dir, out=accel)
+    _linaccel_times_into(accel, v_i, a_in, forward)
+
+    cruise = t[i_c:i_out]
+    if v_c != 0:
+        np.subtract(cruise, s_in, out=cruise)
+        np.divide(cruise, abs(v_c), out=cruise)
+        np.add(cruise, t_in, out=cruise)
+    else:
+        cruise.fill(t_in)
+
+    decel = t[i_out:]
+    np.subtract(decel, s_in + s_c, out=decel)
+    np.multiply(decel, dir, out=decel)
+    _linaccel_times_into(decel, v_c, a_out, forward)
+    np.add(decel, t_in + t_c, out=decel)
+
+    # Guard against the roots crossing over by a rounding error at the phase
+    # boundaries.
+    np.maximum.accumulate(t, out=t)
+
+    return i_c, i_out
 
 
 def pulse_times_trapz(
@@ -174,26 +313,121 @@ def pulse_times_trapz(
     v_c: float,  # cruise velocity
     a_in: float,  # in acceleration
     a_out: float,  # out acceleration
-    steps: int,  # signed step count
+    delta: float,  # signed travel (need not be a whole number of steps)
+    offset: float = 0,  # travel already made toward the first step
+    out: np.ndarray | None = None,
+):
+    """
+    Times at which each step occurs while following a trapezoidal velocity
+    profile over a travel of delta.  There are trapz_pulse_count(delta, offset)
+    of them.
+
+    The times are written into out (float32 or float64, and at least that
+    long) when it's given, and the filled part of it is returned.
+    """
+    steps = trapz_pulse_count(delta, offset)
+    if out is None:
+        out = np.empty(steps)
+    t = out[:steps]
+    if steps != 0:
+        _trapz_times_into(t, v_i, v_f, v_c, a_in, a_out, delta, offset)
+    return t
+
+
+def plan_buffer(steps: int):
+    """
+    Allocates a buffer for pulse_plan_trapz: one row of int64 deadlines and one
+    of float64 velocities (stored as int64, see plan_rows).
+    """
+    return np.empty((2, steps), dtype=np.int64)
+
+
+def plan_rows(buffer: np.ndarray, steps: int):
+    """The deadlines and velocities of the first `steps` pulses in buffer"""
+    return buffer[0, :steps], buffer[1, :steps].view(np.float64)
+
+
+def pulse_plan_trapz(
+    out: np.ndarray,  # from plan_buffer(), at least trapz_pulse_count() long
+    start_ns: int,  # deadline at which the profile starts
+    v_i: float,  # initial velocity
+    v_f: float,  # final velocity
+    v_c: float,  # cruise velocity
+    a_in: float,  # in acceleration
+    a_out: float,  # out acceleration
+    delta: float,  # signed travel (need not be a whole number of steps)
+    offset: float = 0,  # travel already made toward the first step
+    first: int = 0,  # pulses (from the start of the profile) to skip
+    count: int | None = None,  # pulses to plan, by default all the rest
 ):
-    s_in = travel_linaccel(v_i, v_c, a_in)
-    s_out = travel_linaccel(v_c, v_f, a_out)
+    """
+    Like pulse_times_trapz, but fills out with time.monotonic_ns() deadlines
+    and the planned velocity (steps/s) at each, in place, so that planning a
+    slew of any length takes no allocations beyond out itself.  Returns the
+    filled deadlines and velocities, as views into out.
+
+    first and count select a window of the profile's pulses, so that it can be
+    planned a piece at a time.
+    """
+    steps = trapz_pulse_count(delta, offset) - first
+    if count is not None:
+        steps = min(steps, count)
+    deadlines, t = plan_rows(out, steps)
+    if steps == 0:
+        return deadlines, t
 
-    # OPT: Could preallocate an array of `steps` floats, and then fill it,
-    # instead of using `np.concatenate`.
+    # The velocity row doubles as scratch space for the times, which are only
+    # needed to derive deadlines and velocities.
+    i_c, i_out = _trapz_times_into(t, v_i, v_f, v_c, a_in, a_out, delta, offset, first)
+    np.multiply(t, 1_000_000_000, out=t)
+    np.rint(t, out=t)
+    np.add(t, start_ns, out=deadlines, casting="unsafe")
 
-    steps_in, steps_c, steps_out = _discretize_trapz_accel(s_in, s_out, steps)
+    _, _, t_in, t_c = _trapz_phases(v_i, v_f, v_c, a_in, a_out, delta)
 
-    t_max = 0
-    t_in = pulse_times_linaccel(steps_in, v_i, a_in)
+    accel = t[:i_c]
+    np.multiply(accel, a_in / 1_000_000_000, out=accel)
+    np.add(accel, v_i, out=accel)
 
-    if steps_in != 0:
-        t_max = t_in[-1]
+    t[i_c:i_out] = v_c
 
-    t_cruise = t_max + pulse_times_constant(steps_c, v_c)
-    if steps_c != 0:
-        t_max = t_cruise[-1]
+    decel = t[i_out:]
+    np.subtract(decel, (t_in + t_c) * 1_000_000_000, out=decel)
+    np.multiply(decel, a_out / 1_000_000_000, out=decel)
+    np.add(decel, v_c, out=decel)
 
-    t_out = t_max + pulse_times_linaccel(steps_out, v_c, a_out)
+    return deadlines, t
 
-    return np.concatenate([t_in, t_cruise, t_out])
+
+def iter_pulse_plan_trapz(
+    window: int,  # pulses per window
+    start_ns: int,
+    v_i: float,
+    v_f: float,
+    v_c: float,
+    a_in: float,
+    a_out: float,
+    delta: float,
+    offset: float = 0,
+):
+    """
+    Yields the deadlines and velocities of pulse_plan_trapz a window at a
+    time, each in a buffer of its own, so that a slew of any length can start
+    before (and without) all of it being planned.
+    """
+    steps = trapz_pulse_count(delta, offset)
+    for first in range(0, steps, window):
+        count = min(window, steps - first)
+        yield pulse_plan_trapz(
+            plan_buffer(count),
+            start_ns,
+            v_i,
+            v_f,
+            v_c,
+            a_in,
+            a_out,
+            delta,
+            offset,
+            first,
+            count,
+        )
@@ -0,0 +1,129 @@
+"""
+Resolves object names to coordinates from a local SQLite index, so that lookups
+by name don't need the network (or the seconds Sesame can take).
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import re
+import sqlite3
+from threading import Lock
+
+import astropy.units as u
+from astropy.coordinates import ICRS, Angle, SkyCoord
+from astropy.coordinates.name_resolve import NameResolveError
+
+_log = logging.getLogger(__name__)
+
+# Positions (ICRS) of common targets, used to seed the index.
+CATALOG = os.path.join(os.path.dirname(__file__), "catalog.csv")
+
+
+def _key(name: str):
+    """Lookup key for name: case, whitespace and underscores don't matter"""
+    return re.sub(r"[\s_]+", "", name).lower()
+
+
+class NameIndex:
+    """
+    Resolves names from an SQLite database at path, which is seeded from
+    `catalog` and then caches every successful online (Sesame) lookup.  With
+    offline set, names that aren't already known fail immediately rather than
+    going to the network.
+    """
+
+    _conn: sqlite3.Connection
+    _lock: Lock
+    _offline: bool
+    # Coordinates already looked up (building a SkyCoord isn't cheap).
+    _coords: dict[str, SkyCoord]
+
+    def __init__(self, path: str, catalog: str | None = CATALOG, offline=False):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # Lookups may come from any thread, one at a time.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+        self._offline = offline
+        self._coords = {}
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS names (
+                    key TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    ra_deg REAL NOT NULL,
+                    dec_deg REAL NOT NULL,
+                    source TEXT NOT NULL
+                )
+                """
+            )
+
+        if catalog is not None:
+            self._seed(catalog)
+
+    def resolve(self, name: str) -> SkyCoord:
+        """
+        Returns the coordinates of name, like SkyCoord.from_name (and raising
+        NameResolveError in the same way).
+        """
+        key = _key(name)
+        coord = self._coords.get(key)
+        if coord is not None:
+            return coord
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ra_deg, dec_deg FROM names WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is not None:
+            ra, dec = row
+            coord = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame=ICRS)
+            self._coords[key] = coord
+            return coord
+
+        if self._offline:
+            raise NameResolveError(f"{name} isn't known (and resolving is offline)")
+
+        coord = SkyCoord.from_name(name).icrs
+        self._put([key], name, coord, "sesame")
+        self._coords[key] = coord
+        _log.debug(f"resolved {name} online: {coord}")
+        return coord
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _put(self, keys: list[str], name: str, coord: SkyCoord, source: str):
+        ra = coord.ra.to_value(u.deg)  # pyright: ignore
+        dec = coord.dec.to_value(u.deg)  # pyright: ignore
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?)",
+                [(key, name, ra, dec, source) for key in keys],
+            )
+
+    def _seed(self, catalog: str):
+        with open(catalog, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+        entries = []
+        for row in rows:
+            names = row["names"].split("|")
+            ra = Angle(row["ra"]).to_value(u.deg)
+            dec = Angle(row["dec"]).to_value(u.deg)
+            for name in names:
+                entries.append((_key(name), names[0], ra, dec, "catalog"))
+
+        # Don't clobber anything already resolved online.
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO names VALUES (?, ?, ?, ?, ?)", entries
+            )
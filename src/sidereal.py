@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import math
+
+import astropy.constants as const
+import astropy.units as u
+from astropy.coordinates import EarthLocation, SkyCoord
+from astropy.time import Time
+from astropy.utils.iers import IERSRangeError
+import erfa
+import numpy as np
+
+# Earth's rotation rate (radians per second of UT1).  The Earth Rotation Angle
+# (and so local sidereal time, and the hour angle of a fixed target) advances
+# at exactly this rate.
+EARTH_ROTATION_RATE = 2 * math.pi * 1.00273781191135448 / 86_400
+
+
+@dataclass(frozen=True)
+class _Terms:
+    t_ns: int  # time.time_ns() at which these were computed
+    # Observer velocity (barycentric, in units of c) for annual and diurnal
+    # aberration.
+    beta: np.ndarray
+    # ICRS/GCRS to CIRS rotation (bias, precession and nutation).
+    c2i: np.ndarray
+    # Earth Rotation Angle plus longitude, i.e. local (CIO based) sidereal
+    # time.
+    lst: float
+
+
+class FixedHADec:
+    """
+    Computes the hour angle and declination of fixed (ICRS) coordinates with
+    plain NumPy, from aberration and precession-nutation terms that are only
+    recomputed (with astropy and erfa) every refresh_ns.  Between refreshes,
+    local sidereal time is advanced at Earth's rotation rate.
+
+    This leaves out light deflection, polar motion and refraction (as HADec
+    without atmospheric parameters does), so it agrees with astropy to well
+    under an arcsecond, at a tiny fraction of the cost.
+    """
+
+    _location: EarthLocation
+    # Geocentric (ITRS) position of the observer, in m.
+    _itrs: np.ndarray
+    _refresh_ns: int
+    _terms: _Terms | None
+    # id(coord) -> (coord, ICRS unit vector), with coords kept so that their
+    # ids can't be reused while cached.
+    _vectors: dict[int, tuple[SkyCoord, np.ndarray]]
+
+    def __init__(self, location: EarthLocation, refresh_ns: int = 300_000_000_000):
+        self._location = location
+        self._itrs = np.array([location.x.to_value(u.m), location.y.to_value(u.m), 0])
+        self._refresh_ns = refresh_ns
+        self._terms = None
+        self._vectors = {}
+
+    def hadec(self, coord: SkyCoord, t_ns: int | np.ndarray):
+        """
+        Returns the hour angle (wrapped into [-pi, pi), like astropy) and
+        declination, in radians, of coord at t_ns (time.time_ns() values).
+        """
+        return self._hadec(self._vector(coord), t_ns)
+
+    def hadec_radec(self, ra: float, dec: float, t_ns: int | np.ndarray):
+        """Like hadec, but of ICRS right ascension and declination (radians)"""
+        cos_dec = math.cos(dec)
+        p = np.array([cos_dec * math.cos(ra), cos_dec * math.sin(ra), math.sin(dec)])
+        return self._hadec(p, t_ns)
+
+    def _hadec(self, p: np.ndarray, t_ns: int | np.ndarray):
+        terms = self._terms_for(int(np.min(t_ns)))
+
+        p = p + terms.beta
+        p = terms.c2i @ (p / np.linalg.norm(p))
+        ra = math.atan2(p[1], p[0])
+        dec = math.atan2(p[2], math.hypot(p[0], p[1]))
+
+        lst = terms.lst + EARTH_ROTATION_RATE * (
+            (np.asarray(t_ns) - terms.t_ns) / 1_000_000_000
+        )
+        ha = (lst - ra + math.pi) % (2 * math.pi) - math.pi
+
+        if np.ndim(t_ns) == 0:
+            return float(ha), dec
+        return ha, np.full(np.shape(t_ns), dec)
+
+    def _terms_for(self, t_ns: int) -> _Terms:
+        terms = self._terms
+        if terms is None or abs(t_ns - terms.t_ns) > self._refresh_ns:
+            terms = self._compute_terms(t_ns)
+            self._terms = terms
+        return terms
+
+    def _compute_terms(self, t_ns: int) -> _Terms:
+        t = Time(t_ns / 1_000_000_000, format="unix")
+
+        tt = t.tt
+        c2i = erfa.c2i06a(tt.jd1, tt.jd2)
+
+        try:
+            ut1 = t.ut1
+        except IERSRangeError:
+            # Without current IERS tables, astropy's own transforms assume
+            # UT1 - UTC = 0 too.
+            ut1 = t.utc
+        era = erfa.era00(ut1.jd1, ut1.jd2)
+        lst = era + self._location.lon.to_value(u.rad)
+
+        tdb = t.tdb
+        _, pvb = erfa.epv00(tdb.jd1, tdb.jd2)
+        earth_v = (pvb["v"] * (u.au / u.day)).to_value(u.m / u.s)
+
+        # The observer is carried around Earth's axis (ignoring polar motion),
+        # so its velocity is the rotation rate crossed with its position.
+        x, y, _ = self._itrs
+        c, s = math.cos(era), math.sin(era)
+        observer_v = EARTH_ROTATION_RATE * np.array(
+            [-(s * x + c * y), c * x - s * y, 0]
+        )
+        # CIRS to GCRS
+        observer_v = c2i.T @ observer_v
+
+        beta = (earth_v + observer_v) / const.c.to_value(u.m / u.s)
+
+        return _Terms(t_ns, beta, c2i, float(lst))
+
+    def _vector(self, coord: SkyCoord) -> np.ndarray:
+        entry = self._vectors.get(id(coord))
+        if entry is not None and entry[0] is coord:
+            return entry[1]
+
+        v = coord.icrs.cartesian.xyz.value  # pyright: ignore
+        v = v / np.linalg.norm(v)
+        # Tracking is of one target at a time, so there's no need to keep more
+        # than a handful around.
+        if len(self._vectors) >= 16:
+            self._vectors.clear()
+        self._vectors[id(coord)] = (coord, v)
+        return v
@@ -7,28 +7,29 @@ import math
 from queue import Queue
 from threading import Condition, Lock, Thread
 import time
-from typing import Protocol, TypeAlias
+from typing import Callable, Protocol, TypeAlias, runtime_checkable
 from typing_extensions import assert_never
 
 import numpy as np
 
 from .activity import Activity as _Activity, ActivityStatus
-from .lib.nsleep import nsleep
+from .lib.nsleep import sleep_until
 from .motion import (
+    iter_pulse_plan_trapz,
     pulse_times_linaccel,
-    pulse_times_trapz,
+    trapz_pulse_count,
     travel_linaccel,
     trapz_opt_v_c_and_t_to_intercept,
     trapz_v_c_to_intercept_at_t,
+    velocity_trapz,
 )
+from .telemetry import LatenessHistogram, TimingStats
 
 _log = logging.getLogger(__name__)
 
-# TODO: In Stepper, track an error term for desired fractional steps so abutting
-# activities with very slow movements can work perfectly.  Right now this gets
-# worked around in TelescopeControl by issuing very long run_constant commands
-# that guarantee a whole number of steps will occur.  This is inconvenient, and
-# it would be better if Stepper handled fractional moves itself.
+# NOTE: All deadlines (start_ns, deadline_ns, etc.) are in the
+# time.monotonic_ns() domain, so that wall clock adjustments don't disturb
+# step timing.
 
 
 class _PulseFn(Protocol):
@@ -36,14 +37,40 @@ class _PulseFn(Protocol):
         ...
 
 
+@runtime_checkable
+class PulseBackend(Protocol):
+    """
+    Generates pulses with its own (ideally hardware) timing, instead of having
+    Stepper sleep and call a _PulseFn for every step.
+
+    submit() receives batches of steps ahead of time, as absolute
+    time.monotonic_ns() deadlines with their StepDir values (never NOP).
+    Batches arrive in order and don't overlap.
+    """
+
+    def submit(self, deadlines: np.ndarray, dirs: np.ndarray, /) -> None:
+        ...
+
+
 @dataclass(frozen=True)
 class StepperConfig:
     min_sleep_ns: int
     max_speed: float  # steps/s
     max_accel: float  # steps/s/s
     max_decel: float  # steps/s/s
-    pulse: _PulseFn
+    pulse: _PulseFn | PulseBackend
     max_interval_ns: int = 250_000_000
+    # When non-zero, busy-wait this long before each deadline instead of
+    # relying entirely on the kernel to wake us up on time.
+    spin_ns: int = 0
+    # Pulses are handed from the planner to the mover in chunks.  A chunk ends
+    # once it holds chunk_steps entries or spans chunk_ns, whichever comes
+    # first.  Together with plan_ahead (the number of chunks queued), this
+    # bounds how far ahead of the motor the planner can commit, and so the
+    # latency of a cancel.
+    chunk_steps: int = 256
+    chunk_ns: int = 50_000_000
+    plan_ahead: int = 4
 
 
 class StepDir(IntEnum):
@@ -54,10 +81,14 @@ class StepDir(IntEnum):
 
 class _StepperActivity(_Activity):
     _goal: _Goal
+    # Canceled in favour of the activity queued after it, which carries on
+    # from wherever (and however fast) this one leaves off.
+    _handed_off: bool
 
     def __init__(self, goal: _Goal, cond: Condition):
         super().__init__(cond)
         self._goal = goal
+        self._handed_off = False
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self._goal!r}, {self._status.name})"
@@ -97,20 +128,45 @@ class _Stop:
 _Goal: TypeAlias = _InterceptPrecomputed | _Intercept | _RunConstant | _Idle | _Stop
 
 
-_MotionQueue: TypeAlias = Queue[tuple[int, StepDir] | _StepperActivity]
+@dataclass(frozen=True)
+class StepperState:
+    """Position and velocity of a Stepper, as of the same instant"""
+
+    t_ns: int  # time.monotonic_ns()
+    position: int  # steps
+    velocity: float  # steps/s
+
+
+@dataclass
+class _Chunk:
+    deadlines: np.ndarray  # int64 ns
+    dirs: np.ndarray  # int64 StepDir values
+    # Planned (instantaneous) velocity at each deadline, in steps/s.
+    velocities: np.ndarray
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self.deadlines)} pulses)"
+
+
+_MotionQueue: TypeAlias = Queue[_Chunk | _StepperActivity]
 
 
 @dataclass
 class _RunState:
     plan_thread: Thread
     run_thread: Thread
+    motion: _MotionQueue
 
 
 @dataclass
 class _PlanContext:
-    commit_pos: float
+    commit_pos: int
     commit_vel: float
     commit_deadline: int
+    # Ideal (fractional) position minus commit_pos, carried across activities
+    # so that segments of any length can abut without losing partial steps.
+    # Always within half a step.
+    commit_err: float = 0
 
 
 class _StateFn(Protocol):
@@ -124,11 +180,18 @@ class Stepper:
     _config: StepperConfig
     _position: int
     _velocity: float
+    # The chunk being walked, how far into it we are, and the deadline of the
+    # last entry walked.  Together these pin down the planned motion around
+    # the present, which state() interpolates.
+    _chunk: _Chunk | None
+    _chunk_idx: int
+    _velocity_ns: int
 
     _lock: Lock
     _run_state: _RunState | None
     _activities: Queue[_StepperActivity]
     _activity_fallback_cond: Condition
+    _lateness: LatenessHistogram
 
     def __init__(
         self,
@@ -139,11 +202,15 @@ class Stepper:
         self._config = config
         self._position = position
         self._velocity = velocity
+        self._chunk = None
+        self._chunk_idx = 0
+        self._velocity_ns = time.monotonic_ns()
 
         self._lock = Lock()
         self._run_state = None
         self._activities = Queue()
         self._activity_fallback_cond = Condition()
+        self._lateness = LatenessHistogram()
 
     @property
     def config(self):
@@ -156,8 +223,56 @@ class Stepper:
 
     @property
     def velocity(self):
+        return self.state().velocity
+
+    def state(self, t_ns: int | None = None) -> StepperState:
+        """
+        Returns position and velocity as of t_ns (default: now), taken
+        together so that they agree with each other.
+
+        Velocity comes from the committed plan rather than from the spacing of
+        past steps, so it's accurate mid-ramp.  Past the chunk being walked,
+        the last planned velocity is assumed.  Position only counts steps
+        through t_ns that are already planned.
+        """
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+
         with self._lock:
-            return self._velocity
+            position = self._position
+            velocity = self._velocity
+            velocity_ns = self._velocity_ns
+            chunk = self._chunk
+            idx = self._chunk_idx
+
+        if chunk is None or idx >= len(chunk.deadlines) or t_ns <= velocity_ns:
+            return StepperState(t_ns, position, velocity)
+
+        deadlines = chunk.deadlines[idx:]
+        # Steps planned between the last one taken and t_ns.
+        through = int(np.searchsorted(deadlines, t_ns, side="right"))
+        position += int(chunk.dirs[idx : idx + through].sum())
+
+        if through == len(deadlines):
+            return StepperState(t_ns, position, float(chunk.velocities[-1]))
+
+        # Velocity is piecewise linear (within rounding) between deadlines.
+        if through == 0:
+            t0, v0 = velocity_ns, velocity
+        else:
+            t0 = int(deadlines[through - 1])
+            v0 = float(chunk.velocities[idx + through - 1])
+        t1 = int(deadlines[through])
+        v1 = float(chunk.velocities[idx + through])
+        velocity = v0 + (v1 - v0) * (t_ns - t0) / max(t1 - t0, 1)
+
+        return StepperState(t_ns, position, velocity)
+
+    def timing_stats(self) -> TimingStats:
+        with self._lock:
+            run_state = self._run_state
+        queue_depth = run_state.motion.qsize() if run_state is not None else 0
+        return self._lateness.snapshot(queue_depth)
 
     def goto(
         self,
@@ -209,12 +324,12 @@ class Stepper:
             if self._run_state is not None:
                 return
 
-            # TODO: Make plan ahead steps configurable
-            motion: _MotionQueue = Queue(maxsize=4)
+            motion: _MotionQueue = Queue(maxsize=self._config.plan_ahead)
 
             run_state = _RunState(
                 plan_thread=Thread(target=self._plan, args=[motion]),
                 run_thread=Thread(target=self._move, args=[motion]),
+                motion=motion,
             )
             self._run_state = run_state
 
@@ -245,7 +360,7 @@ class Stepper:
             ctx = _PlanContext(
                 self._position,
                 self._velocity,
-                time.time_ns(),
+                time.monotonic_ns(),
             )
 
         statefn: _StateFn | None = _plan_dispatch
@@ -253,9 +368,21 @@ class Stepper:
             statefn = statefn(self, motion, ctx)
 
     def _move(self, motion: _MotionQueue):
+        backend = self._config.pulse
+        if not isinstance(backend, PulseBackend):
+            backend = None
+
+        # With a PulseBackend, each chunk is submitted one chunk ahead of the
+        # one being walked, so that the backend has time to schedule it.
+        submitted: _Chunk | None = None
+
         while True:
             item = motion.get()
             if isinstance(item, _StepperActivity):
+                if submitted is not None:
+                    self._walk(submitted, pulse=False)
+                    submitted = None
+
                 with item._cond:
                     match item._status:
                         case ActivityStatus.ABORTING:
@@ -275,28 +402,80 @@ class Stepper:
                 continue
 
             try:
-                deadline, d = item
-                now = time.time_ns()
-
-                sleep_ns = deadline - now
-                if sleep_ns < self._config.min_sleep_ns:
-                    if d != StepDir.NOP:
-                        # FIXME: Better telemetry
-                        _log.warn(f"running behind: {sleep_ns / 1_000_000_000}")
-                    sleep_ns = self._config.min_sleep_ns
-
-                nsleep(sleep_ns)
-
-                if d != StepDir.NOP:
-                    self.config.pulse(self, d)
-
-                with self._lock:
-                    self._position += d
-                    # FIXME: Calculate velocity
-                    self._velocity = 0
+                if backend is None:
+                    self._walk(item, pulse=True)
+                    continue
+
+                steps = item.dirs != StepDir.NOP
+                if steps.any():
+                    deadlines = item.deadlines[steps]
+                    # The backend takes care of the timing of individual
+                    # pulses, so the best we can do is track how late each
+                    # batch was submitted.
+                    lateness = time.monotonic_ns() - int(deadlines[0])
+                    backend.submit(deadlines, item.dirs[steps])
+                    self._lateness.record(lateness, lateness > 0)
+
+                if submitted is not None:
+                    self._walk(submitted, pulse=False)
+                submitted = item
             finally:
                 motion.task_done()
 
+    def _walk(self, chunk: _Chunk, pulse: bool):
+        """
+        Sleeps through the chunk's deadlines, updating position as steps
+        happen.  When pulse is set, also generates the pulses.
+        """
+        pulse_fn = None
+        if pulse:
+            pulse_fn = self._config.pulse
+            assert not isinstance(pulse_fn, PulseBackend)
+
+        with self._lock:
+            self._chunk = chunk
+            self._chunk_idx = 0
+
+        # Convert once per chunk, rather than boxing a numpy scalar on every
+        # step.
+        for i, (deadline, d, v) in enumerate(
+            zip(
+                chunk.deadlines.tolist(),
+                chunk.dirs.tolist(),
+                chunk.velocities.tolist(),
+            )
+        ):
+            now = time.monotonic_ns()
+
+            wake = deadline
+            late = deadline - now < self._config.min_sleep_ns
+            if late:
+                wake = now + self._config.min_sleep_ns
+
+            sleep_until(wake, self._config.spin_ns)
+
+            if pulse_fn is not None and d != StepDir.NOP:
+                self._lateness.record(time.monotonic_ns() - deadline, late)
+                pulse_fn(self, StepDir(d))
+
+            with self._lock:
+                self._position += d
+                self._velocity = v
+                self._velocity_ns = deadline
+                self._chunk_idx = i + 1
+
+
+def hand_off(activity: _Activity):
+    """
+    Cancels a Stepper's activity without stopping: the motor keeps going
+    as planned through to the next activity, which plans from there.  The next
+    activity must already be queued, or the motor stops dead.
+    """
+    assert isinstance(activity, _StepperActivity)
+    with activity._cond:
+        activity._handed_off = True
+    activity.cancel()
+
 
 @dataclass(frozen=True)
 class InterceptParams:
@@ -333,31 +512,26 @@ def compute_intercept(
             v_f=final_velocity,
         )
 
-    a_in = math.copysign(config.max_accel, scratch_delta)
-    a_out = -math.copysign(config.max_decel, scratch_delta)
-
-    if t is None:
-        v_c, t = trapz_opt_v_c_and_t_to_intercept(
-            config.max_speed,
+    # Accelerate toward the target, unless already heading there too fast to
+    # stop short of it, in which case slow down (overshooting, and coming
+    # back).
+    for sign in (1, -1):
+        a_in = math.copysign(config.max_accel, scratch_delta) * sign
+        a_out = -math.copysign(config.max_decel, scratch_delta) * sign
+        v_c, t_c = _intercept_v_c_and_t(
+            config,
             a_in,
             a_out,
             position,
             velocity,
-            final_velocity,
             target,
             target_velocity,
+            final_velocity,
+            t,
         )
-    else:
-        v_c = trapz_v_c_to_intercept_at_t(
-            a_in=a_in,
-            a_out=a_out,
-            p_i=position,
-            v_i=velocity,
-            v_f=final_velocity,
-            q_i=target,
-            u=target_velocity,
-            t=t,
-        )
+        if (v_c - velocity) * a_in >= 0:
+            break
+    t = t_c
 
     p_f = target + t * target_velocity
     delta = p_f - position
@@ -372,6 +546,41 @@ def compute_intercept(
     )
 
 
+def _intercept_v_c_and_t(
+    config: StepperConfig,
+    a_in: float,
+    a_out: float,
+    position: float,
+    velocity: float,
+    target: float,
+    target_velocity: float,
+    final_velocity: float,
+    t: float | None,
+):
+    if t is None:
+        return trapz_opt_v_c_and_t_to_intercept(
+            config.max_speed,
+            a_in,
+            a_out,
+            position,
+            velocity,
+            final_velocity,
+            target,
+            target_velocity,
+        )
+    v_c = trapz_v_c_to_intercept_at_t(
+        a_in=a_in,
+        a_out=a_out,
+        p_i=position,
+        v_i=velocity,
+        v_f=final_velocity,
+        q_i=target,
+        u=target_velocity,
+        t=t,
+    )
+    return v_c, t
+
+
 def _plan_dispatch(stepper: Stepper, motion: _MotionQueue, ctx: _PlanContext):
     activity = stepper._activities.get()
     with activity._cond:
@@ -405,7 +614,7 @@ def _plan_intercept(activity: _StepperActivity) -> _StateFn:
             activity._status = ActivityStatus.ACTIVE
             activity._cond.notify_all()
 
-        now = time.time_ns()
+        now = time.monotonic_ns()
         # TODO: Need to incorporate Config.min_sleep_ns?
         ctx.commit_deadline = max(ctx.commit_deadline, now)
         match goal:
@@ -413,69 +622,98 @@ def _plan_intercept(activity: _StepperActivity) -> _StateFn:
                 # Just extract params and start_ns
                 pass
             case _Intercept():
-                start_ns = ctx.commit_deadline
 
-                t0 = (start_ns - now) / 1_000_000_000
-                target_t0 = goal.target + t0 * goal.target_velocity
-
-                params = compute_intercept(
-                    stepper._config,
-                    ctx.commit_pos,
-                    ctx.commit_vel,
-                    target_t0,
-                    goal.target_velocity,
-                    goal.final_velocity,
-                )
+                def plan():
+                    start_ns = ctx.commit_deadline
+
+                    t0 = (start_ns - now) / 1_000_000_000
+                    target_t0 = goal.target + t0 * goal.target_velocity
+
+                    params = compute_intercept(
+                        stepper._config,
+                        ctx.commit_pos + ctx.commit_err,
+                        ctx.commit_vel,
+                        target_t0,
+                        goal.target_velocity,
+                        goal.final_velocity,
+                    )
+                    return params, start_ns
+
+                params, start_ns = plan()
+                # Steps only go one way within an intercept, so if (taking
+                # over from a handed off activity) getting there means turning
+                # around, stop first.
+                if params.delta * ctx.commit_vel < 0 or params.delta * params.v_c < 0:
+                    _put_stop(stepper, motion, ctx)
+                    params, start_ns = plan()
 
         if params.delta == 0:
             motion.put(activity)
             return _plan_dispatch
 
         dir = StepDir.FWD if params.delta > 0 else StepDir.REV
-        deadlines = (
-            start_ns
-            + pulse_times_trapz(
-                ctx.commit_vel,
+        v_i = ctx.commit_vel
+        offset = _step_offset(ctx, dir)
+        steps = trapz_pulse_count(params.delta, offset)
+        # Plan a window at a time, so that the first pulses can go out without
+        # waiting on (or holding memory for) the whole of a long slew.
+        windows = iter_pulse_plan_trapz(
+            stepper.config.chunk_steps,
+            start_ns,
+            v_i,
+            params.v_f,
+            params.v_c,
+            params.a_in,
+            params.a_out,
+            params.delta,
+            offset,
+        )
+
+        def velocities(deadlines: np.ndarray):
+            return velocity_trapz(
+                (deadlines - start_ns) / 1_000_000_000,
+                v_i,
                 params.v_f,
                 params.v_c,
                 params.a_in,
                 params.a_out,
-                # TODO: Handle fractional positions, like in run_constant.
-                round(params.delta),
+                params.delta,
             )
-            * 1_000_000_000
-        ).astype(np.int64)
-
-        if len(deadlines) == 0:
-            motion.put(activity)
-            return _plan_dispatch
-
-        velocities = np.empty_like(deadlines, dtype=np.float64)
-        velocities[0] = ctx.commit_vel
-        velocities[1:] = int(dir) * 1_000_000_000 / (deadlines[1:] - deadlines[:-1])
 
-        for deadline, velocity in zip(deadlines, velocities):
-            with activity._cond:
-                if activity._canceled:
-                    return _plan_abort(activity)
-
-            for d in _nop_deadlines(
-                ctx.commit_deadline,
-                deadline,
-                stepper.config.max_interval_ns,
+        err = ctx.commit_err + params.delta - dir * steps
+        end_ns = start_ns + round(params.t * 1_000_000_000)
+
+        for step_deadlines, step_velocities in windows:
+            if not _put_steps(
+                stepper,
+                motion,
+                ctx,
+                activity,
+                step_deadlines,
+                dir,
+                step_velocities,
+                velocities,
             ):
-                with activity._cond:
-                    if activity._canceled:
-                        return _plan_abort(activity)
-                motion.put((d, StepDir.NOP))
-
-            ctx.commit_deadline = deadline
-            ctx.commit_pos += dir
-            ctx.commit_vel = velocity
-            motion.put((deadline, dir))
-        else:
-            motion.put(activity)
-            return _plan_dispatch
+                return _plan_abort(activity)
+
+        # Finish with a NOP (if needed) so that the activity completes on time.
+        if not _put_steps(
+            stepper,
+            motion,
+            ctx,
+            activity,
+            np.empty(0, dtype=np.int64),
+            dir,
+            np.empty(0),
+            velocities,
+            end_ns,
+        ):
+            return _plan_abort(activity)
+
+        ctx.commit_err = err
+        ctx.commit_vel = params.v_f
+        motion.put(activity)
+        return _plan_dispatch
 
     return plan_intercept
 
@@ -490,132 +728,234 @@ def _plan_run_constant(activity: _StepperActivity) -> _StateFn:
             activity._status = ActivityStatus.ACTIVE
             activity._cond.notify_all()
 
-        ctx.commit_deadline = max(ctx.commit_deadline, time.time_ns())
+        ctx.commit_deadline = max(ctx.commit_deadline, time.monotonic_ns())
 
-        if goal.velocity == 0:
-            if ctx.commit_deadline < goal.deadline_ns:
-                ctx.commit_deadline = goal.deadline_ns
-                motion.put((goal.deadline_ns, StepDir.NOP))
-            motion.put(activity)
-            return _plan_dispatch
+        start_ns = ctx.commit_deadline
+        travel = goal.velocity * max(goal.deadline_ns - start_ns, 0) / 1_000_000_000
 
-        # TODO: Deal with quantization errors (should be pretty small)
-        ideal_interval = int(abs(1_000_000_000 / goal.velocity))
-        dir = StepDir.FWD if goal.velocity > 0 else StepDir.REV
+        dir = StepDir.NOP
+        offset = 0.0
+        interval = 0.0
+        steps = 0
+        if goal.velocity != 0:
+            dir = StepDir.FWD if goal.velocity > 0 else StepDir.REV
+            offset = _step_offset(ctx, dir)
+            interval = abs(1_000_000_000 / goal.velocity)
+            steps = trapz_pulse_count(travel, offset)
 
-        interval = ideal_interval
-        next_int_pos = _next_int(ctx.commit_pos, dir)
-        next_int_t = (next_int_pos - ctx.commit_pos) / goal.velocity
-        next_int_interval = round(1_000_000_000 * next_int_t)
-        if next_int_interval != 0:
-            interval = next_int_interval
+        err = ctx.commit_err + travel - dir * steps
 
-        done = False
-        while not done:
-            with activity._cond:
-                if activity._canceled:
-                    return _plan_abort(activity)
-
-            deadline = round(ctx.commit_deadline + interval)
-            interval = ideal_interval
-            if deadline >= goal.deadline_ns:
-                done = True
-                if deadline > goal.deadline_ns:
-                    dir = StepDir.NOP
-                deadline = goal.deadline_ns
-
-            for d in _nop_deadlines(
-                ctx.commit_deadline,
-                deadline,
-                stepper.config.max_interval_ns,
+        def velocities(deadlines: np.ndarray):
+            return np.full(len(deadlines), goal.velocity)
+
+        # Generate the steps a window at a time, so that a long segment doesn't
+        # need to be materialized up front.
+        k = 0
+        while True:
+            k_end = min(k + stepper.config.chunk_steps, steps)
+            step_deadlines = start_ns + np.rint(
+                (np.arange(k + 1, k_end + 1) - offset) * interval
+            ).astype(np.int64)
+
+            # Finish with a NOP (if needed) so that the activity completes on
+            # time.
+            end_ns = goal.deadline_ns if k_end == steps else None
+
+            if not _put_steps(
+                stepper,
+                motion,
+                ctx,
+                activity,
+                step_deadlines,
+                dir,
+                velocities(step_deadlines),
+                velocities,
+                end_ns,
             ):
-                with activity._cond:
-                    if activity._canceled:
-                        return _plan_abort(activity)
-                _commit_const_vel(ctx, d, goal.velocity)
-                motion.put((d, StepDir.NOP))
+                return _plan_abort(activity)
 
-            _commit_const_vel(ctx, deadline, goal.velocity)
-            motion.put((deadline, dir))
+            if k_end == steps:
+                break
+            k = k_end
 
+        ctx.commit_err = err
+        ctx.commit_vel = goal.velocity
         motion.put(activity)
         return _plan_dispatch
 
     return plan_run_constant
 
 
-def _commit_const_vel(ctx: _PlanContext, deadline: int, v: float):
-    dp = v * (deadline - ctx.commit_deadline) / 1_000_000_000
-    ctx.commit_deadline = deadline
-    ctx.commit_pos += dp
-    ctx.commit_vel = v
+def _plan_abort(activity: _StepperActivity) -> _StateFn:
+    def plan_abort(stepper: Stepper, motion: _MotionQueue, ctx: _PlanContext):
+        with activity._cond:
+            activity._status = ActivityStatus.ABORTING
+            activity._cond.notify_all()
 
+        ctx.commit_deadline = max(ctx.commit_deadline, time.monotonic_ns())
 
-def _next_int(x: float, dir: StepDir):
-    assert dir != StepDir.NOP
+        # (Stopping can't be canceled.)
+        if not activity._handed_off:
+            _put_stop(stepper, motion, ctx)
+        motion.put(activity)
+        return _plan_dispatch
 
-    tp = np.floor(x)
+    return plan_abort
 
-    if x == tp:
-        return int(x)
 
-    adj = tp - x
-    if dir == StepDir.FWD:
-        return int(x + adj + 1)
+def _put_stop(stepper: Stepper, motion: _MotionQueue, ctx: _PlanContext):
+    """Queues (uncancelable) deceleration from the committed velocity to 0"""
+    if ctx.commit_vel == 0:
+        return
 
-    return int(x + adj)
+    cfg = stepper._config
 
+    start_ns = ctx.commit_deadline
+    dir = StepDir.FWD if ctx.commit_vel > 0 else StepDir.REV
+    a_out = -math.copysign(cfg.max_decel, ctx.commit_vel)
+    travel = travel_linaccel(ctx.commit_vel, 0, a_out)
 
-def _plan_abort(activity: _StepperActivity) -> _StateFn:
-    def plan_abort(stepper: Stepper, motion: _MotionQueue, ctx: _PlanContext):
-        with activity._cond:
-            activity._status = ActivityStatus.ABORTING
-            activity._cond.notify_all()
+    offset = _step_offset(ctx, dir)
+    steps = trapz_pulse_count(travel, offset)
+    times = pulse_times_linaccel(dir * steps, ctx.commit_vel, a_out, offset)
 
-        ctx.commit_deadline = max(ctx.commit_deadline, time.time_ns())
+    step_deadlines = (start_ns + times * 1_000_000_000).astype(np.int64)
+    v_i = ctx.commit_vel
+    t_stop = -v_i / a_out
+    end_ns = start_ns + round(t_stop * 1_000_000_000)
 
-        if ctx.commit_vel == 0:
-            motion.put(activity)
-            return _plan_dispatch
+    def velocities(deadlines: np.ndarray):
+        t = (deadlines - start_ns) / 1_000_000_000
+        return v_i + a_out * np.clip(t, 0, t_stop)
 
-        cfg = stepper._config
-
-        dir = StepDir.FWD if ctx.commit_vel > 0 else StepDir.REV
-        a_out = -math.copysign(cfg.max_decel, ctx.commit_vel)
-        steps_frac = travel_linaccel(ctx.commit_vel, 0, a_out)
-        # TODO: It would be better to round away from zero, but it's not
-        # convenient with numpy or the std lib.  So, we just always add one
-        # extra step.
-        steps = int(np.trunc(steps_frac) + math.copysign(1, steps_frac))
-
-        deadlines = (
-            ctx.commit_deadline
-            + pulse_times_linaccel(steps, ctx.commit_vel, a_out) * 1_000_000_000
-        ).astype(np.int64)
-
-        velocities = np.empty_like(deadlines, dtype=np.float64)
-        velocities[0] = ctx.commit_vel
-        velocities[1:] = (
-            (1 if dir == StepDir.FWD else -1)
-            * 1_000_000_000
-            / (deadlines[1:] - deadlines[:-1])
-        )
+    err = ctx.commit_err + travel - dir * steps
 
-        for deadline, velocity in zip(deadlines, velocities):
-            ctx.commit_deadline = deadline
-            ctx.commit_pos += dir
-            ctx.commit_vel = velocity
-            motion.put((deadline, dir))
-        else:
-            motion.put(activity)
-            return _plan_dispatch
+    _put_steps(
+        stepper,
+        motion,
+        ctx,
+        None,
+        step_deadlines,
+        dir,
+        v_i + a_out * times,
+        velocities,
+        end_ns,
+    )
 
-    return plan_abort
+    ctx.commit_err = err
+    ctx.commit_vel = 0
+
+
+def _step_offset(ctx: _PlanContext, dir: StepDir):
+    """
+    How far (in steps) the committed position has already come toward the next
+    step in direction dir.  The actual position is kept within half a step of
+    the ideal position, so a step happens each time the ideal position crosses
+    a half step.
+    """
+    return 0.5 + ctx.commit_err * dir
+
+
+def _put_steps(
+    stepper: Stepper,
+    motion: _MotionQueue,
+    ctx: _PlanContext,
+    activity: _StepperActivity | None,
+    step_deadlines: np.ndarray,
+    dir: StepDir,
+    step_velocities: np.ndarray,
+    velocities: Callable[[np.ndarray], np.ndarray],
+    end_ns: int | None = None,
+) -> bool:
+    """
+    Queues steps (interleaved with NOPs, as needed) as chunks, and commits them
+    to ctx as it goes.  When end_ns is given, motion continues until then,
+    without stepping.  step_velocities holds the planned velocity at each
+    step, and velocities maps any other deadlines (the NOPs) to theirs.
+
+    Returns False if activity was canceled before everything was queued.  Pass
+    None as the activity for motion that can't be canceled.
+    """
+    steps = len(step_deadlines)
+    entries = step_deadlines
+    if end_ns is not None and (steps == 0 or step_deadlines[-1] < end_ns):
+        entries = np.append(step_deadlines, np.int64(end_ns))
+
+    if len(entries) == 0:
+        return True
+
+    deadlines, step_idx = _with_nops(
+        ctx.commit_deadline, entries, stepper.config.max_interval_ns
+    )
+    step_idx = step_idx[:steps]
+    dirs = np.zeros_like(deadlines)
+    dirs[step_idx] = dir
+    if len(deadlines) == steps:
+        entry_velocities = step_velocities
+    else:
+        entry_velocities = np.asarray(velocities(deadlines), dtype=np.float64)
+        entry_velocities[step_idx] = step_velocities
+
+    committed = 0
+    for lo, hi in _chunk_bounds(stepper.config, deadlines):
+        if activity is not None:
+            with activity._cond:
+                if activity._canceled:
+                    return False
 
+        # Number of steps (as opposed to NOPs) through the end of the chunk.
+        through = int(np.searchsorted(step_idx, hi))
+        ctx.commit_deadline = int(deadlines[hi - 1])
+        ctx.commit_vel = float(entry_velocities[hi - 1])
+        if through != committed:
+            ctx.commit_pos += dir * (through - committed)
+            # Right at a step, the ideal position is half a step behind.
+            ctx.commit_err = -0.5 * dir
+            committed = through
+        motion.put(_Chunk(deadlines[lo:hi], dirs[lo:hi], entry_velocities[lo:hi]))
 
-def _nop_deadlines(
+    return True
+
+
+def _with_nops(
     from_ns: int,
-    to_ns: int,
+    deadlines: np.ndarray,
     max_interval_ns: int,
-):
-    return np.arange(from_ns + max_interval_ns, to_ns, max_interval_ns)
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Interleave NOP deadlines so that no gap (starting from from_ns) is longer
+    than max_interval_ns.  Returns the merged deadlines along with the indices
+    at which the original deadlines landed.
+    """
+    starts = np.empty_like(deadlines)
+    starts[:1] = from_ns
+    starts[1:] = deadlines[:-1]
+
+    nops = np.maximum(deadlines - starts - 1, 0) // max_interval_ns
+    nops_before = np.cumsum(nops)
+    step_idx = np.arange(len(deadlines)) + nops_before
+
+    total_nops = int(nops_before[-1]) if len(nops_before) else 0
+    if total_nops == 0:
+        return deadlines, step_idx
+
+    merged = np.empty(len(deadlines) + total_nops, dtype=np.int64)
+    merged[step_idx] = deadlines
+
+    is_nop = np.ones(len(merged), dtype=bool)
+    is_nop[step_idx] = False
+    # For each NOP, its 1-based index within the gap it fills.
+    k = np.arange(1, total_nops + 1) - np.repeat(nops_before - nops, nops)
+    merged[is_nop] = np.repeat(starts, nops) + k * max_interval_ns
+
+    return merged, step_idx
+
+
+def _chunk_bounds(config: StepperConfig, deadlines: np.ndarray):
+    """Yields (lo, hi) slice bounds that split deadlines into chunks."""
+    lo = 0
+    while lo < len(deadlines):
+        hi = int(np.searchsorted(deadlines, deadlines[lo] + config.chunk_ns))
+        hi = max(lo + 1, min(hi, lo + config.chunk_steps))
+        yield lo, hi
+        lo = hi
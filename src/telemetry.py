@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class TimingStats:
+    count: int  # pulses recorded
+    late: int  # pulses whose deadline had already passed before sleeping
+    p50_ns: int
+    p99_ns: int
+    max_ns: int
+    queue_depth: int  # planned chunks waiting to be executed
+
+
+class LatenessHistogram:
+    """
+    Fixed-size histogram of how late pulses were relative to their planned
+    deadlines.
+
+    record() is meant to be called from a single thread (a Stepper's mover), so
+    it doesn't take a lock.  snapshot() may run concurrently and miss an
+    in-flight update, which is fine for telemetry.
+    """
+
+    _bucket_ns: int
+    # The final bucket collects everything that doesn't fit in the others.
+    _counts: list[int]
+    _late: int
+    _max_ns: int
+
+    def __init__(self, bucket_ns: int = 10_000, buckets: int = 1_000):
+        self._bucket_ns = bucket_ns
+        self._counts = [0] * (buckets + 1)
+        self._late = 0
+        self._max_ns = 0
+
+    def record(self, lateness_ns: int, late: bool):
+        lateness_ns = max(lateness_ns, 0)
+        i = min(lateness_ns // self._bucket_ns, len(self._counts) - 1)
+        self._counts[i] += 1
+        if late:
+            self._late += 1
+        if lateness_ns > self._max_ns:
+            self._max_ns = lateness_ns
+
+    def snapshot(self, queue_depth: int = 0) -> TimingStats:
+        counts = np.array(self._counts, dtype=np.int64)
+        cumulative = np.cumsum(counts)
+        count = int(cumulative[-1])
+
+        return TimingStats(
+            count=count,
+            late=self._late,
+            p50_ns=self._percentile(cumulative, 0.50),
+            p99_ns=self._percentile(cumulative, 0.99),
+            max_ns=self._max_ns,
+            queue_depth=queue_depth,
+        )
+
+    def _percentile(self, cumulative: np.ndarray, q: float) -> int:
+        """Returns the upper edge of the bucket containing the q-th quantile"""
+        count = cumulative[-1]
+        if count == 0:
+            return 0
+        i = int(np.searchsorted(cumulative, q * count))
+        if i == len(cumulative) - 1:
+            # Overflow bucket: the best bound we have is the max.
+            return self._max_ns
+        return min((i + 1) * self._bucket_ns, self._max_ns)
@@ -1,15 +1,16 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from datetime import datetime, timezone
-import functools
+from collections import OrderedDict
+from dataclasses import astuple, dataclass, field
+import itertools
 import logging
+import math
 import multiprocessing as mp
 import multiprocessing.connection as mpc
-import multiprocessing.synchronize as mps
-from threading import Condition, Event, Thread
+import os
+from threading import Condition, Event, Lock, Thread
 import time
-from typing import Protocol, TypeAlias
+from typing import Callable, Iterator, Protocol, TypeAlias
 from typing_extensions import assert_never
 
 import astropy.units as u
@@ -18,6 +19,7 @@ from astropy.coordinates import (
     SkyCoord,
     HADec,
     ICRS,
+    UnitSphericalRepresentation,
     get_body,
     solar_system_ephemeris,
 )
@@ -26,8 +28,18 @@ import numpy as np
 import trio
 
 from .activity import Activity as _Activity, ActivityStatus
+from .ephemeris import (
+    DAY_NS,
+    ChebyshevEphemeris,
+    EphemerisFile,
+    cached_fit,
+    night_start_ns,
+)
+from .lib.seqlock import SharedStruct
 from .motion import trapz_v_c_to_intercept_at_t
-from .stepper import Stepper, StepperConfig, compute_intercept
+from .sidereal import FixedHADec
+from .stepper import Stepper, StepperConfig, compute_intercept, hand_off
+from .telemetry import TimingStats
 
 TelescopeOrientation: TypeAlias = tuple[u.Quantity["angle"], u.Quantity["angle"]]
 
@@ -35,6 +47,8 @@ TelescopeOrientation: TypeAlias = tuple[u.Quantity["angle"], u.Quantity["angle"]
 @dataclass
 class _Track:
     target: Target
+    # To reply to with the TrackPlan (see TelescopeControl.goto)
+    request_id: int | None = None
 
 
 @dataclass
@@ -86,19 +100,80 @@ class Config:
     declination_axis: StepperAxis
 
     location: EarthLocation
-    predict_ns: int = 30_000_000_000
-    publish_interval: float = 0.25
+    # Length of each tracking segment.  Stepper carries fractional steps from
+    # one segment to the next, so this can be short.
+    predict_ns: int = 2_000_000_000
+    # How often the state (orientation, telemetry...) read by TelescopeControl
+    # is updated.  It's cheap (see _STATE).
+    publish_interval: float = 0.1
+    # Target positions are computed ahead, ephemeris_span_ns at a time, in one
+    # (vectorized) transform sampled every ephemeris_step_ns, and interpolated
+    # from there.
+    ephemeris_span_ns: int = 3_600_000_000_000
+    ephemeris_step_ns: int = 10_000_000_000
+    # Predict FixedTargets analytically (see FixedHADec) rather than through
+    # astropy.  Turn this off to validate against astropy.
+    fast_fixed_targets: bool = True
+    # Where ChebyshevTargets (see TelescopeControl.fit_ephemeris) keep their
+    # fits, and the EphemerisFile (if any) to sample them from instead of the
+    # underlying target.
+    ephemeris_cache_dir: str | None = None
+    ephemeris_stand_in: str | None = None
+
+
+@dataclass(frozen=True)
+class Telemetry:
+    bearing: TimingStats
+    dec: TimingStats
 
 
 class Busy(Exception):
     pass
 
 
+class Superseded(Exception):
+    """Another goal came along before this one was acted on"""
+
+
+@dataclass(frozen=True)
+class TrackPlan:
+    """How a target is to be reached, as planned when tracking it starts"""
+
+    # From when the plan was made until on target
+    intercept_s: float
+    # Distance to go on each axis
+    bearing_steps: float
+    dec_steps: float
+    # Whether the motors carried on from the previous target's slew (see
+    # stepper.hand_off), rather than starting from a standstill
+    retarget: bool
+
+
 class Target(Protocol):
     def coordinate(self, time: Time, location: EarthLocation) -> SkyCoord:
+        """
+        time may be an array of times, in which case the result is an array of
+        coordinates to match.
+        """
         ...
 
 
+def target_hadec(
+    target: Target, time: Time, location: EarthLocation
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the hour angle and declination (in radians) of target at each of
+    time (which may be an array), computed in one transform.
+    """
+    frame = HADec(obstime=time, location=location)
+    hadec = target.coordinate(time, location).transform_to(frame)
+
+    return (
+        np.atleast_1d(hadec.ha.to_value(u.rad)),  # pyright: ignore
+        np.atleast_1d(hadec.dec.to_value(u.rad)),  # pyright: ignore
+    )
+
+
 @dataclass
 class FixedTarget(Target):
     coord: SkyCoord
@@ -123,35 +198,147 @@ class MPCQueryTarget(Target):
     def coordinate(self, time: Time, location: EarthLocation):
         from astroquery.mpc import MPC
 
+        # The MPC service only takes evenly spaced times, so an array of times
+        # is assumed to be.
+        times = np.atleast_1d(time)
+        step = (times[1] - times[0]).to(u.s) if len(times) > 1 else 1 * u.s
+
         eph = MPC.get_ephemeris(  # pyright: ignore
             self.name,
-            start=time,
+            start=times[0],
+            step=step,
             location=location,
-            number=1,
+            number=len(times),
         )
 
-        return SkyCoord(
-            ra=eph["RA"].to(u.hourangle)[0],
-            dec=eph["Dec"].to(u.deg)[0],
-            frame=ICRS,
-        )
+        ra = eph["RA"].to(u.hourangle)
+        dec = eph["Dec"].to(u.deg)
+        if time.isscalar:
+            ra, dec = ra[0], dec[0]
+
+        return SkyCoord(ra=ra, dec=dec, frame=ICRS)
+
+
+# Each night's fit is made of this many segments.
+_NIGHT_SEGMENTS = 12
+
+
+@dataclass
+class ChebyshevTarget(Target):
+    """
+    Wraps a target that's slow to evaluate (or, like MPCQueryTarget, needs the
+    network) with a Chebyshev fit of its position, sampled once per night.
+
+    Fits are saved in cache_dir (when given), keyed by object and night, so
+    that restarts don't need to sample again.  With stand_in (the path of an
+    EphemerisFile), the target is sampled from that file instead, e.g. for
+    testing offline.
+    """
+
+    target: SolarSystemTarget | MPCQueryTarget
+    cache_dir: str | None = None
+    stand_in: str | None = None
+    _fits: dict[int, ChebyshevEphemeris] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+
+    def coordinate(self, time: Time, location: EarthLocation):
+        t_ns = np.rint(np.asarray(time.unix) * 1_000_000_000).astype(np.int64)
+        ra, dec, _, _ = self.radec(t_ns, location)
+        return SkyCoord(ra=ra * u.rad, dec=dec * u.rad, frame=ICRS)
+
+    def radec(self, t_ns: int | np.ndarray, location: EarthLocation):
+        """
+        Returns ICRS right ascension and declination (radians) at t_ns
+        (time.time_ns() values), along with their rates (radians/s)
+        """
+        t = np.asarray(t_ns)
+        # Finding the night needs location's longitude, which is surprisingly
+        # slow, so check the nights already fit first.
+        for fit in self._fits.values():
+            if fit.covers(t):
+                return fit.evaluate(t)
+
+        nights = night_start_ns(t, location)
+
+        if np.ndim(nights) == 0:
+            return self._fit(int(nights), location).evaluate(t)
+
+        results = [np.empty(t.shape) for _ in range(4)]
+        for night in np.unique(nights):
+            m = nights == night
+            for result, value in zip(
+                results, self._fit(int(night), location).evaluate(t[m])
+            ):
+                result[m] = value
+
+        return tuple(results)
+
+    def _fit(self, night_ns: int, location: EarthLocation) -> ChebyshevEphemeris:
+        fit = self._fits.get(night_ns)
+        if fit is None:
+            lat = location.lat.to_value(u.deg)
+            lon = location.lon.to_value(u.deg)
+            key = f"{type(self.target).__name__}-{self.target.name}-{lat:.4f},{lon:.4f}"
+            if self.stand_in is not None:
+                # Don't mix stand-in fits up with real ones.
+                key += f"-{os.path.basename(self.stand_in)}"
+            fit = cached_fit(
+                self.cache_dir,
+                key,
+                self._sampler(location),
+                night_ns,
+                DAY_NS // _NIGHT_SEGMENTS,
+                _NIGHT_SEGMENTS,
+            )
+            self._fits[night_ns] = fit
+        return fit
+
+    def _sampler(self, location: EarthLocation):
+        if self.stand_in is not None:
+            return EphemerisFile(self.stand_in).sampler(self.target.name)
+
+        def sample(t_ns: np.ndarray):
+            time = Time(t_ns / 1_000_000_000, format="unix")
+            coord = self.target.coordinate(time, location)
+
+            # Only the direction (as seen from location) matters.  Dropping the
+            # distance keeps the conversion to ICRS from moving the origin,
+            # which would shift nearby bodies (like the Moon) a long way.
+            direction = coord.frame.realize_frame(
+                coord.frame.represent_as(UnitSphericalRepresentation)
+            )
+            icrs = direction.transform_to(ICRS())
+            return (
+                np.atleast_1d(icrs.ra.to_value(u.rad)),  # pyright: ignore
+                np.atleast_1d(icrs.dec.to_value(u.rad)),  # pyright: ignore
+            )
+
+        return sample
 
 
 class TelescopeControl:
     _config: Config
     _conn: mpc.Connection | None
-    _orientation: TelescopeOrientation
+    # Commands may be issued from worker threads (see lib.threads).
+    _send_lock: Lock
+    # Written by the control process, while it's running
+    _state: SharedStruct | None
+    # The latest target to have come through _conn
     _target: Target | None
+    # Waiting for replies, by request id
+    _replies: dict[int, trio.MemorySendChannel]
+    _request_ids: Iterator[int]
     _log: logging.Logger
 
     def __init__(self, config: Config):
         self._config = config
         self._conn = None
-        self._orientation = (
-            0 * u.hourangle,  # pyright: ignore
-            0 * u.deg,  # pyright: ignore
-        )
+        self._send_lock = Lock()
+        self._state = None
         self._target = None
+        self._replies = {}
+        self._request_ids = itertools.count(1)
         self._log = logging.getLogger(__name__)
 
     @property
@@ -159,18 +346,83 @@ class TelescopeControl:
         return self._config
 
     @property
-    def orientation(self):
-        return self._orientation
+    def orientation(self) -> TelescopeOrientation:
+        state = self._read_state()
+        bearing_steps, dec_steps = (0, 0) if state is None else state[1:3]
+        return (
+            _steps_to_angle(self._config.bearing_axis, bearing_steps),
+            _steps_to_angle(self._config.declination_axis, dec_steps),
+        )
+
+    @property
+    def velocity(self) -> TelescopeOrientation:
+        """Of each axis, per second"""
+        state = self._read_state()
+        bearing_vel, dec_vel = (0.0, 0.0) if state is None else state[3:5]
+        return (
+            bearing_vel * _angle_per_step(self._config.bearing_axis),
+            dec_vel * _angle_per_step(self._config.declination_axis),
+        )
 
     @property
     def target(self):
+        state = self._read_state()
+        # (Tracking may be known to have stopped before word of it has come
+        # through _conn.)
+        if state is None or state[5] == 0:
+            return None
         return self._target
 
+    @property
+    def telemetry(self):
+        state = self._read_state()
+        if state is None or not state[0]:
+            return None
+        return Telemetry(
+            bearing=TimingStats(*state[6:12]),
+            dec=TimingStats(*state[12:18]),
+        )
+
+    def _read_state(self):
+        """The control process's state (see _STATE), or None if it isn't running"""
+        state = self._state
+        return None if state is None else state.read(_STATE_READ_TIMEOUT)
+
     def track(self, target: Target):
         self._put_message(_Track(target))
 
+    async def goto(self, target: Target) -> TrackPlan:
+        """
+        Like track, but waits until the control process has planned how to
+        get to target, and returns the plan.  Raises Superseded if another
+        goal comes along first.
+        """
+        request_id = next(self._request_ids)
+        send, receive = trio.open_memory_channel(1)
+        self._replies[request_id] = send
+        try:
+            self._put_message(_Track(target, request_id))
+            try:
+                reply: _Reply = await receive.receive()
+            except trio.EndOfChannel:
+                raise RuntimeError("telescope control stopped") from None
+        finally:
+            self._replies.pop(request_id, None)
+
+        if reply.plan is None:
+            raise Superseded()
+        return reply.plan
+
+    def fit_ephemeris(self, target: SolarSystemTarget | MPCQueryTarget):
+        """Wraps target in a ChebyshevTarget, as configured"""
+        return ChebyshevTarget(
+            target,
+            cache_dir=self._config.ephemeris_cache_dir,
+            stand_in=self._config.ephemeris_stand_in,
+        )
+
     def current_skycoord(self):
-        bearing, dec = self._orientation
+        bearing, dec = self.orientation
 
         return SkyCoord(
             bearing,
@@ -195,6 +447,14 @@ class TelescopeControl:
         self._put_message(_CalibrateRelSteps(bearing, dec))
 
     async def run(self):
+        self._state = SharedStruct(_STATE)
+        try:
+            await self._run()
+        finally:
+            state, self._state = self._state, None
+            state.close()
+
+    async def _run(self):
         conn, child_conn = mp.Pipe()
         # The type definitions for mp.Pipe are different  on Unix and Windows.
         # They are nominally incompatible so there is a type error, but
@@ -202,82 +462,105 @@ class TelescopeControl:
         # TODO: Define a protocol that defines the part of the [Pipe]Connection
         # interface that we rely on?
         self._conn = conn  # pyright: ignore
-        stop = mp.Event()
-
-        async with trio.open_nursery() as n:
-            n.start_soon(
-                functools.partial(
-                    trio.to_thread.run_sync,
-                    self._run_multiprocess,
-                    conn,
-                    child_conn,
-                    stop,
-                )
-            )
 
-            try:
-                await trio.sleep_forever()
-            except:
-                stop.set()
-
-    def _put_message(self, msg: _InputMessage):
-        if self._conn is None:
-            raise RuntimeError("must be running to issue commands")
-
-        self._conn.send(msg)
-
-    def _run_multiprocess(
-        self,
-        conn: mpc.Connection,
-        child_conn: mpc.Connection,
-        stop: mps.Event,
-    ):
         proc = mp.Process(
-            target=_with_error_printing(_mp_main), args=[self.config, child_conn]
+            target=_with_error_printing(_mp_main),
+            args=[self.config, child_conn, self._state],
         )
         proc.start()
+        # (The child has its own, and without ours, its exit ends the pipe.)
+        child_conn.close()
 
         child_had_error = False
-        stop_deadline = None
-        while proc.exitcode is None and (
-            stop_deadline is None or time.time() < stop_deadline
-        ):
-            if stop.is_set():
-                stop_deadline = time.time() + 5
-                self._log.info("stopping")
-                conn.send(_Stop())
-                stop.clear()
-
-            if conn.poll(1):
-                msg: _OutputMessage = conn.recv()
-                match msg:
-                    case _Log(record):
-                        self._log.callHandlers(record)
-                    case _PublishOrientation(orientation):
 
-                        def update():
-                            self._orientation = orientation
+        def on_error():
+            nonlocal child_had_error
+            child_had_error = True
+            n.cancel_scope.cancel()
 
-                        trio.from_thread.run_sync(update)
-                    case _PublishTarget(target):
+        try:
+            async with trio.open_nursery() as n:
+                n.start_soon(self._receive_loop, conn, on_error)
+                await trio.lowlevel.wait_readable(proc.sentinel)
+                n.cancel_scope.cancel()
+        finally:
+            with trio.CancelScope(shield=True):
+                await self._stop(conn, proc)
+
+        if child_had_error:
+            raise Exception("telescope error (see above)") from None
+
+    async def _stop(self, conn: mpc.Connection, proc: mp.Process):
+        if proc.exitcode is None:
+            self._log.info("stopping")
+            try:
+                self._put_message(_Stop())
+            except OSError:
+                pass
 
-                        def update():
-                            self._target = target
+            # Carry on passing on its logs until it's stopped.
+            with trio.move_on_after(5):
+                async with trio.open_nursery() as n:
+                    n.start_soon(self._receive_loop, conn, lambda: None)
+                    await trio.lowlevel.wait_readable(proc.sentinel)
+                    n.cancel_scope.cancel()
 
-                        trio.from_thread.run_sync(update)
+            if proc.exitcode is None:
+                self._log.error("timed out waiting for telescope control to stop")
+                proc.kill()
+
+        self._conn = None
+        for send in self._replies.values():
+            send.close()
+        conn.close()
+
+    def _put_message(self, msg: _InputMessage):
+        if self._conn is None:
+            raise RuntimeError("must be running to issue commands")
+
+        with self._send_lock:
+            self._conn.send(msg)
+
+    async def _receive_loop(self, conn: mpc.Connection, on_error: Callable[[], None]):
+        """Handles messages from the control process, as soon as they come"""
+        while True:
+            await trio.lowlevel.wait_readable(conn.fileno())
+            while conn.poll():
+                try:
+                    msg: _OutputMessage = conn.recv()
+                except EOFError:
+                    return
+
+                # (Orientation and telemetry don't come this way, but through
+                # _state.)
+                match msg:
+                    case _Log(name, levelno, message, created, exc_text):
+                        self._log.callHandlers(
+                            logging.makeLogRecord(
+                                {
+                                    "name": name,
+                                    "levelno": levelno,
+                                    "levelname": logging.getLevelName(levelno),
+                                    "msg": message,
+                                    "created": created,
+                                    "msecs": created % 1 * 1000,
+                                    "exc_text": exc_text,
+                                }
+                            )
+                        )
+                    case _PublishTarget(target):
+                        self._target = target
+                    case _Reply(request_id):
+                        # (Replies to requests given up on are dropped, as are
+                        # repeats.)
+                        send = self._replies.pop(request_id, None)
+                        if send is not None:
+                            send.send_nowait(msg)
                     case _ChildError():
-                        child_had_error = True
-                        stop.set()
+                        on_error()
                     case _:
                         assert_never(msg)
 
-        if proc.exitcode is None:
-            self._log.error("timed out waiting for telescope control to stop")
-            proc.kill()
-
-        if child_had_error:
-            raise Exception("telescope error (see above)") from None
-
 
 @dataclass
 class _PublishTarget:
@@ -285,13 +568,25 @@ class _PublishTarget:
 
 
 @dataclass
-class _PublishOrientation:
-    orientation: TelescopeOrientation
+class _Log:
+    """A log record, formatted (so as not to pickle its args)"""
 
+    name: str
+    levelno: int
+    message: str
+    created: float
+    exc_text: str | None
 
-@dataclass
-class _Log:
-    record: logging.LogRecord
+
+# The control process's state, as shared with TelescopeControl: published (1
+# once it's written), bearing and dec steps, their velocities (steps/s), the
+# target's id (counting up from 1 with each new target, 0 for none), and
+# TimingStats for each motor.
+_STATE = "<?qqddq" + "qqqqqq" * 2
+# How long (in seconds) a read of _STATE keeps retrying while a write is in
+# progress, before settling for the last consistent state.  Writes take
+# microseconds, and reads happen on the event loop, so this is kept short.
+_STATE_READ_TIMEOUT = 0.002
 
 
 @dataclass
@@ -299,8 +594,15 @@ class _ChildError:
     pass
 
 
+@dataclass
+class _Reply:
+    request_id: int
+    # None if superseded
+    plan: TrackPlan | None
+
+
 _InputMessage: TypeAlias = _Calibrate | _CalibrateRelSteps | _Goal
-_OutputMessage: TypeAlias = _PublishTarget | _PublishOrientation | _Log | _ChildError
+_OutputMessage: TypeAlias = _PublishTarget | _Log | _ChildError | _Reply
 
 
 class StateFn(Protocol):
@@ -320,10 +622,17 @@ class _RunContext:
     # Logger objects are not multiprocess safe, so we create a new Logger in the
     # child process.
     log: logging.Logger
+    predictions: _PredictionCache
+    state: SharedStruct
+    # conn is written to from several threads.
+    send_lock: Lock
     bearing_offset: int = 0
     dec_offset: int = 0
     target: Target | None = None
     activity: _TelescopeActivity | None = None
+    # Motor activities of a track that was retargeted, left running for the
+    # next track to take over from (see stepper.hand_off).
+    superseded: list[_ActivityGroup] = field(default_factory=list)
     stop: Event = field(default_factory=Event)
     cond: Condition = field(default_factory=Condition)
     activity_cond: Condition = field(default_factory=Condition)
@@ -349,12 +658,24 @@ def _with_error_printing(fn):
     return wrapper
 
 
-def _mp_main(config: Config, conn: mpc.Connection):
+def _mp_main(config: Config, conn: mpc.Connection, state: SharedStruct):
     log = logging.Logger(__name__ + ".mp", logging.getLogger(__name__).level)
+    send_lock = Lock()
 
     class LogHandler(logging.Handler):
         def emit(self, record: logging.LogRecord) -> None:
-            conn.send(_Log(record))
+            exc_text = None
+            if record.exc_info:
+                exc_text = logging.Formatter().formatException(record.exc_info)
+            msg = _Log(
+                record.name,
+                record.levelno,
+                record.getMessage(),
+                record.created,
+                exc_text,
+            )
+            with send_lock:
+                conn.send(msg)
 
     log.addHandler(LogHandler())
 
@@ -365,6 +686,14 @@ def _mp_main(config: Config, conn: mpc.Connection):
         bearing_motor=Stepper(config.bearing_axis.config),
         dec_motor=Stepper(config.declination_axis.config),
         log=log,
+        predictions=_PredictionCache(
+            config.location,
+            span_ns=config.ephemeris_span_ns,
+            step_ns=config.ephemeris_step_ns,
+            fixed=(FixedHADec(config.location) if config.fast_fixed_targets else None),
+        ),
+        state=state,
+        send_lock=send_lock,
     )
 
     ctx.bearing_motor.start()
@@ -385,7 +714,8 @@ def _mp_main(config: Config, conn: mpc.Connection):
     try:
         _run(ctx, conn)
     except Exception as e:
-        conn.send(_ChildError())
+        with send_lock:
+            conn.send(_ChildError())
         raise e
     finally:
         ctx.stop.set()
@@ -448,6 +778,10 @@ def _run_dispatch(ctx: _RunContext, conn: mpc.Connection) -> StateFn:
         activity._status = ActivityStatus.ACTIVE
         activity._cond.notify_all()
 
+    if ctx.superseded and not isinstance(activity._goal, _Track):
+        _ag_cancel_all(ctx.superseded)
+        ctx.superseded = []
+
     match activity._goal:
         case _Track():
             return _run_track(activity)
@@ -461,38 +795,70 @@ def _run_dispatch(ctx: _RunContext, conn: mpc.Connection) -> StateFn:
 
 def _read_goals(ctx: _RunContext, conn: mpc.Connection):
     while True:
-        msg: _InputMessage = conn.recv()
-        match msg:
-            case (_Track() | _Stop() | _Idle()) as goal:
-                ctx.log.debug(f"received goal {goal}")
-                with ctx.cond:
-                    if ctx.activity is not None:
-                        ctx.log.debug(f"canceling activity: {ctx.activity}")
-                        ctx.activity.cancel()
-                    ctx.activity = _TelescopeActivity(goal, ctx.activity_cond)
-                    ctx.log.debug(f"set activity: {ctx.activity}")
-                    ctx.cond.notify()
-
-                if isinstance(goal, _Stop):
-                    break
-            case _Calibrate(bearing, dec):
-                with ctx.cond:
-                    ctx.bearing_offset = round(
-                        _angle_to_steps(ctx.config.bearing_axis, bearing)
-                        - ctx.bearing_motor.position
-                    )
-                    ctx.dec_offset = round(
-                        _angle_to_steps(ctx.config.declination_axis, dec)
-                        - ctx.dec_motor.position
-                    )
-                ctx.log.debug(f"calibrated: {ctx.bearing_offset}, {ctx.dec_offset}")
-            case _CalibrateRelSteps(bearing, dec):
-                with ctx.cond:
-                    ctx.bearing_offset += bearing
-                    ctx.dec_offset += dec
-                ctx.log.debug(f"calibrated: {ctx.bearing_offset}, {ctx.dec_offset}")
-            case _:
-                assert_never(msg)
+        # Take whatever else has arrived too, so that of a burst of goals (e.g.
+        # clicking through objects in Stellarium) only the last is acted on.
+        msgs: list[_InputMessage] = [conn.recv()]
+        while conn.poll():
+            msgs.append(conn.recv())
+
+        goal: _Goal | None = None
+        for msg in msgs:
+            match msg:
+                case _Track() | _Stop() | _Idle():
+                    # Nothing supersedes stopping.
+                    if isinstance(goal, _Stop):
+                        _reply(ctx, conn, msg)
+                        continue
+                    if goal is not None:
+                        ctx.log.debug(f"dropping superseded goal {goal}")
+                        _reply(ctx, conn, goal)
+                    goal = msg
+                case _Calibrate(bearing, dec):
+                    with ctx.cond:
+                        ctx.bearing_offset = round(
+                            _angle_to_steps(ctx.config.bearing_axis, bearing)
+                            - ctx.bearing_motor.position
+                        )
+                        ctx.dec_offset = round(
+                            _angle_to_steps(ctx.config.declination_axis, dec)
+                            - ctx.dec_motor.position
+                        )
+                    ctx.log.debug(f"calibrated: {ctx.bearing_offset}, {ctx.dec_offset}")
+                case _CalibrateRelSteps(bearing, dec):
+                    with ctx.cond:
+                        ctx.bearing_offset += bearing
+                        ctx.dec_offset += dec
+                    ctx.log.debug(f"calibrated: {ctx.bearing_offset}, {ctx.dec_offset}")
+                case _:
+                    assert_never(msg)
+
+        if goal is None:
+            continue
+
+        ctx.log.debug(f"received goal {goal}")
+        with ctx.cond:
+            if ctx.activity is not None:
+                ctx.log.debug(f"canceling activity: {ctx.activity}")
+                ctx.activity.cancel()
+                # (If it had got as far as planning, this is a repeat, and
+                # ignored.)
+                _reply(ctx, conn, ctx.activity._goal)
+            ctx.activity = _TelescopeActivity(goal, ctx.activity_cond)
+            ctx.log.debug(f"set activity: {ctx.activity}")
+            ctx.cond.notify()
+
+        if isinstance(goal, _Stop):
+            break
+
+
+def _reply(
+    ctx: _RunContext, conn: mpc.Connection, goal: _Goal, plan: TrackPlan | None = None
+):
+    """Replies to goal's request, if any, with plan (None if superseded)"""
+    if not isinstance(goal, _Track) or goal.request_id is None:
+        return
+    with ctx.send_lock:
+        conn.send(_Reply(goal.request_id, plan))
 
 
 _: StateFn = _run_dispatch
@@ -511,62 +877,87 @@ def _ag_cancel_all(groups: list[_ActivityGroup]):
 
 
 def _ag_wait_one_group(parent: _TelescopeActivity, groups: list[_ActivityGroup]):
+    """
+    Waits for the first group to finish, and drops it.  Returns False (leaving
+    it) if parent is canceled first.  The group's activities must share
+    parent's condition.
+    """
     if len(groups) == 0:
         raise ValueError("activity_groups must not be empty")
 
     for act in groups[0]:
-        while not act.wait_for(ActivityStatus.done, timeout=0.5):
+        with parent._cond:
+            parent._cond.wait_for(lambda: act._status.done() or parent._canceled)
             if parent._canceled:
-                with parent._cond:
-                    parent._status = ActivityStatus.ABORTING
-                    parent._cond.notify_all()
-                _ag_cancel_all(groups)
-                with parent._cond:
-                    parent._status = ActivityStatus.ABORTED
-                    parent._cond.notify_all()
                 return False
     groups.pop(0)
 
     return True
 
 
+def _ag_abort(parent: _TelescopeActivity, groups: list[_ActivityGroup]):
+    with parent._cond:
+        parent._status = ActivityStatus.ABORTING
+        parent._cond.notify_all()
+    _ag_cancel_all(groups)
+    with parent._cond:
+        parent._status = ActivityStatus.ABORTED
+        parent._cond.notify_all()
+
+
+def _retargeting(ctx: _RunContext):
+    """Whether the next activity is another track (to hand the motors to)"""
+    with ctx.cond:
+        return ctx.activity is not None and isinstance(ctx.activity._goal, _Track)
+
+
 def _run_track(activity: _TelescopeActivity) -> StateFn:
     assert isinstance(activity._goal, _Track)
     goal = activity._goal
 
     def run_track(ctx: _RunContext, conn: mpc.Connection):
         if activity._canceled:
+            _reply(ctx, conn, goal)
             _finalize_activity(activity)
             _clear_activity(ctx, activity)
             return _run_dispatch
 
+        superseded, ctx.superseded = ctx.superseded, []
+
         with ctx.cond:
             ctx.target = goal.target
             ctx.cond.notify_all()
 
         try:
             predict_dt_ns = ctx.config.predict_ns
-            predict_dt = predict_dt_ns * u.nanosecond  # pyright: ignore
+
+            # Do any slow setup up front, so that it doesn't eat into the time
+            # left to plan the intercept.
+            ctx.predictions.prepare(goal.target, time.time_ns())
 
             # Predict target location a short time in the future (to leave time
             # for the initial calculations)
-            planned_to_ns = time.time_ns() + 500_000_000
-            planned_to_time = Time(
-                datetime.fromtimestamp(planned_to_ns / 1_000_000_000, timezone.utc)
-            )
+            planned_to_ns = time.monotonic_ns() + 500_000_000
+            planned_to_wall_ns = _monotonic_to_wall_ns(planned_to_ns)
 
             tgt_bearing_steps, tgt_dec_steps = _predict_pos(
-                ctx, goal.target, planned_to_time
+                ctx, goal.target, planned_to_wall_ns
             )
 
             tgt_bearing_vel, tgt_dec_vel = _predict_vel(
-                ctx, goal.target, planned_to_time, predict_dt
+                ctx, goal.target, planned_to_wall_ns, predict_dt_ns
             )
 
+            # Take position and velocity together, so that a target change
+            # mid-slew starts from where (and how fast) the motors really are.
+            now_ns = time.monotonic_ns()
+            bearing_state = ctx.bearing_motor.state(now_ns)
+            dec_state = ctx.dec_motor.state(now_ns)
+
             bearing_kwargs = {
                 "config": ctx.bearing_motor.config,
-                "position": ctx.bearing_steps,
-                "velocity": ctx.bearing_motor.velocity,
+                "position": bearing_state.position + ctx.bearing_offset,
+                "velocity": bearing_state.velocity,
                 "target": tgt_bearing_steps,
                 "target_velocity": tgt_bearing_vel,
                 "final_velocity": tgt_bearing_vel,
@@ -575,8 +966,8 @@ def _run_track(activity: _TelescopeActivity) -> StateFn:
 
             dec_kwargs = {
                 "config": ctx.dec_motor.config,
-                "position": ctx.dec_steps,
-                "velocity": ctx.dec_motor.velocity,
+                "position": dec_state.position + ctx.dec_offset,
+                "velocity": dec_state.velocity,
                 "target": tgt_dec_steps,
                 "target_velocity": tgt_dec_vel,
                 "final_velocity": tgt_dec_vel,
@@ -585,31 +976,77 @@ def _run_track(activity: _TelescopeActivity) -> StateFn:
 
             activity_groups: list[_ActivityGroup] = []
 
-            if bearing_params.t < dec_params.t:
-                bearing_params = compute_intercept(**bearing_kwargs, t=dec_params.t)
-            elif bearing_params.t > dec_params.t:
-                dec_params = compute_intercept(**dec_kwargs, t=bearing_params.t)
+            if superseded:
+                # Rather than stopping and starting over, take over from
+                # wherever the motors are committed to be (a little ahead of
+                # now), heading for where the target is now.
+                now_wall_ns = _monotonic_to_wall_ns(now_ns)
+                bearing_now, dec_now = _predict_pos(ctx, goal.target, now_wall_ns)
+                intercept_group = [
+                    ctx.bearing_motor.intercept(
+                        bearing_now - ctx.bearing_offset,
+                        tgt_bearing_vel,
+                        cond=ctx.activity_cond,
+                    ),
+                    ctx.dec_motor.intercept(
+                        dec_now - ctx.dec_offset,
+                        tgt_dec_vel,
+                        cond=ctx.activity_cond,
+                    ),
+                ]
+                for group in superseded:
+                    for act in group:
+                        hand_off(act)
+
+                # Roughly when the intercepts end.  Tracking segments start
+                # whenever they actually do.
+                planned_to_ns = now_ns + round(
+                    max(dec_params.t, bearing_params.t) * 1_000_000_000
+                )
             else:
-                ctx.log.debug("lucky you! synchronicity.")
-
-            intercept_group = [
-                ctx.bearing_motor.intercept_precomputed(bearing_params, planned_to_ns),
-                ctx.dec_motor.intercept_precomputed(dec_params, planned_to_ns),
-            ]
-
-            planned_to_ns += round(max(dec_params.t, bearing_params.t) * 1_000_000_000)
+                if bearing_params.t < dec_params.t:
+                    bearing_params = compute_intercept(**bearing_kwargs, t=dec_params.t)
+                elif bearing_params.t > dec_params.t:
+                    dec_params = compute_intercept(**dec_kwargs, t=bearing_params.t)
+                else:
+                    ctx.log.debug("lucky you! synchronicity.")
+
+                intercept_group = [
+                    ctx.bearing_motor.intercept_precomputed(
+                        bearing_params, planned_to_ns, cond=ctx.activity_cond
+                    ),
+                    ctx.dec_motor.intercept_precomputed(
+                        dec_params, planned_to_ns, cond=ctx.activity_cond
+                    ),
+                ]
+
+                planned_to_ns += round(
+                    max(dec_params.t, bearing_params.t) * 1_000_000_000
+                )
             activity_groups.append(intercept_group)
 
+            _reply(
+                ctx,
+                conn,
+                goal,
+                TrackPlan(
+                    intercept_s=(planned_to_ns - now_ns) / 1_000_000_000,
+                    bearing_steps=bearing_params.delta,
+                    dec_steps=dec_params.delta,
+                    retarget=bool(superseded),
+                ),
+            )
+
             while True:
                 # NOTE: Assuming velocity doesn't change too much, so we don't need
                 # a ramp.  For more dynamic objects, the situation would be more
                 # complex.
 
-                planned_to_time = Time(
-                    datetime.fromtimestamp(planned_to_ns / 1_000_000_000, timezone.utc)
-                )
                 tgt_bearing_vel, tgt_dec_vel = _predict_vel(
-                    ctx, goal.target, planned_to_time, predict_dt
+                    ctx,
+                    goal.target,
+                    _monotonic_to_wall_ns(planned_to_ns),
+                    predict_dt_ns,
                 )
 
                 ctx.log.debug(
@@ -619,16 +1056,30 @@ def _run_track(activity: _TelescopeActivity) -> StateFn:
                 planned_to_ns += predict_dt_ns
                 activity_groups.append(
                     [
-                        ctx.bearing_motor.run_constant(tgt_bearing_vel, planned_to_ns),
-                        ctx.dec_motor.run_constant(tgt_dec_vel, planned_to_ns),
+                        ctx.bearing_motor.run_constant(
+                            tgt_bearing_vel, planned_to_ns, cond=ctx.activity_cond
+                        ),
+                        ctx.dec_motor.run_constant(
+                            tgt_dec_vel, planned_to_ns, cond=ctx.activity_cond
+                        ),
                     ]
                 )
 
                 if not _ag_wait_one_group(activity, activity_groups):
                     if activity_groups[0] == intercept_group:
-                        ctx.log.info("canceled while intercepting")
+                        stage = "intercepting"
+                    else:
+                        stage = "tracking"
+
+                    if _retargeting(ctx):
+                        ctx.log.info(f"retargeted while {stage}")
+                        ctx.superseded = activity_groups
+                        with activity._cond:
+                            activity._status = ActivityStatus.ABORTED
+                            activity._cond.notify_all()
                     else:
-                        ctx.log.info("canceled while tracking")
+                        ctx.log.info(f"canceled while {stage}")
+                        _ag_abort(activity, activity_groups)
                     break
 
             _finalize_activity(activity)
@@ -642,40 +1093,191 @@ def _run_track(activity: _TelescopeActivity) -> StateFn:
     return run_track
 
 
-def _predict_pos_raw(config: Config, target: Target, t: Time):
-    """returns values in angle / time"""
+def _monotonic_to_wall_ns(ns: int) -> int:
+    """
+    Converts a time.monotonic_ns() value (as used by Stepper) to a
+    time.time_ns() one (as used for predictions)
+    """
+    return ns + time.time_ns() - time.monotonic_ns()
 
-    frame = HADec(obstime=t, location=config.location)
-    hadec = target.coordinate(t, config.location).transform_to(frame)
 
-    bearing = hadec.ha.to(u.rad)  # pyright: ignore
-    dec = hadec.dec.to(u.rad)  # pyright: ignore
+@dataclass
+class _Ephemeris:
+    """Hour angle and declination of a target, sampled at regular times"""
+
+    start_ns: int  # time.time_ns() of the first sample
+    step_ns: int
+    # Unwrapped, so that it can be interpolated across +/-pi.
+    ha: np.ndarray
+    dec: np.ndarray
+
+    @classmethod
+    def compute(
+        cls,
+        target: Target,
+        location: EarthLocation,
+        start_ns: int,
+        span_ns: int,
+        step_ns: int,
+    ):
+        samples_ns = start_ns + step_ns * np.arange(span_ns // step_ns + 1)
+        times = Time(samples_ns / 1_000_000_000, format="unix")
+        ha, dec = target_hadec(target, times, location)
+        return cls(start_ns, step_ns, np.unwrap(ha), dec)
 
-    return bearing, dec
+    @property
+    def end_ns(self):
+        return self.start_ns + self.step_ns * (len(self.ha) - 1)
+
+    def covers(self, t_ns: int):
+        return self.start_ns <= t_ns <= self.end_ns
+
+    def hadec(self, t_ns: int) -> tuple[float, float]:
+        """returns hour angle (wrapped like astropy, into [-pi, pi)) and dec"""
+        i = (t_ns - self.start_ns) // self.step_ns
+        i = min(max(i, 0), len(self.ha) - 2)
+        # (From the clamped sample, so that the last step, and any time
+        # outside the samples, is interpolated between the right pair.)
+        frac = (t_ns - self.start_ns - i * self.step_ns) / self.step_ns
+
+        ha = float(self.ha[i] + (self.ha[i + 1] - self.ha[i]) * frac)
+        dec = float(self.dec[i] + (self.dec[i + 1] - self.dec[i]) * frac)
+        return (ha + math.pi) % (2 * math.pi) - math.pi, dec
+
+
+class _PredictionCache:
+    """
+    Predicts target positions in HADec by interpolating each target's
+    _Ephemeris, which covers span_ns at a time and is computed in one
+    vectorized transform.
+
+    FixedTargets (and the fitted positions of ChebyshevTargets) are instead
+    converted directly by `fixed` (when given), which is cheaper than even
+    interpolating.
+
+    Results are also memoized, keyed by target and time.  Times are quantized
+    to quantum_ns, so that the repeated predictions of a tracking run (each
+    segment's end is the next one's start) hit the cache, and only the `size`
+    most recently used are kept.
+    """
+
+    _location: EarthLocation
+    _size: int
+    _quantum_ns: int
+    _span_ns: int
+    _step_ns: int
+    _fixed: FixedHADec | None
+    # (id(target), quantized time) -> (target, ha, dec), with targets kept so
+    # that their ids can't be reused while cached.
+    _positions: OrderedDict[tuple[int, int], tuple[Target, float, float]]
+    # id(target) -> (target, ephemeris)
+    _ephemerides: dict[int, tuple[Target, _Ephemeris]]
+
+    def __init__(
+        self,
+        location: EarthLocation,
+        size: int = 64,
+        quantum_ns: int = 1_000_000,
+        span_ns: int = 3_600_000_000_000,
+        step_ns: int = 10_000_000_000,
+        fixed: FixedHADec | None = None,
+    ):
+        self._location = location
+        self._size = size
+        self._quantum_ns = quantum_ns
+        self._span_ns = span_ns
+        self._step_ns = step_ns
+        self._fixed = fixed
+        self._positions = OrderedDict()
+        self._ephemerides = {}
+
+    def prepare(self, target: Target, t_ns: int):
+        """Does the slow parts of predicting target around t_ns, ahead of time"""
+        if self._fixed is not None and isinstance(target, FixedTarget):
+            self._fixed.hadec(target.coord, t_ns)
+        elif self._fixed is not None and isinstance(target, ChebyshevTarget):
+            ra, dec, _, _ = target.radec(t_ns, self._location)
+            self._fixed.hadec_radec(ra, dec, t_ns)
+        else:
+            self.ephemeris(target, t_ns)
+
+    def hadec(self, target: Target, t_ns: int) -> tuple[float, float]:
+        """
+        returns hour angle and declination in radians, at t_ns (a
+        time.time_ns() value)
+        """
+        if self._fixed is not None and isinstance(target, FixedTarget):
+            return self._fixed.hadec(target.coord, t_ns)
+        if self._fixed is not None and isinstance(target, ChebyshevTarget):
+            ra, dec, _, _ = target.radec(t_ns, self._location)
+            return self._fixed.hadec_radec(ra, dec, t_ns)
+
+        q = round(t_ns / self._quantum_ns)
+        key = (id(target), q)
+
+        hit = self._positions.get(key)
+        if hit is not None and hit[0] is target:
+            self._positions.move_to_end(key)
+            return hit[1], hit[2]
+
+        t_ns = q * self._quantum_ns
+        ha, dec = self.ephemeris(target, t_ns).hadec(t_ns)
+
+        self._positions[key] = (target, ha, dec)
+        if len(self._positions) > self._size:
+            self._positions.popitem(last=False)
+
+        return ha, dec
+
+    def ephemeris(self, target: Target, t_ns: int) -> _Ephemeris:
+        """
+        Returns an ephemeris of target covering t_ns (a time.time_ns() value),
+        computing one if needed.
+        """
+        entry = self._ephemerides.get(id(target))
+        if entry is not None and entry[0] is target and entry[1].covers(t_ns):
+            return entry[1]
+
+        # Start a little early, so that slightly earlier predictions (like
+        # those made while planning an intercept) are covered too.
+        ephemeris = _Ephemeris.compute(
+            target, self._location, t_ns - self._step_ns, self._span_ns, self._step_ns
+        )
+
+        # Tracking is of one target at a time, so there's no need to keep more
+        # than a handful around.
+        if len(self._ephemerides) >= 4:
+            self._ephemerides.clear()
+        self._ephemerides[id(target)] = (target, ephemeris)
+
+        return ephemeris
+
+
+def _predict_pos_raw(ctx: _RunContext, target: Target, t_ns: int):
+    """returns values in angle / time"""
+    bearing, dec = ctx.predictions.hadec(target, t_ns)
+
+    return bearing * u.rad, dec * u.rad  # pyright: ignore
 
 
-def _predict_pos(ctx: _RunContext, target: Target, t: Time):
-    """returns values in steps"""
-    bearing, dec = _predict_pos_raw(ctx.config, target, t)
+def _predict_pos(ctx: _RunContext, target: Target, t_ns: int):
+    """returns values in (fractional) steps"""
+    bearing, dec = _predict_pos_raw(ctx, target, t_ns)
 
     return (
-        _angle_to_steps(ctx.config.bearing_axis, bearing),
-        _angle_to_steps(ctx.config.declination_axis, dec),
+        _angle_to_fractional_steps(ctx.config.bearing_axis, bearing),
+        _angle_to_fractional_steps(ctx.config.declination_axis, dec),
     )
 
 
-def _predict_vel(
-    ctx: _RunContext, target: Target, t: Time, predict_dt: u.Quantity["time"]
-):
+def _predict_vel(ctx: _RunContext, target: Target, t_ns: int, predict_dt_ns: int):
     """returns values in steps / s"""
-    t0 = t
-    t1 = t + predict_dt
-
-    tgt_bearing_t0, tgt_dec_t0 = _predict_pos_raw(ctx.config, target, t0)
-    tgt_bearing_t1, tgt_dec_t1 = _predict_pos_raw(ctx.config, target, t1)
+    tgt_bearing_t0, tgt_dec_t0 = _predict_pos_raw(ctx, target, t_ns)
+    tgt_bearing_t1, tgt_dec_t1 = _predict_pos_raw(ctx, target, t_ns + predict_dt_ns)
 
-    ha_vel = (tgt_bearing_t1 - tgt_bearing_t0) / predict_dt.to(u.s).value
-    dec_vel = (tgt_dec_t1 - tgt_dec_t0) / predict_dt.to(u.s).value
+    predict_dt = predict_dt_ns / 1_000_000_000
+    ha_vel = (tgt_bearing_t1 - tgt_bearing_t0) / predict_dt
+    dec_vel = (tgt_dec_t1 - tgt_dec_t0) / predict_dt
 
     bearing_vel_steps = (
         ha_vel.to(u.rad) / _angle_per_step(ctx.config.bearing_axis).to(u.rad)
@@ -692,7 +1294,11 @@ def _angle_per_step(axis: StepperAxis) -> u.Quantity["angle"]:
 
 
 def _angle_to_steps(axis: StepperAxis, a: u.Quantity["angle"]) -> int:
-    return round(a.to(u.rad).value / _angle_per_step(axis).to(u.rad).value)
+    return round(_angle_to_fractional_steps(axis, a))
+
+
+def _angle_to_fractional_steps(axis: StepperAxis, a: u.Quantity["angle"]) -> float:
+    return a.to(u.rad).value / _angle_per_step(axis).to(u.rad).value
 
 
 def _steps_to_angle(axis: StepperAxis, steps: int) -> u.Quantity["angle"]:
@@ -721,27 +1327,32 @@ def _run_stop(activity: _TelescopeActivity) -> StateFn:
 
 
 def _publish_state(ctx: _RunContext, conn: mpc.Connection):
-    prev_bearing_steps = None
-    prev_dec_steps = None
     prev_target = None
+    target_id = 0
 
-    cfg = ctx.config
-
-    while not ctx.stop.wait(cfg.publish_interval):
+    while not ctx.stop.wait(ctx.config.publish_interval):
         with ctx.cond:
             target = ctx.target
-            bearing_steps = ctx.bearing_steps
-            dec_steps = ctx.dec_steps
-
-        if bearing_steps != prev_bearing_steps or dec_steps != prev_dec_steps:
-            prev_bearing_steps = bearing_steps
-            prev_dec_steps = dec_steps
+            offsets = ctx.bearing_offset, ctx.dec_offset
+        bearing = ctx.bearing_motor.state()
+        dec = ctx.dec_motor.state()
+        bearing_stats = ctx.bearing_motor.timing_stats()
+        dec_stats = ctx.dec_motor.timing_stats()
 
-            orientation = (
-                _steps_to_angle(cfg.bearing_axis, bearing_steps),
-                _steps_to_angle(cfg.declination_axis, dec_steps),
-            )
-            conn.send(_PublishOrientation(orientation))
         if target is not prev_target:
             prev_target = target
-            conn.send(_PublishTarget(target))
+            if target is not None:
+                target_id += 1
+            with ctx.send_lock:
+                conn.send(_PublishTarget(target))
+
+        ctx.state.write(
+            True,
+            bearing.position + offsets[0],
+            dec.position + offsets[1],
+            bearing.velocity,
+            dec.velocity,
+            target_id if target is not None else 0,
+            *astuple(bearing_stats),
+            *astuple(dec_stats),
+        )
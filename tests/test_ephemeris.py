@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+import pytest
+
+from src.ephemeris import ChebyshevEphemeris, EphemerisFile, cached_fit
+
+START_NS = 1_614_567_600 * 1_000_000_000
+HOUR_NS = 3_600_000_000_000
+SPAN_NS = 12 * HOUR_NS
+ROW_S = 120
+# Linear interpolation between rows (rather than the fit) is out by up to ~1e-7
+# rad, and ~1e-9 rad/s, for this track.
+TOLERANCE = 2e-7  # radians
+RATE_TOLERANCE = 2e-9  # radians/s
+
+# A made up, smoothly moving target, crossing RA 0 part way through.
+RA_0 = math.radians(359.0)
+RA_RATE = math.radians(4.0) / 86_400  # radians/s
+DEC_0 = math.radians(20.0)
+DEC_AMPLITUDE = math.radians(0.5)
+DEC_OMEGA = 2 * math.pi / 86_400  # radians/s
+
+
+def _track(t_ns):
+    t = (np.asarray(t_ns) - START_NS) / 1e9
+    ra = (RA_0 + RA_RATE * t) % (2 * math.pi)
+    dec = DEC_0 + DEC_AMPLITUDE * np.sin(DEC_OMEGA * t)
+    return ra, dec
+
+
+def _rates(t_ns):
+    t = (np.asarray(t_ns) - START_NS) / 1e9
+    return np.full(t.shape, RA_RATE), DEC_AMPLITUDE * DEC_OMEGA * np.cos(DEC_OMEGA * t)
+
+
+@pytest.fixture
+def ephemeris_file(tmp_path):
+    t_ns = START_NS + np.arange(0, SPAN_NS // 1_000_000_000 + 1, ROW_S) * 1_000_000_000
+    ra, dec = _track(t_ns)
+    path = tmp_path / "ephemeris.csv"
+    with open(path, "w") as f:
+        f.write("name,unix_s,ra_deg,dec_deg\n")
+        for row in zip(t_ns, np.degrees(ra), np.degrees(dec)):
+            f.write("Test Comet,%d,%.10f,%.10f\n" % (row[0] // 1_000_000_000, *row[1:]))
+    return EphemerisFile(str(path))
+
+
+def test_fit_reproduces_track(ephemeris_file):
+    sample = ephemeris_file.sampler("test comet")
+    ephemeris = ChebyshevEphemeris.fit(sample, START_NS, HOUR_NS, 12)
+
+    assert ephemeris.covers(START_NS) and ephemeris.covers(START_NS + SPAN_NS)
+    t_ns = START_NS + np.linspace(0, SPAN_NS, 997).astype(np.int64)
+    ra, dec, ra_rate, dec_rate = ephemeris.evaluate(t_ns)
+    expected_ra, expected_dec = _track(t_ns)
+    expected_ra_rate, expected_dec_rate = _rates(t_ns)
+
+    assert ((0 <= ra) & (ra < 2 * math.pi)).all()
+    ra_error = (ra - expected_ra + math.pi) % (2 * math.pi) - math.pi
+    assert np.abs(ra_error).max() < TOLERANCE
+    assert np.abs(dec - expected_dec).max() < TOLERANCE
+    assert np.abs(ra_rate - expected_ra_rate).max() < RATE_TOLERANCE
+    assert np.abs(dec_rate - expected_dec_rate).max() < RATE_TOLERANCE
+
+    # (Scalars too)
+    t = int(t_ns[500])
+    assert ephemeris.evaluate(t) == pytest.approx(
+        tuple(float(v[500]) for v in (ra, dec, ra_rate, dec_rate))
+    )
+
+
+def test_sampler_only_covers_the_file(ephemeris_file):
+    sample = ephemeris_file.sampler("Test Comet")
+    with pytest.raises(ValueError):
+        sample(np.array([START_NS - HOUR_NS, START_NS]))
+    with pytest.raises(KeyError):
+        ephemeris_file.sampler("Not A Comet")
+
+
+def test_cached_fit_round_trips(tmp_path, ephemeris_file):
+    cache_dir = str(tmp_path / "cache")
+    sample = ephemeris_file.sampler("test comet")
+    fitted = cached_fit(cache_dir, "Test Comet/2024", sample, START_NS, HOUR_NS, 12)
+
+    def unused(t_ns):
+        raise AssertionError("should have come from the cache")
+
+    cached = cached_fit(cache_dir, "Test Comet/2024", unused, START_NS, HOUR_NS, 12)
+
+    assert (cached.start_ns, cached.segment_ns) == (START_NS, HOUR_NS)
+    np.testing.assert_array_equal(cached.ra, fitted.ra)
+    np.testing.assert_array_equal(cached.dec, fitted.dec)
+    # (Each night has its own file.)
+    with pytest.raises(AssertionError):
+        cached_fit(cache_dir, "Test Comet/2024", unused, START_NS + 1, HOUR_NS, 12)
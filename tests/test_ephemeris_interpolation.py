@@ -0,0 +1,52 @@
+import math
+import time
+
+import astropy.units as u
+from astropy.coordinates import EarthLocation, SkyCoord
+
+from src.sidereal import FixedHADec
+from src.telescope_control import FixedTarget, _Ephemeris
+
+LOCATION = EarthLocation(lat=45 * u.deg, lon=-75 * u.deg, height=100 * u.m)
+STEP_NS = 10_000_000_000
+SPAN_NS = 600_000_000_000
+# FixedHADec agrees with astropy to well under this, and a sample off by one
+# step is ~150" out in hour angle.
+TOLERANCE = math.radians(2 / 3600)
+
+
+def _wrap(a: float):
+    return (a + math.pi) % (2 * math.pi) - math.pi
+
+
+def test_hadec_at_boundaries_matches_fixed_hadec():
+    coord = SkyCoord(ra=279.2347 * u.deg, dec=38.7837 * u.deg)
+    start_ns = time.time_ns()
+    ephemeris = _Ephemeris.compute(
+        FixedTarget(coord), LOCATION, start_ns, SPAN_NS, STEP_NS
+    )
+    fixed = FixedHADec(LOCATION)
+
+    for t_ns in [
+        ephemeris.start_ns,
+        ephemeris.start_ns + SPAN_NS // 2 + STEP_NS // 3,
+        ephemeris.end_ns,
+    ]:
+        ha, dec = ephemeris.hadec(t_ns)
+        expected_ha, expected_dec = fixed.hadec(coord, t_ns)
+        assert abs(_wrap(ha - float(expected_ha))) < TOLERANCE, t_ns - start_ns
+        assert abs(dec - float(expected_dec)) < TOLERANCE, t_ns - start_ns
+
+
+def test_hadec_is_continuous_at_end():
+    coord = SkyCoord(ra=10 * u.deg, dec=-20 * u.deg)
+    ephemeris = _Ephemeris.compute(
+        FixedTarget(coord), LOCATION, time.time_ns(), SPAN_NS, STEP_NS
+    )
+
+    before, _ = ephemeris.hadec(ephemeris.end_ns - 1_000_000)
+    at, _ = ephemeris.hadec(ephemeris.end_ns)
+    after, _ = ephemeris.hadec(ephemeris.end_ns + 1_000_000)
+    # Sidereal rate is ~7e-5 rad/s, so 1 ms moves it ~7e-8 rad.
+    assert abs(_wrap(at - before)) < 1e-6
+    assert abs(_wrap(after - at)) < 1e-6
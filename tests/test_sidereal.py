@@ -0,0 +1,50 @@
+import math
+
+import astropy.units as u
+from astropy.coordinates import EarthLocation, HADec, SkyCoord
+from astropy.time import Time
+import pytest
+
+from src.sidereal import FixedHADec
+
+LOCATION = EarthLocation(lat=45 * u.deg, lon=-75 * u.deg, height=100 * u.m)
+# (Within the IERS tables astropy ships with, so that both sides use the same
+# UT1.)
+START_NS = int(Time("2021-03-01T03:00:00", scale="utc").unix) * 1_000_000_000
+REFRESH_NS = 60_000_000_000
+TOLERANCE = math.radians(1 / 3600)
+
+
+def _wrap(a: float):
+    return (a + math.pi) % (2 * math.pi) - math.pi
+
+
+@pytest.mark.parametrize(
+    "coord",
+    [
+        SkyCoord(ra=279.2347 * u.deg, dec=38.7837 * u.deg),  # Vega
+        SkyCoord(ra=10.6847 * u.deg, dec=41.2690 * u.deg),  # M31
+        SkyCoord(ra=88.7929 * u.deg, dec=7.4071 * u.deg),  # Betelgeuse
+        SkyCoord(ra=37.9546 * u.deg, dec=89.2641 * u.deg),  # Polaris
+    ],
+)
+def test_matches_astropy_hadec(coord):
+    fixed = FixedHADec(LOCATION, refresh_ns=REFRESH_NS)
+
+    refreshes = set()
+    # Up to (and just past) a refresh, then well after it.
+    for dt_s in [0, 30, 59, 61, 3_600, 6 * 3_600]:
+        t_ns = START_NS + dt_s * 1_000_000_000
+        ha, dec = fixed.hadec(coord, t_ns)
+        refreshes.add(fixed._terms.t_ns)
+
+        expected = coord.transform_to(
+            HADec(obstime=Time(t_ns / 1e9, format="unix"), location=LOCATION)
+        )
+        # On the sky: near the pole, hour angle errors are magnified.
+        error = math.hypot(
+            _wrap(ha - expected.ha.rad) * math.cos(dec), dec - expected.dec.rad
+        )
+        assert error < TOLERANCE, dt_s
+
+    assert len(refreshes) == 4
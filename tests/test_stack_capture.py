@@ -0,0 +1,38 @@
+import pytest
+import trio
+
+from src.gphoto2.gphoto import FAKE_CAMERA_COMMAND, GPhoto
+from src.gphoto2.session import ShellSession
+from src.gphoto2.stack import CaptureSession, StackCapture, StackSettings
+
+EXPOSURE_S = 0.5
+DOWNLOAD_S = 1.5
+# For the camera round trips either side of the exposure
+TOLERANCE_MS = 150
+
+
+@pytest.mark.parametrize("imageformat", ["7", "6"])  # RAW, RAW + JPEG
+def test_downloads_dont_stretch_short_exposures(tmp_path, imageformat):
+    session = ShellSession(
+        [*FAKE_CAMERA_COMMAND, "--download-seconds", str(DOWNLOAD_S)]
+    )
+    camera = GPhoto(session)
+    capture = CaptureSession.create(
+        StackSettings(
+            frames=3,
+            exposure=EXPOSURE_S,
+            imageformat=imageformat,
+            directory=str(tmp_path),
+        )
+    )
+    try:
+        trio.run(StackCapture(camera, capture).run)
+    finally:
+        session.close()
+
+    status = capture.status()
+    assert status["state"] == "finished"
+    assert status["errors"] == 0
+    assert status["pending_downloads"] == 0
+    for frame in status["frame_list"]:
+        assert abs(frame["exposure_ms"] - EXPOSURE_S * 1000) < TOLERANCE_MS, frame
@@ -0,0 +1,230 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.activity import ActivityStatus
+from src.lib.pulse import SimulatedPulseBackend
+from src.motion import velocity_trapz
+from src.stepper import (
+    Stepper,
+    StepperConfig,
+    _chunk_bounds,
+    _with_nops,
+    compute_intercept,
+    hand_off,
+)
+
+MAX_ACCEL = 5000.0
+
+
+class _RecordingBackend(SimulatedPulseBackend):
+    """Also keeps each submitted batch, as submitted"""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def submit(self, deadlines, dirs, /):
+        self.batches.append((deadlines.copy(), dirs.copy()))
+        super().submit(deadlines, dirs)
+
+
+def _config(pulse, **kwargs):
+    return StepperConfig(
+        min_sleep_ns=50_000,
+        max_speed=2000,
+        max_accel=MAX_ACCEL,
+        max_decel=MAX_ACCEL,
+        pulse=pulse,
+        **kwargs,
+    )
+
+
+def _steps(backend: SimulatedPulseBackend):
+    """Net steps the backend has been asked for"""
+    edges = backend.edges()
+    return int(edges["dir"][edges["level"] == 1].sum())
+
+
+def _wait(*activities):
+    for activity in activities:
+        assert activity.wait_for(ActivityStatus.done, timeout=10)
+
+
+@pytest.fixture
+def backend():
+    return _RecordingBackend()
+
+
+@pytest.fixture
+def stepper(backend):
+    stepper = Stepper(_config(backend))
+    stepper.start()
+    yield stepper
+    stepper.stop(timeout=10)
+
+
+def test_with_nops_bounds_gaps():
+    deadlines = np.array([100, 1_000, 1_000_000, 1_100_000], dtype=np.int64)
+    merged, step_idx = _with_nops(0, deadlines, 250_000)
+
+    assert (merged[step_idx] == deadlines).all()
+    assert (np.diff(merged) > 0).all()
+    assert np.diff(merged, prepend=0).max() <= 250_000
+    # (1_000 to 1_000_000 needs 3 NOPs in between.)
+    assert len(merged) == len(deadlines) + 3
+
+
+def test_with_nops_passes_short_gaps_through():
+    deadlines = np.array([10, 20, 30], dtype=np.int64)
+    merged, step_idx = _with_nops(0, deadlines, 250_000)
+
+    assert merged is deadlines
+    assert step_idx.tolist() == [0, 1, 2]
+
+
+def test_chunk_bounds():
+    config = _config(SimulatedPulseBackend(), chunk_steps=4, chunk_ns=1_000)
+    deadlines = np.array([0, 10, 20, 30, 40, 50, 2_000, 2_500, 5_000])
+
+    bounds = list(_chunk_bounds(config, deadlines))
+
+    assert bounds == [(0, 4), (4, 6), (6, 8), (8, 9)]
+
+
+@pytest.mark.parametrize(
+    "position, velocity, target, target_velocity",
+    [
+        (0, 0, 100, 0),
+        (0, 0, -100, 0),
+        # Heading away from the target
+        (0, -500, 100, 0),
+        # Heading toward it too fast to stop short: overshoot and come back
+        (0, 1000, 10, 0),
+        # Moving target
+        (0, 0, 100, 50),
+    ],
+)
+def test_compute_intercept_signs(position, velocity, target, target_velocity):
+    config = _config(SimulatedPulseBackend())
+    params = compute_intercept(
+        config, position, velocity, target, target_velocity, target_velocity
+    )
+
+    assert params.p_f == pytest.approx(target + params.t * target_velocity)
+    assert params.delta == pytest.approx(params.p_f - position)
+    # Accelerate toward v_c, then toward v_f.
+    assert (params.v_c - velocity) * params.a_in >= 0
+    assert (params.v_f - params.v_c) * params.a_out >= 0
+    assert abs(params.a_in) == abs(params.a_out) == MAX_ACCEL
+    if velocity * params.delta > 0 and velocity**2 / (2 * MAX_ACCEL) > abs(
+        params.delta
+    ):
+        assert params.v_c * params.delta < 0
+
+    # The profile covers delta in t.
+    t_in = (params.v_c - velocity) / params.a_in
+    t_out = (params.v_f - params.v_c) / params.a_out
+    t_c = params.t - t_in - t_out
+    assert t_c >= -1e-9
+    travel = (
+        (params.v_c**2 - velocity**2) / (2 * params.a_in)
+        + params.v_c * t_c
+        + (params.v_f**2 - params.v_c**2) / (2 * params.a_out)
+    )
+    assert travel == pytest.approx(params.delta)
+
+
+def test_fractional_steps_carry_across_activities(stepper, backend):
+    start_ns = time.monotonic_ns() + 100_000_000
+    activities = [stepper.run_constant(0, start_ns)]
+    # 5.5 steps each: rounding each activity on its own would lose (or gain)
+    # half a step every time.
+    for k in range(1, 11):
+        activities.append(stepper.run_constant(110, start_ns + k * 50_000_000))
+    activities.append(stepper.run_constant(0, start_ns + 600_000_000))
+    _wait(*activities)
+
+    assert stepper.position == 55
+    assert _steps(backend) == 55
+
+
+def test_intercept_lands_on_target_after_fractional_run(stepper, backend):
+    end_ns = time.monotonic_ns() + 250_000_000
+    # 27.5 steps, finishing mid-step and still moving
+    _wait(stepper.run_constant(110, end_ns), stepper.goto(100))
+
+    assert stepper.position == 100
+    assert _steps(backend) == 100
+    assert stepper.state().velocity == pytest.approx(0, abs=1e-3)
+
+
+def test_deadlines_in_order(stepper, backend):
+    _wait(stepper.goto(300), stepper.goto(-200))
+
+    previous = None
+    for deadlines, dirs in backend.batches:
+        assert (np.diff(deadlines) > 0).all()
+        assert (dirs != 0).all()
+        if previous is not None:
+            assert deadlines[0] > previous
+        previous = deadlines[-1]
+    assert stepper.position == -200
+
+
+def test_state_follows_planned_profile(stepper, backend):
+    config = stepper.config
+    params = compute_intercept(config, 0, 0, 400, 0, 0)
+    start_ns = time.monotonic_ns() + 50_000_000
+    activity = stepper.intercept_precomputed(params, start_ns)
+
+    def planned(t_ns):
+        t = np.array([(t_ns - start_ns) / 1e9])
+        return float(
+            velocity_trapz(
+                t,
+                0,
+                params.v_f,
+                params.v_c,
+                params.a_in,
+                params.a_out,
+                params.delta,
+            )[0]
+        )
+
+    # Within a step interval's worth of acceleration (from piecewise linear
+    # interpolation around the corners), once the first step has set a
+    # velocity to start from.
+    tolerance = 0.01 * abs(params.v_c) + MAX_ACCEL * 0.002
+    first_ns = start_ns + round((1 / MAX_ACCEL) ** 0.5 * 1e9)
+    end_ns = start_ns + round(params.t * 1e9)
+    samples = 0
+    while not activity.wait_for(ActivityStatus.done, timeout=0.005):
+        state = stepper.state()
+        if first_ns < state.t_ns < end_ns:
+            assert state.velocity == pytest.approx(planned(state.t_ns), abs=tolerance)
+            samples += 1
+
+    assert samples > 20
+    assert stepper.position == 400
+    assert stepper.state().velocity == pytest.approx(0, abs=1e-3)
+
+
+def test_hand_off_keeps_moving(stepper, backend):
+    velocity = 400
+    now = time.monotonic_ns()
+    first = stepper.run_constant(velocity, now + 10_000_000_000)
+    time.sleep(0.2)
+    # (Well beyond what the first will have planned ahead.)
+    second = stepper.run_constant(velocity, now + 1_000_000_000)
+    hand_off(first)
+    _wait(first, second)
+
+    assert first.wait_for(lambda s: s) == ActivityStatus.ABORTED
+    rising = backend.edges()
+    rising = rising["t_ns"][rising["level"] == 1]
+    # No stop (or gap) between the two.
+    interval = 1e9 / velocity
+    assert np.diff(rising).max() < 1.01 * interval
+    assert stepper.position == pytest.approx(velocity, abs=2)